@@ -1,40 +1,90 @@
-from utils.cycles import save_available_cycles, load_available_cycles
+from utils.cycles import save_available_cycles, load_available_cycles, load_cycle_cache, CycleCache
 from utils.amount import compute_amount_in
 
-from amm.engine import find_transactions
-from amm import AMM
+from amm.engine import find_all_transactions, find_negative_cycles, select_disjoint, configure_route_cache
+from amm.parallel import ParallelSearch
+from amm import AMM, CycleMatrix, Transaction, Pool
+
+from utils.async_fetcher import AsyncFetcher
+from utils.fetcher import latest_block_height
+from utils.recorder import configure_recorder
+from utils.replay import iter_snapshots, replay_trace_path, ReplayReport
+from utils.pipeline import Pipeline
+from utils.blocks import make_block_scheduler
+from utils.sequence import SequenceManager
+from utils.gas import GasModel, route_shape, OUT_OF_GAS
+from utils.metrics import get_metrics, serve_metrics, StepProfiler
+from utils.tracing import Snapshot, Trace, Tracer, read_traces, summarize, trace_log_path
+
+from anyplatform.benchmark import run as run_benchmark
 
 from osmosis.query import make_model as os_make_model
+from osmosis.query import async_make_model as os_async_make_model
+from osmosis.query import make_model_from_snapshot as os_make_model_from_snapshot
+from osmosis.query import fetch_pools as os_fetch_pools
+from osmosis.query import async_fetch_pools as os_async_fetch_pools
+from osmosis.query import pools_from_snapshot as os_pools_from_snapshot
 from osmosis.execute import build_swap_command as os_build_swap_command
 from osmosis.execute import send_cmd as os_send_cmd
 from osmosis.execute import get_account_sequence as os_get_account_sequence
+from osmosis.execute import async_get_account_sequence as os_async_get_account_sequence
+from osmosis.execute import get_tx_result as os_get_tx_result
+from osmosis.tx import TxClient as os_TxClient
 
 from terraswap.query import make_model as ts_make_model
+from terraswap.query import async_make_model as ts_async_make_model
+from terraswap.query import make_model_from_snapshot as ts_make_model_from_snapshot
+from terraswap.query import fetch_pools as ts_fetch_pools
+from terraswap.query import async_fetch_pools as ts_async_fetch_pools
+from terraswap.query import pools_from_snapshot as ts_pools_from_snapshot
 from terraswap.execute import build_swap_command as ts_build_swap_command
 from terraswap.execute import send_cmd as ts_send_cmd
 from terraswap.execute import get_account_sequence as ts_get_account_sequence
+from terraswap.execute import async_get_account_sequence as ts_async_get_account_sequence
 
 from astroport.query import make_model as as_make_model
+from astroport.query import async_make_model as as_async_make_model
+from astroport.query import make_model_from_snapshot as as_make_model_from_snapshot
+from astroport.query import fetch_pools as as_fetch_pools
+from astroport.query import async_fetch_pools as as_async_fetch_pools
+from astroport.query import pools_from_snapshot as as_pools_from_snapshot
 from astroport.execute import build_swap_command as as_build_swap_command
 from astroport.execute import send_cmd as as_send_cmd
 from astroport.execute import get_account_sequence as as_get_account_sequence
+from astroport.execute import async_get_account_sequence as as_async_get_account_sequence
 
 import pathlib
 import yaml
-from typing import List, Dict
+from typing import List, Dict, Optional, Sequence, Callable, Union, Set, Tuple
 from loguru import logger
 import sys
-import multiprocessing as mp
-from functools import partial
 import itertools
+import hashlib
+import threading
 import requests
 import time
+import numpy as np
+import asyncio
+import argparse
 
 models = {"osmosis": os_make_model, "terraswap": ts_make_model, "astroport": as_make_model}
 commands = {"osmosis": os_build_swap_command, "terraswap": ts_build_swap_command, "astroport": as_build_swap_command}
 senders = {"osmosis": os_send_cmd, "terraswap": ts_send_cmd, "astroport": as_send_cmd}
 sequences = {"osmosis": os_get_account_sequence, "terraswap": ts_get_account_sequence,
              "astroport": as_get_account_sequence}
+async_models = {"osmosis": os_async_make_model, "terraswap": ts_async_make_model, "astroport": as_async_make_model}
+async_sequences = {"osmosis": os_async_get_account_sequence, "terraswap": ts_async_get_account_sequence,
+                   "astroport": as_async_get_account_sequence}
+tx_clients = {"osmosis": os_TxClient}
+tx_results = {"osmosis": os_get_tx_result}
+snapshot_models = {"osmosis": os_make_model_from_snapshot, "terraswap": ts_make_model_from_snapshot,
+                   "astroport": as_make_model_from_snapshot}
+# Parsed pools only, for the incremental search which refreshes its model in place
+pool_fetchers = {"osmosis": os_fetch_pools, "terraswap": ts_fetch_pools, "astroport": as_fetch_pools}
+async_pool_fetchers = {"osmosis": os_async_fetch_pools, "terraswap": ts_async_fetch_pools,
+                       "astroport": as_async_fetch_pools}
+snapshot_pools = {"osmosis": os_pools_from_snapshot, "terraswap": ts_pools_from_snapshot,
+                  "astroport": as_pools_from_snapshot}
 
 logger.remove()
 logger.add(sys.stdout, format="<green>{time:YYYY-MM-DD at HH:mm:ss.SSS}</green> {level}  <level>{message}</level>",
@@ -45,9 +95,11 @@ class App:
     amm: AMM
     base_path: str
     config: dict
-    cycles: List[List[str]]
+    cycles: Sequence[List[str]]
+    cycle_matrix: CycleMatrix
     starters: Dict[str, Dict[str, float]]
-    previous_sequence: int
+    previous_sequence: Optional[int]
+    cycle_transactions: Optional[Dict[int, List[Transaction]]]
 
     def __init__(self, platform="osmosis") -> None:
         self.base_path = str(pathlib.Path(__file__).parent.resolve())
@@ -60,77 +112,692 @@ class App:
 
         self.platform = platform
 
-        make_model = models.get(platform)
+        configure_recorder(record_history=self.config.get('record_snapshots', False),
+                           max_queue=self.config.get('snapshot_queue_size', 64))
 
-        self.amm = make_model(
+        self.amm = self.make_model(
             regenerate=self.config['regenerate_denom2symbol'])
 
-        if self.config['regenerate_cycles']:
-            self.cycles = save_available_cycles(platform, amm=self.amm, priorities=list(self.starters.keys()))
+        self.search_mode = self.config.get('search_mode', 'cycles')
+        # The model is refreshed in place from the fetched pools instead of being rebuilt every step
+        self.incremental = self.search_mode not in ('negative_cycles', 'parallel') and \
+            self.config.get('incremental', False)
+        self.negative_cycles = []  # cycles of the previous negative cycles search, checked first
+
+        if self.search_mode == 'negative_cycles':
+            self.cycles = []
+        elif self.config.get('cycle_cache', False):
+            self.cycles = load_cycle_cache(platform, amm=self.amm, priorities=list(self.starters.keys()),
+                                           max_hops=self.config.get('max_cycle_length'),
+                                           skip_reversed=self.config.get('skip_reversed_cycles', False))
+        elif self.config['regenerate_cycles']:
+            self.cycles = save_available_cycles(platform, amm=self.amm, priorities=list(self.starters.keys()),
+                                                max_hops=self.config.get('max_cycle_length'),
+                                                skip_reversed=self.config.get('skip_reversed_cycles', False))
         else:
             self.cycles = load_available_cycles(platform)
 
-        self.previous_sequence = 0
+        if isinstance(self.cycles, CycleCache):
+            self.cycle_matrix = CycleMatrix.from_cache(self.cycles)
+        else:
+            self.cycle_matrix = CycleMatrix(self.cycles)
+
+        # Profit that a cycle must be able to make to be searched, in units of its first asset
+        prices = self.cycle_matrix.start_prices(self.starters)
+        with np.errstate(divide='ignore'):
+            self.minimum_profits = np.where(prices > 0, self.config['minimum_dollars_delta'] / prices, 0.)
+
+        # Route optima are reused while the reserves of their pools do not change
+        configure_route_cache(self.config.get('route_cache_size', 100000))
+
+        # Persistent worker pool searching shards of the cycles
+        self.parallel_search = None
+        if self.search_mode == 'parallel':
+            self.parallel_search = ParallelSearch(self.cycle_matrix, starters=self.starters,
+                                                  processes=self.config.get('search_processes') or None,
+                                                  top_k=self.config.get('search_top_k', 16),
+                                                  route_cache_size=self.config.get('route_cache_size', 100000))
+
+        self.previous_sequence = None  # sequence of the last transaction sent
+        self.last_opportunities = 0
+        self.in_flight: Dict[str, Tuple[float, Set[str]]] = {}  # txhash --> (time.monotonic() sent, pool ids)
+
+        # Async fetch layer : one event loop and one pooled session for the whole run
+        self.fetcher = None
+        if self.config.get('async_fetch', False):
+            self.loop = asyncio.new_event_loop()
+            self.fetcher = AsyncFetcher(limit_per_host=self.config.get('max_connections_per_host', 8))
+
+        self.cycle_transactions = None  # cycle index --> transactions, for the incremental search
+
+        # Account sequence tracked locally instead of fetched at every step
+        self.sequence_manager = None
+        if self.config.get('local_sequence', False):
+            self.sequence_manager = SequenceManager(self.get_account_sequence,
+                                                    resync_interval=self.config.get('sequence_resync_interval', 60))
+
+        # Transactions signed and broadcast in process, the CLI command stays the fallback
+        self.tx_client = self.make_tx_client()
+
+        # Gas limits and fees learned from the past transactions
+        self.gas_model = None
+        if self.config.get('gas_model', False):
+            gas_limit = self.config.get('gas_limit', 400000)
+            self.gas_model = GasModel(f"{self.base_path}/input_data/dynamic/{platform}/gas_model.json",
+                                      default_gas=gas_limit, gas_price=self.config['fees'] / gas_limit,
+                                      min_gas_price=self.config.get('min_gas_price', 0.0025),
+                                      margin=self.config.get('gas_margin', 1.2))
+
+        # Steps start on new blocks instead of polling as fast as fetches return
+        self.scheduler = None
+        if self.config.get('block_events', False):
+            self.scheduler = make_block_scheduler(self.config['rpc_url'],
+                                                  max_poll_interval=self.config.get('max_poll_interval', 1.))
+
+        # Latency of every stage of the steps, served for Prometheus when metrics_port is set
+        self.metrics = get_metrics()
+        if self.config.get('metrics_port', 0):
+            serve_metrics(self.metrics, self.config['metrics_port'])
+
+        # One step out of profile_every is run under cProfile
+        self.profiler = None
+        if self.config.get('profile_every', 0):
+            self.profiler = StepProfiler(self.config['profile_every'])
+
+        # Every opportunity sent is traced from the snapshot it was found in to its inclusion
+        self.snapshot = None  # origin of the latest fetched model
+        self.tracer = None
+        if self.config.get('trace_opportunities', False):
+            self.tracer = Tracer(self.trace_path())
+
+    def make_model(self, regenerate: bool) -> AMM:
+        make_model = models.get(self.platform)
+        return make_model(regenerate=regenerate)
+
+    def fetch_pools(self, regenerate: bool) -> List[Pool]:
+        fetch_pools = pool_fetchers.get(self.platform)
+        return fetch_pools(regenerate=regenerate)
+
+    def make_fresh(self) -> Union[AMM, List[Pool]]:
+        """ Fresh model, only its parsed pools in incremental mode : they refresh the current model in place """
+        if self.incremental:
+            return self.fetch_pools(regenerate=False)
+        return self.make_model(regenerate=False)
+
+    async def async_make_fresh(self) -> Union[AMM, List[Pool]]:
+        """ Same as make_fresh, with the shared async fetcher """
+        if self.incremental:
+            return await async_pool_fetchers.get(self.platform)(self.fetcher, regenerate=False)
+        return await async_models.get(self.platform)(self.fetcher, regenerate=False)
+
+    def make_tx_client(self):
+        if self.config.get('tx_mode', 'cli') != 'direct' or self.platform not in tx_clients:
+            return None
+        try:
+            return tx_clients[self.platform](self.config['account'], self.config['signing_key_file'],
+                                             lcd=self.config.get('lcd_url'))
+        except Exception as e:
+            logger.warning(f'In-process transactions unavailable, falling back on the CLI : {e}')
+            return None
+
+    def trace_path(self) -> str:
+        return trace_log_path(self.platform)
+
+    def get_account_sequence(self):
+        get_account_sequence = sequences.get(self.platform)
+        return get_account_sequence(self.config['account'])
 
-    def step(self):
+    def build_swap_command(self, transaction: Transaction, amount_in: int, sequence: int, gas: Optional[int] = None,
+                           fees: Optional[int] = None) -> Union[str, bytes]:
         """
-        One step equals fetching, processing, and sending transaction if needed
+        Signed transaction bytes when transactions are made in process, CLI command otherwise
+        :param gas: gas limit, simulated by the CLI (or gas_limit in process) when None
+        :param fees: config fees when None
         """
-        logger.debug('Starting a new step')
+        if fees is None:
+            fees = self.config['fees']
 
-        get_account_sequence = sequences.get(self.platform)
-        sequence = get_account_sequence(self.config['account'])
-        if sequence == self.previous_sequence:
-            logger.debug("Waiting for previous tx")
-            time.sleep(self.config['sleep_time'])
+        if self.tx_client is not None:
+            try:
+                return self.tx_client.build_swap_tx(transaction, amount_in=amount_in, sequence=sequence, fees=fees,
+                                                    gas_limit=gas or self.config.get('gas_limit', 400000))
+            except Exception as e:
+                logger.warning(f'In-process transaction could not be built, falling back on the CLI : {e}')
+
+        build_swap_command = commands.get(self.platform)
+        return build_swap_command(transaction, amount_in=amount_in, sequence=sequence, fees=fees, gas=gas)
+
+    def send_cmd(self, cmd: Union[str, bytes]):
+        if isinstance(cmd, bytes):
+            return self.tx_client.broadcast(cmd)
+
+        send_cmd = senders.get(self.platform)
+        return send_cmd(cmd)
+
+    def post_monitor(self, txhash):
+        requests.post(
+            url="http://127.0.0.1:5000/arbitrages/osmosis", data={"hash": txhash})
+
+    def in_flight_pools(self) -> Set[str]:
+        """
+        Pool ids of the transactions sent and not known to be included yet. Transactions sent more than
+        in_flight_timeout seconds ago are forgotten.
+        """
+        now = time.monotonic()
+        timeout = self.config.get('in_flight_timeout', 30)
+        for txhash, (sent, pool_ids) in list(self.in_flight.items()):
+            if now - sent > timeout:
+                self.in_flight.pop(txhash, None)
+        return set().union(*[pool_ids for _, pool_ids in list(self.in_flight.values())])
+
+    def record_result(self, txhash: str, shape: str, trace: Optional[Trace] = None):
+        """
+        Once a transaction is included, in the background : forget it from the transactions in flight, record
+        its gas used in the gas model and its status in its trace. The result is polled every tx_poll_interval
+        seconds, doubling up to tx_poll_max_interval, and the trace is finished as unknown if the transaction is
+        neither included nor rejected after tx_result_timeout seconds.
+        """
+        get_tx_result = tx_results.get(self.platform)
+        if get_tx_result is None:
             return
 
-        make_model = models.get(self.platform)
+        def record():
+            result = None
+            started = time.monotonic()
+            interval = self.config.get('tx_poll_interval', 1)
+            timeout = self.config.get('tx_result_timeout', 60)
+            while result is None:
+                time.sleep(interval)
+                try:
+                    result = get_tx_result(txhash)
+                except Exception as e:
+                    logger.debug(f'Result of {txhash} could not be fetched : {e}')
+                if result is None and time.monotonic() - started > timeout:
+                    logger.warning(f'No result for {txhash} after {timeout}s')
+                    if trace is not None:
+                        self.tracer.finished(trace, None)
+                    return
+                interval = min(2 * interval, self.config.get('tx_poll_max_interval', 8))
+
+            code, gas_used, gas_wanted, height = result
+            self.in_flight.pop(txhash, None)
+            if trace is not None:
+                self.tracer.finished(trace, code, height)
+            if self.gas_model is not None:
+                out_of_gas = code == OUT_OF_GAS
+                self.gas_model.record(shape, gas_wanted if out_of_gas else gas_used, out_of_gas=out_of_gas)
+
+        threading.Thread(target=record, name=f"result-{txhash[:8]}", daemon=True).start()
+
+    def search(self, fresh_amm: AMM) -> Tuple[List[Transaction], int]:
+        """
+        Find the transactions of every profitable cycle with the freshly fetched model
+        return :
+           - txs:            Best transactions found, at most search_top_k
+           - opportunities:  Number of profitable transactions found, before keeping the best ones
+        """
+        self.amm = fresh_amm
+
+        # Score every cycle at once, only the profitable ones are worth optimizing
+        with self.metrics.timer("cycle_scoring"):
+            indices, changes = self.cycle_matrix.profitable(self.amm, minimum_profits=self.minimum_profits)
+        self.metrics.count("cycles_scored", len(self.cycles))
+
+        with self.metrics.timer("route_optimization"):
+            return find_all_transactions(cycles=[self.cycles[n] for n in indices], changes=changes, amm=self.amm,
+                                         config=self.config, starters=self.starters,
+                                         top_k=self.config.get('search_top_k', 16))
+
+    def search_incremental(self, fresh_pools: List[Pool]) -> Tuple[List[Transaction], int]:
+        """
+        Refresh the model in place with the freshly parsed pools and only search again the cycles going through
+        pools whose state changed since the previous step. Transactions of the other cycles are kept from the
+        previous steps.
+        return :
+           - txs:            Transactions of every cycle, searched again or kept
+           - opportunities:  Number of transactions, none of them is dropped
+        """
+        touched = self.amm.refresh(fresh_pools)
+        if self.cycle_transactions is None:
+            self.cycle_transactions = {}
+            indices = np.arange(len(self.cycles))
+        else:
+            indices = self.cycle_matrix.cycles_using(touched)
+            for n in indices:
+                self.cycle_transactions.pop(n, None)
+
+        logger.debug(f'{len(indices)} cycles to search')
+
+        with self.metrics.timer("cycle_scoring"):
+            changes = self.cycle_matrix.score(self.amm)[indices]
+            positive = changes > 0
+            indices, changes = indices[positive], changes[positive]
+            if len(indices):
+                worth = self.cycle_matrix.profit_bounds(self.amm, indices) > self.minimum_profits[indices]
+                indices, changes = indices[worth], changes[worth]
+        self.metrics.count("cycles_scored", len(positive))
+
+        cycles = [self.cycles[n] for n in indices]
+        positions = {id(cycle): n for cycle, n in zip(cycles, indices)}
+
+        with self.metrics.timer("route_optimization"):
+            found, _ = find_all_transactions(cycles=cycles, changes=changes, amm=self.amm, config=self.config,
+                                             starters=self.starters)
+        for tx in found:
+            self.cycle_transactions.setdefault(positions[id(tx.cycle)], []).append(tx)
+
+        txs = [tx for txs in self.cycle_transactions.values() for tx in txs]
+        return txs, len(txs)
+
+    def search_negative_cycles(self, fresh_amm: AMM) -> Tuple[List[Transaction], int]:
+        """
+        Find profitable cycles directly in the freshly fetched model instead of scoring a precomputed list
+        return :
+           - txs:            Best transactions found, at most search_top_k
+           - opportunities:  Number of profitable transactions found, before keeping the best ones
+        """
+        self.amm = fresh_amm
+
+        with self.metrics.timer("cycle_scoring"):
+            cycles = find_negative_cycles(self.amm, sources=list(self.starters.keys()),
+                                          previous_cycles=self.negative_cycles,
+                                          max_cycles=self.config.get('max_negative_cycles'),
+                                          max_length=self.config.get('max_cycle_length'))
+            self.negative_cycles = cycles
+            changes = [self.amm.compute_cycle(cycle) for cycle in cycles]
+        logger.debug(f'{len(cycles)} profitable cycles found')
+        self.metrics.count("cycles_scored", len(cycles))
+
+        with self.metrics.timer("route_optimization"):
+            return find_all_transactions(cycles=cycles, changes=changes, amm=self.amm, config=self.config,
+                                         starters=self.starters, top_k=self.config.get('search_top_k', 16))
+
+    async def fetch_async(self):
+        """
+        Fetch the account sequence and the model concurrently
+        """
+        get_account_sequence = async_sequences.get(self.platform)
+
+        async def fetch_sequence():
+            with self.metrics.timer("sequence_fetch"):
+                return await get_account_sequence(self.fetcher, self.config['account'])
+
+        return await asyncio.gather(fetch_sequence(), self.async_make_fresh())
+
+    def fetch(self):
+        """
+        Fetch the account sequence and a fresh model
+        return :
+           - sequence:       Account sequence, None when it is tracked by the sequence manager
+           - fresh_amm:      Fresh model (its parsed pools in incremental mode), None while the previous
+                             transaction is not included
+        """
+        fetch_started = time.time()
+
+        if self.sequence_manager is not None:
+            # Sequences are handed out at submission, several transactions can be in flight
+            if self.fetcher is not None:
+                fresh_amm = self.loop.run_until_complete(self.async_make_fresh())
+            else:
+                fresh_amm = self.make_fresh()
+            logger.debug('Data fetched')
+            self.snapshot = Snapshot(self.snapshot_height(fetch_started), fetch_started, time.time())
+            return None, fresh_amm
+
+        if self.fetcher is not None:
+            sequence, fresh_amm = self.loop.run_until_complete(self.fetch_async())
+        else:
+            with self.metrics.timer("sequence_fetch"):
+                sequence = self.get_account_sequence()
+            fresh_amm = None
 
-        self.amm = make_model(regenerate=False)
+        if self.is_pending(sequence):
+            logger.debug("Waiting for previous tx")
+            # The next block is waited for by the scheduler
+            if self.scheduler is None:
+                time.sleep(self.config['sleep_time'])
+            return sequence, None
+
+        if fresh_amm is None:
+            fresh_amm = self.make_fresh()
         logger.debug('Data fetched')
+        self.snapshot = Snapshot(self.snapshot_height(fetch_started), fetch_started, time.time())
 
-        txs = []
-        for cycle in self.cycles:
-            txs += find_transactions(amm=self.amm, config=self.config, starters=self.starters, cycle=cycle)
+        return sequence, fresh_amm
 
+    def snapshot_height(self, fetch_started: float) -> Optional[int]:
+        """
+        Block height of the model fetched from fetch_started : that of the LCD responses of the fetch, else the
+        latest block seen by the block scheduler. None when neither is known
+        """
+        height = latest_block_height(since=fetch_started)
+        if height is None and self.scheduler is not None and self.scheduler.clock.height > 0:
+            height = self.scheduler.clock.height
+        return height
+
+    def is_pending(self, sequence) -> bool:
+        """ Whether the account sequence shows that the last transaction sent is not included yet """
+        if self.previous_sequence is None:
+            return False
+        try:
+            return int(sequence) <= int(self.previous_sequence)
+        except (TypeError, ValueError):
+            return sequence == self.previous_sequence
+
+    def find(self, fresh_amm: Union[AMM, List[Pool]]) -> List[Transaction]:
+        """
+        Search the fresh model (its parsed pools in incremental mode) with the configured search mode. The number
+        of profitable opportunities found, before only keeping the best ones, is kept in last_opportunities.
+        """
+        if self.search_mode == 'negative_cycles':
+            txs, opportunities = self.search_negative_cycles(fresh_amm)
+        elif self.search_mode == 'parallel':
+            self.amm = fresh_amm
+            with self.metrics.timer("route_optimization"):
+                txs, opportunities = self.parallel_search.search(self.amm, config=self.config)
+            self.metrics.count("cycles_scored", len(self.cycles))
+        elif self.incremental:
+            txs, opportunities = self.search_incremental(fresh_amm)
+        else:
+            txs, opportunities = self.search(fresh_amm)
+
+        self.last_opportunities = opportunities
+        self.metrics.count("opportunities", opportunities)
+        return txs
+
+    def submit(self, txs: List[Transaction], sequence: int, snapshot: Optional[Snapshot] = None):
+        """
+        Send the most profitable transactions that have no pool in common (up to max_transactions_per_step),
+        with consecutive sequences, if transactions are enabled
+        :param snapshot: origin of the model the transactions were found in, the latest fetched one when None
+        """
         if len(txs) == 0:
             logger.debug('No transaction found')
             return
 
-        best_transaction = max(txs)
-        logger.debug(f'A transaction was found : {best_transaction}')
+        # Transactions on the pools of a transaction in flight would revert once it is included
+        selected = select_disjoint(txs, max_count=self.config.get('max_transactions_per_step', 1),
+                                   excluded=self.in_flight_pools())
+        for n, transaction in enumerate(selected):
+            # Consecutive sequences, the sequence manager hands them out itself
+            if n > 0 and sequence is not None:
+                sequence = int(sequence) + 1
+            txhash = self.submit_transaction(transaction, sequence, snapshot)
+            # The following sequences would be rejected
+            if self.config["do_transactions"] and txhash is None:
+                break
+
+    def submit_transaction(self, transaction: Transaction, sequence: int,
+                           snapshot: Optional[Snapshot] = None) -> Optional[str]:
+        """
+        Build the command of a transaction and send it if transactions are enabled
+        :param sequence: ignored when the sequence is tracked by the sequence manager
+        return :
+           - txhash:         None if the transaction was not sent or failed
+        """
+        logger.debug(f'A transaction was found : {transaction}')
 
-        amount_in = compute_amount_in(best_transaction, starters=self.starters)
+        trace = None
+        if self.tracer is not None:
+            trace = self.tracer.start(snapshot or self.snapshot, transaction)
+            self.metrics.observe("decision_latency", trace.decision_latency)
 
-        build_swap_command = commands.get(self.platform)
-        cmd = build_swap_command(best_transaction, amount_in=amount_in, sequence=sequence, fees=self.config['fees'])
+        amount_in = compute_amount_in(transaction, starters=self.starters)
 
-        logger.debug(f'cmd successfully built : {cmd}')
+        # Only the commands that are sent consume a sequence
+        if self.sequence_manager is not None and self.config["do_transactions"]:
+            sequence = self.sequence_manager.next()
 
-        if self.config["do_transactions"]:
+        # Gas limit and fees from the gas model instead of a simulation
+        gas, fees = None, None
+        if self.gas_model is not None:
+            gas = self.gas_model.estimate(transaction)
+            fees = self.gas_model.fee(gas)
 
-            send_cmd = senders.get(self.platform)
-            txhash, stdout = send_cmd(cmd)
+        with self.metrics.timer("command_build"):
+            cmd = self.build_swap_command(transaction, amount_in=amount_in, sequence=sequence, gas=gas, fees=fees)
 
-            if txhash:
-                logger.success(
-                    f'cmd successfully sent : https://www.mintscan.io/osmosis/txs/{txhash}')
-                self.previous_sequence = sequence
-            else:
-                logger.error(f'cmd failed')
+        if isinstance(cmd, bytes):
+            # Signed bytes, only their hash is logged
+            logger.debug(f'tx successfully built : {hashlib.sha256(cmd).hexdigest().upper()} ({len(cmd)} bytes)')
+        else:
+            logger.debug(f'cmd successfully built : {cmd}')
+
+        if not self.config["do_transactions"]:
+            return None
+
+        with self.metrics.timer("submission"):
+            txhash, stdout = self.send_cmd(cmd)
+        self.metrics.count("submissions")
+
+        if self.sequence_manager is not None:
+            self.sequence_manager.report(sequence, txhash, stdout)
+
+        if trace is not None:
+            self.tracer.submitted(trace, txhash)
+            self.metrics.observe("data_age", trace.data_age)
 
-            if "insufficient fees" in stdout:
-                self.config["fees"] += 100
+        if txhash:
+            logger.success(
+                f'cmd successfully sent : https://www.mintscan.io/osmosis/txs/{txhash}')
+            self.previous_sequence = sequence
+            self.in_flight[txhash] = (time.monotonic(), {pool.idx for pool in transaction.pools})
+        else:
+            logger.error(f'cmd failed')
+            self.metrics.count("failed_submissions")
+
+        if self.gas_model is not None:
+            self.gas_model.outcome(gas, txhash, stdout)
+        elif "insufficient fees" in stdout:
+            self.config["fees"] += 100
+
+        if txhash:
+            self.record_result(txhash, route_shape(transaction), trace)
+
+        with self.metrics.timer("monitor_post"):
+            self.post_monitor(txhash)
 
-            requests.post(
-                url="http://127.0.0.1:5000/arbitrages/osmosis", data={"hash": txhash})
+        return txhash or None
+
+    def step(self) -> List[Transaction]:
+        """
+        One step equals fetching, processing, and sending transaction if needed
+        return :
+           - txs:            Transactions found during the step, the best one was sent
+        """
+        logger.debug('Starting a new step')
+
+        # The counters of a step that returns early or raises are not carried over to the next one
+        try:
+            with self.metrics.timer("step"):
+                sequence, fresh_amm = self.fetch()
+                if fresh_amm is None:
+                    return []
+
+                txs = self.find(fresh_amm)
+                self.submit(txs, sequence)
+        finally:
+            self.metrics.end_step()
+
+        return txs
+
+    def run_pipelined(self, duration: Optional[float] = None) -> Pipeline:
+        """
+        Same as run, but fetching, searching and submitting run as overlapping stages : snapshot N+1 is fetched
+        while snapshot N is searched. Snapshots and decisions that a stage had no time to take are dropped.
+        """
+        def fetch(_):
+            if self.scheduler is not None:
+                logger.debug(f'Block {self.scheduler.next_block()}')
+            sequence, fresh_amm = self.fetch()
+            if fresh_amm is None:
+                return None
+            return sequence, fresh_amm, self.snapshot, time.perf_counter()
+
+        def search(fetched):
+            sequence, fresh_amm, snapshot, fetched_at = fetched
+            return sequence, self.find(fresh_amm), snapshot, fetched_at
+
+        def submit(decision):
+            sequence, txs, snapshot, fetched_at = decision
+            try:
+                # A transaction was already sent with this sequence
+                if self.is_pending(sequence):
+                    return
+                self.submit(txs, sequence, snapshot=snapshot)
+                self.metrics.observe("step", time.perf_counter() - fetched_at)
+            finally:
+                self.metrics.end_step()
+            logger.debug(f'Decision made {time.perf_counter() - fetched_at:.3f}s after the fetch')
+
+        if self.scheduler is not None:
+            self.scheduler.start()
+
+        pipeline = Pipeline([fetch, search, submit], maxsize=self.config.get('pipeline_queue_size', 1))
+        pipeline.run(duration=duration)
+        return pipeline
 
     def run(self):
+        if self.config.get('pipelined', False):
+            self.run_pipelined()
+            return
+
+        if self.scheduler is not None:
+            self.scheduler.start()
+
         while True:
-            self.step()
+            if self.scheduler is not None:
+                logger.debug(f'Block {self.scheduler.next_block()}')
+            if self.profiler is not None:
+                self.profiler(self.step)
+            else:
+                self.step()
+
+
+class ReplayApp(App):
+    """
+    Drives App.step from recorded snapshots as fast as possible : the model is built from the snapshots,
+    the account sequence and the submission are stubbed, and nothing is sent to the monitor. Transactions are
+    never signed nor looked up, and their traces are written next to the snapshots.
+    """
+    def __init__(self, platform="osmosis", directory: Optional[str] = None) -> None:
+        self.directory = directory
+        snapshots = iter_snapshots(platform, directory=directory)
+
+        # The first snapshot builds the initial model and is also replayed as the first step
+        first = next(snapshots)
+        self.snapshots = itertools.chain([first, first], snapshots)
+        self.sent = 0  # transactions sent, numbers their hashes
+        self.report = ReplayReport()
+
+        super().__init__(platform)
+
+        self.fetcher = None
+        self.config["do_transactions"] = True
+
+    def make_model(self, regenerate: bool) -> AMM:
+        timestamp, payload = next(self.snapshots)
+        return snapshot_models.get(self.platform)(payload)
+
+    def fetch_pools(self, regenerate: bool) -> List[Pool]:
+        timestamp, payload = next(self.snapshots)
+        return snapshot_pools.get(self.platform)(payload)
+
+    def make_tx_client(self):
+        # Replayed transactions are never signed nor broadcast
+        return None
+
+    def trace_path(self) -> str:
+        return replay_trace_path(self.platform, directory=self.directory)
+
+    def get_account_sequence(self):
+        # Replayed transactions are included at once : the account sequence is one past the last one sent
+        return int(self.previous_sequence) + 1 if self.previous_sequence is not None else 1
+
+    def send_cmd(self, cmd: str):
+        self.sent += 1
+        return f"replay-{self.sent}", ""
+
+    def record_result(self, txhash: str, shape: str, trace: Optional[Trace] = None):
+        # Replayed transactions are never included, they are only forgotten from the transactions in flight
+        self.in_flight.pop(txhash, None)
+
+    def post_monitor(self, txhash):
+        pass
+
+    def run(self) -> ReplayReport:
+        while True:
+            start = time.perf_counter()
+            try:
+                txs = self.step()
+            except StopIteration:
+                break
+            # Same transactions as the ones submit sends
+            selected = select_disjoint(txs, self.config.get('max_transactions_per_step', 1))
+            self.report.add_step(time.perf_counter() - start, opportunities=self.last_opportunities,
+                                 transactions=selected)
+
+        logger.info(f'{self.report}')
+        return self.report
+
+
+class BenchmarkApp(App):
+    """
+    Drives App.step on a seeded synthetic market : every step builds the model from make_pools(), the
+    account sequence, the command and the submission are stubbed.
+    """
+    def __init__(self, make_pools: Callable[[], List[Pool]]) -> None:
+        self.make_pools = make_pools
+
+        super().__init__("anyplatform")
+
+        self.fetcher = None
+        self.config["do_transactions"] = True
+
+    def make_model(self, regenerate: bool) -> AMM:
+        return AMM("anyplatform", pools=self.make_pools())
+
+    def fetch_pools(self, regenerate: bool) -> List[Pool]:
+        return self.make_pools()
+
+    def get_account_sequence(self):
+        # Same as the replays, every transaction sent is included at once
+        return int(self.previous_sequence) + 1 if self.previous_sequence is not None else 1
+
+    def build_swap_command(self, transaction: Transaction, amount_in: int, sequence: int, gas: Optional[int] = None,
+                           fees: Optional[int] = None) -> str:
+        return f"benchmark-{sequence}"
+
+    def send_cmd(self, cmd: str):
+        return cmd, ""
+
+    def post_monitor(self, txhash):
+        pass
 
 
 if __name__ == '__main__':
-    app = App("osmosis")
-    app.run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--platform", default="osmosis", choices=list(models.keys()))
+    parser.add_argument("--benchmark", action="store_true",
+                        help="time the engine on synthetic markets of 100, 1k and 10k pools")
+    parser.add_argument("--replay", nargs="?", const="", default=None, metavar="SNAPSHOTS_DIRECTORY",
+                        help="replay recorded snapshots instead of trading live")
+    parser.add_argument("--traces", action="store_true",
+                        help="summarize the data age and decision latency of the traced opportunities, "
+                             "of the replays with --replay")
+    args = parser.parse_args()
+
+    if args.traces:
+        if args.replay is not None:
+            path = replay_trace_path(args.platform, directory=args.replay or None)
+        else:
+            path = trace_log_path(args.platform)
+        print(yaml.safe_dump(summarize(read_traces(path)), sort_keys=False))
+    elif args.benchmark:
+        run_benchmark(app_factory=BenchmarkApp)
+    elif args.replay is not None:
+        app = ReplayApp(args.platform, directory=args.replay or None)
+        app.run()
+    else:
+        app = App(args.platform)
+        app.run()
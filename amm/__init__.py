@@ -1,6 +1,8 @@
+from .store import PoolStore
 from .pool import Pool
 from .amm import AMM
 from .asset import Asset
 from .transaction import Transaction
+from .cycle_matrix import CycleMatrix
 
-__all__ = ['Pool', 'AMM', 'Asset', 'Transaction']
+__all__ = ['PoolStore', 'Pool', 'AMM', 'Asset', 'Transaction', 'CycleMatrix']
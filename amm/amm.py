@@ -1,20 +1,34 @@
 from amm.pool import Pool
 import numpy as np
-from typing import List
+from typing import List, Tuple
 from amm.asset import Asset
+from amm.store import PoolStore
 import itertools
+import bisect
 
 
 class AMM:
-    def __init__(self, name: str, pools: List[Pool]):
+    def __init__(self, name: str, pools: List[Pool], store: PoolStore = None):
         self.name = name
+        # Pools state, one row per pool. Reuse the store the pools were parsed into when there is one
+        if store is None:
+            store = pools[0].store if pools else PoolStore()
+        self.store = store
+        self.store.reserve(len(pools))
         self.symbol_to_denom = {}  # asset_symbol --> asset_denom
         self.pools = {}   # pool_id  --> Pool
         self.graph = {}   # asset_symbol --> [  (pool_1, asset_symbol_dest_1) , (pool_2, asset_symbol_dest_2), ... ]
+        self.edges = {}   # (asset_symbol_from, asset_symbol_to) --> [pool_1, pool_2, ...] best change first
+        self.directed = {}  # (pool_id, asset_symbol_from, asset_symbol_to) --> Pool
         self.assets = {}  # asset_symbol --> Asset
         self.num_assets = 0
         self.num_pools = 0
 
+        # Move every pool in the store first so that change rates are computed in a single pass
+        for pool in pools:
+            pool.bind(self.store)
+        self.store.update_changes()
+
         for pool in pools:
             self.add_pool(pool)
 
@@ -28,6 +42,8 @@ class AMM:
             self.symbol_to_denom[asset.symbol] = asset.denom
 
     def add_pool(self, pool: Pool):
+        pool.bind(self.store)
+
         if pool.idx not in self.graph:
             self.pools[pool.idx] = pool
             self.num_pools += 1
@@ -39,6 +55,97 @@ class AMM:
         self.add_asset(pool.asset_2)
 
         self.graph[symbol_1].append((pool, symbol_2))
+        self.directed[(pool.idx, symbol_1, symbol_2)] = pool
+
+        # Keep each directed edge sorted by decreasing change rate
+        edge = self.edges.setdefault((symbol_1, symbol_2), [])
+        bisect.insort(edge, pool, key=lambda p: -p.change)
+
+    def remove_pool(self, pool: Pool):
+        """
+        Unlink a pool from the graph. Its row stays in the store until the AMM is rebuilt
+        """
+        symbol_1 = pool.symbol_1
+        symbol_2 = pool.symbol_2
+
+        del self.directed[(pool.idx, symbol_1, symbol_2)]
+        if self.pools.get(pool.idx) is pool:
+            del self.pools[pool.idx]
+        self.num_pools -= 1
+        self.graph[symbol_1] = [link for link in self.graph[symbol_1] if link[0] is not pool]
+
+        edge = self.edges[(symbol_1, symbol_2)]
+        edge.remove(pool)
+        if len(edge) == 0:
+            del self.edges[(symbol_1, symbol_2)]
+
+    def refresh(self, pools: List[Pool]) -> List[Pool]:
+        """
+        Update this AMM in place from freshly fetched pools : reserves of known pools are overwritten,
+        new pools are added and missing ones removed. The fetched pools are only read, they are compared
+        with the store rows of the known pools all at once.
+        return :
+           - touched:        Pools of this AMM that were updated, added or removed
+        """
+        seen = set()
+        known = []    # (pool of this AMM, fetched pool)
+        added = []
+
+        for pool in pools:
+            key = (pool.idx, pool.symbol_1, pool.symbol_2)
+            seen.add(key)
+
+            current = self.directed.get(key)
+            if current is None:
+                added.append(pool)
+            else:
+                known.append((current, pool))
+
+        touched = []
+        if known:
+            rows = np.array([current.row for current, _ in known], dtype=np.int64)
+            changed = self.store.update_rows(rows, *_gather_state([pool for _, pool in known]))
+            touched = [known[n][0] for n in np.flatnonzero(changed)]
+
+        removed = [pool for key, pool in self.directed.items() if key not in seen]
+        for pool in removed:
+            self.remove_pool(pool)
+
+        # New pools are moved in the store before their change rate is read
+        for pool in added:
+            pool.bind(self.store)
+        self.store.update_changes()
+        for pool in added:
+            self.add_pool(pool)
+        touched += added
+
+        # Updated pools may have moved in their edge ordering
+        for symbol_1, symbol_2 in {(pool.symbol_1, pool.symbol_2) for pool in touched}:
+            edge = self.edges.get((symbol_1, symbol_2))
+            if edge:
+                edge.sort(key=lambda p: -p.change)
+
+        return touched + removed
+
+    def pools_between(self, start: str, end: str) -> List[Pool]:
+        """
+        Pools swapping start --> end, best change rate first
+        """
+        return self.edges.get((start, end), [])
+
+    def best_pool(self, start: str, end: str) -> Pool:
+        """
+        Pool with the best change rate swapping start --> end, None if there is none
+        """
+        edge = self.edges.get((start, end))
+        return edge[0] if edge else None
+
+    def best_change(self, start: str, end: str) -> float:
+        """
+        Best change rate among the pools swapping start --> end, -inf if there is none
+        """
+        edge = self.edges.get((start, end))
+        return edge[0].change if edge else -np.inf
 
     def compute_cycle(self, cycle: List[str]) -> float:
         """
@@ -53,16 +160,7 @@ class AMM:
         change = 0
 
         for start, end in zip(cycle[:-1], cycle[1:]):
-            available_pools = [link[0] for link in self.graph[start] if link[1] == end]
-
-            max_change = -np.inf
-
-            for pool in available_pools:
-                # If the change rate is better in this pool
-                if pool.change > max_change:
-                    max_change = pool.change
-
-            change += max_change
+            change += self.best_change(start, end)
         return change
 
     def all_pools_with_cycle(self, cycle: List[str]) -> List[List[Pool]]:
@@ -71,7 +169,19 @@ class AMM:
 
         list_of_pools = []
         for start, end in zip(cycle[:-1], cycle[1:]):
-            available_pools = [link[0] for link in self.graph[start] if link[1] == end]
-            list_of_pools.append(available_pools)
+            list_of_pools.append(self.pools_between(start, end))
 
         return list(map(list, itertools.product(*list_of_pools)))
+
+
+def _gather_state(pools: List[Pool]) -> Tuple[np.ndarray, ...]:
+    """
+    Reserves, weights and fee ratio of the pools as arrays, read straight from their store when they share one
+    """
+    store = pools[0].store
+    if all(pool.store is store for pool in pools):
+        rows = np.array([pool.row for pool in pools], dtype=np.int64)
+        return store.reserves_in[rows], store.reserves_out[rows], store.wi[rows], store.wo[rows], store.r[rows]
+
+    return tuple(np.array([getattr(pool, field) for pool in pools], dtype=float)
+                 for field in ('i', 'o', 'wi', 'wo', 'r'))
@@ -0,0 +1,267 @@
+from typing import List, Tuple, Optional
+import numpy as np
+from amm.pool import Pool
+from amm.store import PoolStore, POOL_TYPE_CODES
+
+XYK = POOL_TYPE_CODES['xyk']
+STABLE = POOL_TYPE_CODES['stable']
+
+
+class RouteBatch:
+    """
+    N routes padded to the same number of hops, stored as (N, hops) arrays gathered from the PoolStore
+    the pools live in. Padding hops are identity swaps.
+    """
+    def __init__(self, routes: List[List[Pool]]):
+        self.routes = routes
+        self.num_routes = len(routes)
+        self.max_hops = max([len(route) for route in routes], default=0)
+
+        rows = np.zeros((self.num_routes, self.max_hops), dtype=np.int64)
+        mask = np.zeros((self.num_routes, self.max_hops), dtype=bool)  # False on padding hops
+
+        store = routes[0][0].store if routes else None
+        for n, route in enumerate(routes):
+            for h, pool in enumerate(route):
+                if pool.store is not store:
+                    raise ValueError(f'Pool {pool} does not belong to the same store as the other routes')
+                rows[n, h] = pool.row
+            mask[n, :len(route)] = True
+
+        self._gather(store, rows, mask)
+
+    @classmethod
+    def from_rows(cls, store: PoolStore, rows: np.ndarray, mask: np.ndarray) -> 'RouteBatch':
+        """
+        Batch of routes given as (N, hops) store rows, without Pool handles. Padding hops are False in mask.
+        """
+        batch = cls.__new__(cls)
+        batch.routes = None
+        batch.num_routes, batch.max_hops = rows.shape
+        batch._gather(store, rows, mask)
+        return batch
+
+    def _gather(self, store: PoolStore, rows: np.ndarray, mask: np.ndarray):
+        self.mask = mask
+
+        # Padding hops get neutral values so that they never produce nan
+        if store is not None:
+            self.i = np.where(self.mask, store.reserves_in[rows], 1.)
+            self.o = np.where(self.mask, store.reserves_out[rows], 1.)
+            self.wi = np.where(self.mask, store.wi[rows], 1.)
+            self.wo = np.where(self.mask, store.wo[rows], 1.)
+            self.r = np.where(self.mask, store.r[rows], 1.)
+            self.type_code = np.where(self.mask, store.type_code[rows], XYK)
+        else:
+            self.i = self.o = self.wi = self.wo = self.r = np.ones((0, 0))
+            self.type_code = np.zeros((0, 0), dtype=np.int8)
+
+        self.equal_weight_xyk = np.all(~self.mask | ((self.type_code == XYK) & (self.wi == self.wo)), axis=1)
+
+    def __len__(self):
+        return self.num_routes
+
+    def take(self, indices: np.ndarray) -> 'RouteBatch':
+        """
+        Batch of the given routes only, sliced from this one without gathering them again
+        """
+        batch = self.__class__.__new__(self.__class__)
+        batch.routes = [self.routes[n] for n in indices] if self.routes is not None else None
+        batch.num_routes, batch.max_hops = len(indices), self.max_hops
+        for name in ('mask', 'i', 'o', 'wi', 'wo', 'r', 'type_code', 'equal_weight_xyk'):
+            setattr(batch, name, getattr(self, name)[indices])
+        return batch
+
+    def keys(self) -> List[bytes]:
+        """
+        State of the pools of every route as bytes : routes with the same key have the same optimum.
+        Padding hops are left out, so the key of a route does not depend on the batch it is in.
+        """
+        state = np.stack([self.i, self.o, self.wi, self.wo, self.r, self.type_code], axis=2)
+        hops = self.mask.sum(axis=1)
+        return [route[:n].tobytes() for route, n in zip(state, hops)]
+
+    def profit_bounds(self) -> np.ndarray:
+        """
+        Upper bound of output - input of every route whatever the input, in units of its first asset.
+        The output of a swap is concave : it is at most its input times its change rate at zero and at most
+        its output reserve. So the route output is at most e^change * input, and at most the smallest output
+        reserve along the route carried to the end at the change rates of the following hops, Y. Then
+        output - input <= Y * (1 - e^-change).
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            changes = np.log(self.wi / self.wo * self.r)
+            changes = np.where(self.type_code == XYK, changes + np.log(self.o / self.i), changes)
+            changes = np.where(self.mask, changes, 0.)
+
+            following = np.cumsum(changes[:, ::-1], axis=1)[:, ::-1] - changes
+            log_y = np.where(self.mask, np.log(self.o) + following, np.inf).min(axis=1)
+
+            total = changes.sum(axis=1)
+            return np.where(total > 0, np.exp(log_y) * -np.expm1(-total), 0.)
+
+    def simulate_swaps(self, amounts: np.ndarray) -> np.ndarray:
+        return self.simulate_swaps_derivatives(amounts)[0]
+
+    def simulate_swaps_derivatives(self, amounts: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Output amount of every route with its first and second derivatives with respect to the input amount
+        """
+        amount = np.asarray(amounts, dtype=float)
+        d_amount = np.ones(self.num_routes)
+        d2_amount = np.zeros(self.num_routes)
+
+        for h in range(self.max_hops):
+            i, o, r = self.i[:, h], self.o[:, h], self.r[:, h]
+            w = self.wi[:, h] / self.wo[:, h]
+
+            # Weighted xyk swap
+            base = i + amount * r
+            ratio = (i / base) ** w
+            out = o * (1 - ratio)
+            d_out = o * w * r / base * ratio
+            d2_out = -(w + 1) * r / base * d_out
+
+            # Stable swap
+            rate = w * r
+            below = amount * rate < o
+            stable = self.type_code[:, h] == STABLE
+            out = np.where(stable, np.where(below, amount * rate, o), out)
+            d_out = np.where(stable, np.where(below, rate, 0.), d_out)
+            d2_out = np.where(stable, 0., d2_out)
+
+            # Padding is the identity
+            hop = self.mask[:, h]
+            out = np.where(hop, out, amount)
+            d_out = np.where(hop, d_out, 1.)
+            d2_out = np.where(hop, d2_out, 0.)
+
+            d2_amount = d2_out * d_amount ** 2 + d_out * d2_amount
+            d_amount = d_out * d_amount
+            amount = out
+
+        return amount, d_amount, d2_amount
+
+    def closed_form(self) -> np.ndarray:
+        """
+        Optimal input of every route considered as equal-weight xyk pools (exact for those)
+        """
+        i_eq = self.i[:, 0].copy()
+        o_eq = self.o[:, 0].copy()
+
+        for h in range(1, self.max_hops):
+            i, o, r = self.i[:, h], self.o[:, h], self.r[:, h]
+            hop = self.mask[:, h]
+
+            denominator = i + r * o_eq
+            i_eq, o_eq = np.where(hop, i_eq * i / denominator, i_eq), np.where(hop, r * o_eq * o / denominator, o_eq)
+
+        r_1 = self.r[:, 0]
+        return (np.sqrt(i_eq * o_eq * r_1) - i_eq) / r_1
+
+    def newton(self, xatol=10000, fatol=100, max_iterations=100, routes: np.ndarray = None) -> np.ndarray:
+        """
+        Vectorized version of engine.find_optimal_amount_newton : bracketed Newton on d(output)/d(input) = 1
+        :param routes: boolean mask of the routes to solve, the others get 0
+        """
+        _, d_out, _ = self.simulate_swaps_derivatives(np.zeros(self.num_routes))
+        profitable = d_out > 1
+        if routes is not None:
+            profitable &= routes
+        active = profitable.copy()
+
+        # Bracket the roots
+        lo = np.zeros(self.num_routes)
+        hi = np.maximum(self.i[:, 0], 1.)
+        for _ in range(max_iterations):
+            _, d_out, _ = self.simulate_swaps_derivatives(hi)
+            growing = active & (d_out > 1)
+            if not growing.any():
+                break
+            lo = np.where(growing, hi, lo)
+            hi = np.where(growing, 2 * hi, hi)
+
+        x = (lo + hi) / 2
+        out, d_out, d2_out = self.simulate_swaps_derivatives(x)
+
+        for _ in range(max_iterations):
+            if not active.any():
+                break
+
+            lo = np.where(active & (d_out > 1), x, lo)
+            hi = np.where(active & (d_out <= 1), x, hi)
+
+            middle = (lo + hi) / 2
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_new = np.where(d2_out < 0, x - (d_out - 1) / d2_out, middle)
+            x_new = np.where((lo < x_new) & (x_new < hi), x_new, middle)
+            x_new = np.where(active, x_new, x)
+
+            out_new, d_out, d2_out = self.simulate_swaps_derivatives(x_new)
+
+            converged = (np.abs(x_new - x) <= xatol) & (np.abs((out_new - x_new) - (out - x)) <= fatol)
+            x, out = x_new, out_new
+
+            active &= ~converged & (hi - lo > xatol)
+
+        return np.where(profitable, x, 0.)
+
+    def solve(self, xatol=10000, fatol=100) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Optimal input of every route, closed form for equal-weight xyk routes and Newton for the others
+        return :
+           - best_inputs:    Optimal input amounts
+           - outputs:        Output amounts for these inputs
+           - deltas:         outputs - best_inputs
+        """
+        best_inputs = np.zeros(self.num_routes)
+
+        if self.equal_weight_xyk.any():
+            best_inputs = np.where(self.equal_weight_xyk, self.closed_form(), best_inputs)
+
+        if not self.equal_weight_xyk.all():
+            best_inputs = np.where(self.equal_weight_xyk, best_inputs,
+                                   self.newton(xatol=xatol, fatol=fatol, routes=~self.equal_weight_xyk))
+
+        # Unprofitable routes can get a negative optimum, they do not trade
+        best_inputs = np.maximum(best_inputs, 0.)
+        outputs = self.simulate_swaps(best_inputs)
+        return best_inputs, outputs, outputs - best_inputs
+
+    def solve_best_first(self, prices: np.ndarray, minimum: float, top_k: Optional[int] = None, xatol=10000,
+                         fatol=100, cache=None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Solve only the routes whose profit bound is above minimum, by decreasing bound, in chunks doubling in
+        size. Stops once top_k routes made more than the bound of every route left.
+        :param prices: price of the first asset of every route, profits and minimum are compared in this unit
+        :param cache: engine.RouteCache the optima are looked up in before solving
+        return :
+           - indices:        Indices of the solved routes
+           - best_inputs:    Their optimal input amounts
+           - deltas:         Their outputs - best_inputs
+        """
+        bounds = prices * self.profit_bounds()
+        order = np.flatnonzero(bounds > minimum)
+        order = order[np.argsort(-bounds[order], kind='stable')]
+
+        chunks = []
+        made = np.zeros(0)  # profits above minimum of the solved routes
+        start, size = 0, top_k or len(order)
+        while start < len(order):
+            if top_k is not None and len(made) >= top_k and np.partition(made, -top_k)[-top_k] >= bounds[order[start]]:
+                break
+
+            chunk = order[start:start + size]
+            if cache is not None:
+                best_inputs, _, deltas = cache.solve(self.take(chunk), xatol=xatol, fatol=fatol)
+            else:
+                best_inputs, _, deltas = self.take(chunk).solve(xatol=xatol, fatol=fatol)
+            chunks.append((chunk, best_inputs, deltas))
+
+            profits = prices[chunk] * deltas
+            made = np.concatenate([made, profits[(best_inputs > 0) & (profits > minimum)]])
+            start, size = start + size, 2 * size
+
+        if len(chunks) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+        return tuple(np.concatenate(arrays) for arrays in zip(*chunks))
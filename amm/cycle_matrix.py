@@ -0,0 +1,179 @@
+from typing import List, Tuple, Dict, Optional
+import numpy as np
+
+
+class CycleMatrix:
+    """
+    Compiled form of a list of cycles. Each cycle is stored as a row of edge indices
+    (one per hop), padded with the index of a zero-rate edge, so that every cycle can be
+    scored at once with a single gather-and-sum over the edge log-rate vector.
+    """
+    def __init__(self, cycles: List[List[str]]):
+        self.cycles = cycles
+        self.edges: List[Tuple[str, str]] = []      # edge_index --> (asset_symbol_from, asset_symbol_to)
+        self.edge_index: Dict[Tuple[str, str], int] = {}  # (asset_symbol_from, asset_symbol_to) --> edge_index
+
+        rows = []
+        for cycle in cycles:
+            if cycle[-1] != cycle[0]:
+                cycle = cycle + [cycle[0]]
+
+            row = []
+            for start, end in zip(cycle[:-1], cycle[1:]):
+                edge = (start, end)
+                if edge not in self.edge_index:
+                    self.edge_index[edge] = len(self.edges)
+                    self.edges.append(edge)
+                row.append(self.edge_index[edge])
+            rows.append(row)
+
+        self.num_edges = len(self.edges)
+        self.padding = self.num_edges  # last slot of the rate vector, always 0
+        self.max_hops = max([len(row) for row in rows], default=0)
+
+        self.matrix = np.full((len(rows), self.max_hops), self.padding, dtype=np.int32)
+        for n, row in enumerate(rows):
+            self.matrix[n, :len(row)] = row
+
+        self.assets: List[str] = []  # asset_symbol of every index of starts
+        asset_index = {}
+        for cycle in cycles:
+            if cycle[0] not in asset_index:
+                asset_index[cycle[0]] = len(self.assets)
+                self.assets.append(cycle[0])
+        self.starts = np.array([asset_index[cycle[0]] for cycle in cycles], dtype=np.int64)  # first asset of cycles
+
+        self._index_edge_cycles()
+
+    @classmethod
+    def from_cache(cls, cache) -> 'CycleMatrix':
+        """
+        Same as CycleMatrix(cache) for a utils.cycles.CycleCache, built from its arrays with numpy instead of
+        going through the cycles one by one
+        """
+        matrix = cls.__new__(cls)
+        matrix.cycles = cache
+        matrix.assets = list(cache.symbols)
+
+        offsets = np.asarray(cache.offsets, dtype=np.int64)
+        nodes = np.asarray(cache.nodes, dtype=np.int64)
+        lengths = np.diff(offsets)
+        num_cycles = len(lengths)
+
+        # Hop k of a cycle swaps its node k into node k + 1, the last one back into the first
+        cycle_of = np.repeat(np.arange(num_cycles), lengths)
+        positions = np.arange(len(nodes)) - offsets[cycle_of]
+        following = np.arange(1, len(nodes) + 1)
+        last = positions == lengths[cycle_of] - 1
+        following[last] = offsets[cycle_of[last]]
+        start, end = nodes, nodes[following] if len(nodes) else nodes
+
+        # A cycle stored closed (last node = first node) has no closing hop, as in __init__
+        hops = ~(last & (start == end))
+        cycle_of, positions, start, end = cycle_of[hops], positions[hops], start[hops], end[hops]
+
+        num_symbols = max(len(cache.symbols), 1)
+        codes, edge_of = np.unique(start * num_symbols + end, return_inverse=True)
+        matrix.edges = [(cache.symbols[code // num_symbols], cache.symbols[code % num_symbols]) for code in codes]
+        matrix.edge_index = {edge: n for n, edge in enumerate(matrix.edges)}
+
+        matrix.num_edges = len(matrix.edges)
+        matrix.padding = matrix.num_edges
+        hop_counts = np.bincount(cycle_of, minlength=num_cycles)
+        matrix.max_hops = int(hop_counts.max(initial=0))
+
+        matrix.matrix = np.full((num_cycles, matrix.max_hops), matrix.padding, dtype=np.int32)
+        matrix.matrix[cycle_of, positions] = edge_of
+
+        matrix.starts = nodes[offsets[:-1]] if num_cycles else np.zeros(0, dtype=np.int64)
+
+        matrix._index_edge_cycles()
+        return matrix
+
+    def _index_edge_cycles(self):
+        """ Inverted index : edge_index --> sorted indices of the cycles using it """
+        rows, columns = np.nonzero(self.matrix != self.padding)
+        pairs = np.unique(self.matrix[rows, columns].astype(np.int64) * max(len(self.matrix), 1) + rows)
+        edges, cycles = np.divmod(pairs, max(len(self.matrix), 1))
+        bounds = np.searchsorted(edges, np.arange(self.num_edges + 1))
+        self.edge_cycles = [cycles[bounds[n]:bounds[n + 1]] for n in range(self.num_edges)]
+
+    def start_prices(self, starters: Dict[str, Dict[str, float]]) -> np.ndarray:
+        """ current_price of the first asset of every cycle, 0 when it is not in the starters """
+        prices = np.array([float(starters.get(symbol, {}).get('current_price', 0)) for symbol in self.assets])
+        return prices[self.starts] if len(prices) else np.zeros(len(self.starts))
+
+    def __len__(self):
+        return len(self.cycles)
+
+    def cycles_using(self, pools) -> np.ndarray:
+        """
+        Sorted indices of the cycles going through at least one of the given pools
+        """
+        edges = {self.edge_index.get((pool.symbol_1, pool.symbol_2)) for pool in pools}
+        edges.discard(None)
+        if not edges:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate([self.edge_cycles[edge] for edge in edges]))
+
+    def edge_rates(self, amm) -> np.ndarray:
+        """
+        Best log change rate of every compiled edge in the given AMM. Missing edges get -inf
+        and the padding slot gets 0.
+        """
+        rates = np.zeros(self.num_edges + 1)
+        for n, (start, end) in enumerate(self.edges):
+            rates[n] = amm.best_change(start, end)
+        return rates
+
+    def edge_reserves(self, amm) -> np.ndarray:
+        """
+        Log of the largest output reserve among the pools of every compiled edge in the given AMM. Missing
+        edges get -inf and the padding slot gets +inf.
+        """
+        reserves = np.full(self.num_edges + 1, np.inf)
+        with np.errstate(divide='ignore'):
+            for n, (start, end) in enumerate(self.edges):
+                pools = amm.pools_between(start, end)
+                reserves[n] = np.log(max(pool.o for pool in pools)) if pools else -np.inf
+        return reserves
+
+    def score(self, amm) -> np.ndarray:
+        """
+        Compute every cycle best change rate at once, same values as AMM.compute_cycle
+        """
+        return self.edge_rates(amm)[self.matrix].sum(axis=1)
+
+    def profit_bounds(self, amm, indices: np.ndarray, rates: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Upper bound of output - input of every route of the given cycles, in units of their first asset :
+        RouteBatch.profit_bounds with the best change rate and the largest output reserve of each edge
+        :param rates: edge_rates of the AMM, computed when None
+        """
+        if rates is None:
+            rates = self.edge_rates(amm)
+
+        changes = rates[self.matrix[indices]]
+        with np.errstate(invalid='ignore', over='ignore'):
+            following = np.cumsum(changes[:, ::-1], axis=1)[:, ::-1] - changes
+            log_y = (self.edge_reserves(amm)[self.matrix[indices]] + following).min(axis=1)
+
+            total = changes.sum(axis=1)
+            return np.where(total > 0, np.exp(log_y) * -np.expm1(-total), 0.)
+
+    def profitable(self, amm, minimum_profits: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param minimum_profits: profit that every cycle must be able to exceed, in units of its first asset.
+            Cycles with a positive change rate but a lower profit bound are left out too.
+        return :
+           - indices:        Indices of the cycles with a positive change rate
+           - changes:        Their change rates
+        """
+        rates = self.edge_rates(amm)
+        changes = rates[self.matrix].sum(axis=1)
+        indices = np.flatnonzero(changes > 0)
+
+        if minimum_profits is not None and len(indices):
+            indices = indices[self.profit_bounds(amm, indices, rates) > minimum_profits[indices]]
+
+        return indices, changes[indices]
@@ -1,7 +1,13 @@
+import heapq
+import math
 import numpy as np
-from typing import List
+from typing import List, Dict, Tuple, Optional, Set
+from collections import deque, OrderedDict
 import scipy.optimize
 from amm import Transaction, Pool
+from amm.batch import RouteBatch
+from amm.store import POOL_TYPE_CODES
+from utils.metrics import get_metrics
 
 
 def simulate_swaps(pools: List[Pool], amount: float):
@@ -10,6 +16,66 @@ def simulate_swaps(pools: List[Pool], amount: float):
     return amount
 
 
+def simulate_swaps_derivatives(pools: List[Pool], amount: float):
+    """
+    Output amount of the route with its first and second derivatives with respect to the input amount
+    """
+    d_amount = 1.
+    d2_amount = 0.
+    for pool in pools:
+        amount, d_out, d2_out = pool.simulate_swap_derivatives(amount)
+        d2_amount = d2_out * d_amount ** 2 + d_out * d2_amount
+        d_amount = d_out * d_amount
+    return amount, d_amount, d2_amount
+
+
+def find_optimal_amount_newton(pools: List[Pool], xatol=10000, fatol=100, max_iterations=100):
+    """
+    Maximize output - input by solving d(output)/d(input) = 1 with a bracketed Newton method.
+    The route output is concave, so its derivative is decreasing and the root is unique.
+    Stops when the step is below xatol and the delta moved by less than fatol.
+    """
+    _, d_out, _ = simulate_swaps_derivatives(pools, 0.)
+    if d_out <= 1:
+        return 0.
+
+    # Bracket the root : derivative above 1 at lo, below 1 at hi
+    lo = 0.
+    hi = max(float(pools[0].i), 1.)
+    for _ in range(max_iterations):
+        _, d_out, _ = simulate_swaps_derivatives(pools, hi)
+        if d_out <= 1:
+            break
+        lo, hi = hi, 2 * hi
+
+    x = (lo + hi) / 2
+    out, d_out, d2_out = simulate_swaps_derivatives(pools, x)
+
+    for _ in range(max_iterations):
+        if d_out > 1:
+            lo = x
+        else:
+            hi = x
+
+        # Newton step when it stays in the bracket, bisection otherwise (stable pools have no curvature)
+        if d2_out < 0:
+            x_new = x - (d_out - 1) / d2_out
+            if not lo < x_new < hi:
+                x_new = (lo + hi) / 2
+        else:
+            x_new = (lo + hi) / 2
+
+        out_new, d_out, d2_out = simulate_swaps_derivatives(pools, x_new)
+
+        converged = abs(x_new - x) <= xatol and abs((out_new - x_new) - (out - x)) <= fatol
+        x, out = x_new, out_new
+
+        if converged or hi - lo <= xatol:
+            break
+
+    return x
+
+
 def find_optimal_amount(pools: List[Pool], xatol=10000, fatol=100):
 
     if all([p.wi == p.wo for p in pools]) and all([p.pool_type == 'xyk' for p in pools]):
@@ -26,6 +92,8 @@ def find_optimal_amount(pools: List[Pool], xatol=10000, fatol=100):
 
         x_op = (np.sqrt(i_eq * o_eq * p1.r) - i_eq) / p1.r
         return x_op
+    elif all([p.pool_type in ('xyk', 'stable') for p in pools]):
+        return find_optimal_amount_newton(pools, xatol=xatol, fatol=fatol)
     else:
 
         def delta(x):
@@ -37,24 +105,166 @@ def find_optimal_amount(pools: List[Pool], xatol=10000, fatol=100):
         return float(res.x)
 
 
-def find_transactions(cycle, amm, config, starters):
+def route_profit_bound(pools: List[Pool]) -> float:
+    """
+    Same as RouteBatch.profit_bounds for a single route, from the change rates of its pools : Y * (1 - e^-change)
+    """
+    changes = [float(pool.change) for pool in pools]
+    total = sum(changes)
+    if total <= 0:
+        return 0.
+
+    log_y = math.inf
+    following = total
+    for pool, change in zip(pools, changes):
+        following -= change
+        log_y = min(log_y, (math.log(pool.o) if pool.o > 0 else -math.inf) + following)
+    return math.exp(log_y) * -math.expm1(-total)
+
+
+def route_key(pools: List[Pool]) -> bytes:
+    """ Same as RouteBatch.keys for a single route, from the state of its pools """
+    return np.array([(pool.i, pool.o, pool.wi, pool.wo, pool.r, POOL_TYPE_CODES[pool.pool_type]) for pool in pools],
+                    dtype=float).tobytes()
+
+
+class RouteCache:
+    """
+    Bounded LRU cache of route optima, keyed on the state of the pools of the route (RouteBatch.keys) :
+    between two blocks most pools keep their reserves, and their routes cost one lookup instead of a solve.
+    The hits, misses and evictions are counted in the metrics by report().
+    """
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # key --> (best_input, delta), least recently used first
+        self.tolerances = None  # (xatol, fatol) of the cached optima
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._reported = (0, 0, 0)  # hits, misses and evictions already counted in the metrics
+
+    def get(self, key: bytes) -> Optional[Tuple[float, float]]:
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: bytes, value: Tuple[float, float]):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def report(self):
+        """ Count the lookups made since the previous report in the metrics """
+        metrics = get_metrics()
+        current = (self.hits, self.misses, self.evictions)
+        for name, value, reported in zip(("hits", "misses", "evictions"), current, self._reported):
+            if value > reported:
+                metrics.count(f"route_cache_{name}", value - reported)
+        self._reported = current
+
+        metrics.gauge("route_cache_hit_rate", self.hit_rate)
+        metrics.gauge("route_cache_size", len(self.entries))
+
+    def check_tolerances(self, xatol, fatol):
+        """ Optima found with other tolerances are dropped """
+        if self.tolerances != (xatol, fatol):
+            self.entries.clear()
+            self.tolerances = (xatol, fatol)
+
+    def solve(self, batch: RouteBatch, xatol=10000, fatol=100) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Same as batch.solve, only the routes missing from the cache are solved
+        """
+        self.check_tolerances(xatol, fatol)
+
+        keys = batch.keys()
+        best_inputs = np.zeros(len(keys))
+        deltas = np.zeros(len(keys))
+
+        missing = []
+        for n, key in enumerate(keys):
+            value = self.get(key)
+            if value is None:
+                missing.append(n)
+            else:
+                best_inputs[n], deltas[n] = value
+
+        if missing:
+            missing = np.array(missing)
+            solved_inputs, _, solved_deltas = batch.take(missing).solve(xatol=xatol, fatol=fatol)
+            best_inputs[missing] = solved_inputs
+            deltas[missing] = solved_deltas
+            for n, best_input, delta in zip(missing, solved_inputs, solved_deltas):
+                self.put(keys[n], (float(best_input), float(delta)))
+
+        self.report()
+        return best_inputs, best_inputs + deltas, deltas
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    def __repr__(self):
+        return f"RouteCache(size={len(self.entries)}, hit_rate={self.hit_rate:.3f}, evictions={self.evictions})"
+
+
+_route_cache: Optional[RouteCache] = RouteCache()
+
+
+def configure_route_cache(max_size: int) -> Optional[RouteCache]:
+    """ Replace the route cache of the searches, disabled when max_size is 0 """
+    global _route_cache
+    _route_cache = RouteCache(max_size) if max_size > 0 else None
+    return _route_cache
+
+
+def get_route_cache() -> Optional[RouteCache]:
+    return _route_cache
+
+
+def find_transactions(cycle, amm, config, starters, change=None):
     transactions = []
-    change = amm.compute_cycle(cycle)
+    if change is None:
+        change = amm.compute_cycle(cycle)
     if change < 0:
         return transactions
 
+    cache = get_route_cache()
+    if cache is not None:
+        cache.check_tolerances(config['xatol'], config['fatol'])
+
     for pools in amm.all_pools_with_cycle(cycle):
         if len(pools) == 0:
             continue
         from_asset = cycle[0]
-        best_input = find_optimal_amount(pools, xatol=config['xatol'], fatol=config['fatol'])
 
-        if best_input <= 0:
+        # The route cannot clear the threshold whatever its input
+        bound = float(starters[from_asset]['current_price']) * route_profit_bound(pools)
+        if bound <= config['minimum_dollars_delta']:
             continue
 
-        output = simulate_swaps(pools=pools, amount=best_input)
+        # Keys of the single route solver apart from those of RouteCache.solve, their optima may differ a bit
+        key = b"single" + route_key(pools)
+        cached = cache.get(key) if cache is not None else None
 
-        delta = output - best_input
+        if cached is not None:
+            best_input, delta = cached
+        else:
+            best_input = find_optimal_amount(pools, xatol=config['xatol'], fatol=config['fatol'])
+            delta = simulate_swaps(pools=pools, amount=best_input) - best_input if best_input > 0 else 0.
+            if cache is not None:
+                cache.put(key, (best_input, delta))
+
+        if best_input <= 0:
+            continue
 
         dollars_delta = float(starters[from_asset]['current_price']) * delta
 
@@ -66,4 +276,197 @@ def find_transactions(cycle, amm, config, starters):
 
         transactions.append(transaction)
 
+    if cache is not None:
+        cache.report()
+
     return transactions
+
+
+def find_all_transactions(cycles, changes, amm, config, starters,
+                          top_k: Optional[int] = None) -> Tuple[List[Transaction], int]:
+    """
+    Same as calling find_transactions on every cycle, but every candidate route is optimized
+    in a single RouteBatch, best profit bound first
+    :param changes: cycles change rates, as computed by CycleMatrix.score
+    :param top_k: only keep the top_k most profitable transactions, in a heap filled as they are found. The
+        routes left are not optimized once none of them can beat the top_k
+    return :
+       - transactions:   Profitable transactions, the top_k best when top_k is set
+       - opportunities:  Number of profitable routes found before keeping the top_k (the routes left by the
+                         early exit are not counted)
+    """
+    candidates = []
+    for cycle, change in zip(cycles, changes):
+        if change < 0:
+            continue
+        for pools in amm.all_pools_with_cycle(cycle):
+            if len(pools) == 0:
+                continue
+            candidates.append((cycle, change, pools))
+
+    if len(candidates) == 0:
+        return [], 0
+
+    batch = RouteBatch([pools for _, _, pools in candidates])
+    prices = np.array([float(starters[cycle[0]]['current_price']) for cycle, _, _ in candidates])
+    solved, best_inputs, deltas = batch.solve_best_first(prices, config['minimum_dollars_delta'], top_k=top_k,
+                                                         xatol=config['xatol'], fatol=config['fatol'],
+                                                         cache=get_route_cache())
+    get_metrics().count("routes_optimized", len(solved))
+    get_metrics().count("routes_pruned", len(candidates) - len(solved))
+
+    transactions = []  # min-heap of the best transactions when top_k is set
+    opportunities = 0
+    for n, best_input, delta in zip(solved, best_inputs, deltas):
+        if best_input <= 0:
+            continue
+
+        cycle, change, pools = candidates[n]
+        from_asset = cycle[0]
+        dollars_delta = prices[n] * delta
+
+        if dollars_delta <= config['minimum_dollars_delta']:
+            continue
+
+        opportunities += 1
+        full = top_k is not None and len(transactions) >= top_k
+        if full and dollars_delta <= transactions[0].dollars_delta:
+            continue
+
+        transaction = Transaction(dollars_delta=dollars_delta, delta=float(delta), pools=pools, cycle=cycle,
+                                  from_asset=from_asset, best_input=float(best_input), change=float(change))
+
+        if full:
+            heapq.heapreplace(transactions, transaction)
+        elif top_k is not None:
+            heapq.heappush(transactions, transaction)
+        else:
+            transactions.append(transaction)
+
+    return transactions, opportunities
+
+
+def select_disjoint(transactions: List[Transaction], max_count: int,
+                    excluded: Optional[Set[str]] = None) -> List[Transaction]:
+    """
+    Most profitable transactions that have no pool in common, so that they can all be sent in the same block
+    without one moving the reserves of another. Greedy by decreasing dollars_delta : the best one is always
+    sent, an exact set packing is not worth it for a few transactions.
+    :param excluded: pool ids that no selected transaction may use, e.g. those of the transactions in flight
+    """
+    selected = []
+    used = set(excluded or ())  # pool ids of the selected transactions, both directions of a pool share it
+    for transaction in sorted(transactions, reverse=True):
+        pool_ids = {pool.idx for pool in transaction.pools}
+        if used & pool_ids:
+            continue
+
+        selected.append(transaction)
+        used |= pool_ids
+        if len(selected) >= max_count:
+            break
+
+    return selected
+
+
+def _tree_path(predecessors: Dict[str, str], ancestor: str, symbol: str, max_length: int) -> Optional[List[str]]:
+    """
+    Path of the predecessors graph from ancestor to symbol, in swap order, None if it has more than max_length
+    assets : the walk up from symbol stops after max_length - 1 hops
+    """
+    walk = [symbol]
+    while walk[-1] != ancestor:
+        if len(walk) >= max_length or walk[-1] not in predecessors:
+            return None
+        walk.append(predecessors[walk[-1]])
+    return walk[::-1]
+
+
+def _rotate_to_sources(cycle: List[str], sources: List[str]) -> Optional[List[str]]:
+    """ Rotate a cycle so that it starts with its first asset in the sources order, None if it has none """
+    for source in sources:
+        if source in cycle:
+            index = cycle.index(source)
+            return cycle[index:] + cycle[:index]
+    return None
+
+
+def find_negative_cycles(amm, sources: List[str], previous_cycles: List[List[str]] = None,
+                         max_cycles: int = None, max_length: int = None) -> List[List[str]]:
+    """
+    Search profitable cycles directly in the AMM with a queue-based Bellman-Ford (SPFA) from each source,
+    on edge weights -change (a profitable cycle is a negative cycle). Every call starts from fresh distances :
+    labels of a previous call would be too low once the weights changed, and SPFA never raises a label.
+    Labels are kept to paths of less than max_length hops : longer ones could only close longer cycles, and
+    going around a negative cycle makes the path longer, so the search cannot go around it forever. A cycle is
+    found when it closes, with a walk of at most max_length hops up the predecessors.
+    :param sources: assets to start from, in priority order. Only cycles going through one of them are returned
+    :param previous_cycles: cycles found by the previous call, checked against the current weights and added
+        after those of the search if they are still profitable
+    :param max_cycles: stop once this many cycles are found
+    :param max_length: longest cycle to return, defaults to the number of assets
+    return :
+       - cycles:         Profitable cycles, rotated to start with their first source in priority order
+    """
+    adjacency = {}  # asset_symbol --> [(asset_symbol_dest, weight), ...]
+    for (symbol_1, symbol_2), edge in amm.edges.items():
+        adjacency.setdefault(symbol_1, []).append((symbol_2, -float(edge[0].change)))
+
+    max_length = min(max_length or len(amm.assets), len(amm.assets))
+
+    cycles = []
+    seen = set()
+
+    for source in sources:
+        if source not in adjacency:
+            continue
+
+        distance = {source: 0.}
+        predecessors = {}
+        hops = {source: 0}
+
+        queue = deque([source])
+        queued = {source}
+
+        while queue:
+            symbol = queue.popleft()
+            queued.discard(symbol)
+
+            for dest, weight in adjacency.get(symbol, []):
+                if distance[symbol] + weight >= distance.get(dest, np.inf):
+                    continue
+
+                # dest -> ... -> symbol -> dest is a negative cycle, do not propagate around it
+                cycle = _tree_path(predecessors, dest, symbol, max_length)
+                if cycle is not None:
+                    cycle = _rotate_to_sources(cycle, sources)
+                    if cycle is not None and tuple(cycle) not in seen and amm.compute_cycle(cycle) > 0:
+                        seen.add(tuple(cycle))
+                        cycles.append(cycle)
+                    continue
+                if dest == source or hops[symbol] + 1 >= max_length:
+                    continue
+
+                distance[dest] = distance[symbol] + weight
+                predecessors[dest] = symbol
+                hops[dest] = hops[symbol] + 1
+
+                if dest not in queued:
+                    queue.append(dest)
+                    queued.add(dest)
+
+            if max_cycles is not None and len(cycles) >= max_cycles:
+                break
+
+        if max_cycles is not None and len(cycles) >= max_cycles:
+            break
+
+    # Cycles of the previous call that the search did not reach, if they are still profitable
+    for cycle in previous_cycles or []:
+        if max_cycles is not None and len(cycles) >= max_cycles:
+            break
+        if tuple(cycle) not in seen and amm.compute_cycle(cycle) > 0:
+            seen.add(tuple(cycle))
+            cycles.append(cycle)
+
+    return cycles
@@ -0,0 +1,218 @@
+import atexit
+import itertools
+import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+from typing import List, Dict, Tuple, Optional
+
+import numpy as np
+
+from amm.amm import AMM
+from amm.batch import RouteBatch
+from amm.cycle_matrix import CycleMatrix
+from amm.engine import configure_route_cache, get_route_cache
+from amm.store import PoolStore
+from amm.transaction import Transaction
+
+
+class SharedArrays:
+    """
+    Named arrays in shared memory blocks. A block is only reallocated when an array outgrows it, workers
+    attach to the blocks through the layout.
+    """
+    def __init__(self):
+        self.blocks: Dict[str, shared_memory.SharedMemory] = {}
+        self.layout: Dict[str, Tuple[str, str, int]] = {}  # name --> (block name, dtype, length)
+
+    def write(self, name: str, array: np.ndarray):
+        array = np.ascontiguousarray(array)
+        block = self.blocks.get(name)
+        if block is None or block.size < array.nbytes:
+            if block is not None:
+                block.close()
+                block.unlink()
+            block = shared_memory.SharedMemory(create=True, size=max(2 * array.nbytes, 64))
+            self.blocks[name] = block
+
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        self.layout[name] = (block.name, array.dtype.str, len(array))
+
+    def close(self):
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+        self.layout = {}
+
+
+# Worker state, set once by _init_worker
+_matrix: Optional[np.ndarray] = None   # cycle index --> edge indices, as CycleMatrix.matrix
+_prices: Optional[np.ndarray] = None   # cycle index --> dollar price of its first asset
+_attached: Dict[str, shared_memory.SharedMemory] = {}  # block name --> block
+
+
+def _init_worker(matrix: np.ndarray, prices: np.ndarray, route_cache_size: int):
+    global _matrix, _prices
+    _matrix = matrix
+    _prices = prices
+    configure_route_cache(route_cache_size)
+
+
+def _attach(layout: Dict[str, Tuple[str, str, int]]) -> Dict[str, np.ndarray]:
+    """ Arrays of the layout, blocks that are not used anymore are closed """
+    names = {block_name for block_name, _, _ in layout.values()}
+    for block_name in list(_attached):
+        if block_name not in names:
+            _attached.pop(block_name).close()
+
+    arrays = {}
+    for name, (block_name, dtype, length) in layout.items():
+        if block_name not in _attached:
+            _attached[block_name] = shared_memory.SharedMemory(name=block_name)
+        arrays[name] = np.ndarray(length, dtype=dtype, buffer=_attached[block_name].buf)
+    return arrays
+
+
+def edge_rates(change: np.ndarray, offsets: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """
+    Best change rate of every edge given as a CSR table of store rows, -inf for edges without pools and 0 for
+    the padding slot, same values as CycleMatrix.edge_rates
+    """
+    num_edges = len(offsets) - 1
+    rates = np.full(num_edges + 1, -np.inf)
+    rates[num_edges] = 0.
+
+    counts = np.diff(offsets)
+    starts = offsets[:-1][counts > 0]
+    if len(starts):
+        rates[:num_edges][counts > 0] = np.maximum.reduceat(change[rows], starts)
+    return rates
+
+
+def _search_shard(task) -> Tuple[List[Tuple[int, Tuple[int, ...], float, float, float, float]], int]:
+    """
+    Score the cycles [start, stop) and optimize the routes of the profitable ones, on the pool state
+    in shared memory
+    return :
+       - candidates:     Best (cycle index, route rows, best_input, delta, dollars_delta, change), at most top_k
+       - opportunities:  Number of profitable routes before keeping the top_k
+    """
+    start, stop, layout, size, xatol, fatol, minimum_dollars_delta, top_k = task
+
+    arrays = _attach(layout)
+    store = PoolStore.view(arrays, size)
+    offsets, edge_rows = arrays['edge_offsets'], arrays['edge_rows']
+
+    rates = edge_rates(store.change, offsets, edge_rows)
+    padding = len(offsets) - 1
+
+    matrix = _matrix[start:stop]
+    changes = rates[matrix].sum(axis=1)
+
+    # Expand the profitable cycles into every combination of their pools
+    cycle_indices, routes = [], []
+    for n in np.flatnonzero(changes > 0):
+        hops = [edge_rows[offsets[edge]:offsets[edge + 1]] for edge in matrix[n] if edge != padding]
+        for route in itertools.product(*hops):
+            cycle_indices.append(start + n)
+            routes.append(route)
+
+    if len(routes) == 0:
+        return [], 0
+
+    rows = np.zeros((len(routes), matrix.shape[1]), dtype=np.int64)
+    mask = np.zeros(rows.shape, dtype=bool)
+    for n, route in enumerate(routes):
+        rows[n, :len(route)] = route
+        mask[n, :len(route)] = True
+
+    cycle_indices = np.array(cycle_indices)
+    prices = _prices[cycle_indices]
+
+    solved, best_inputs, deltas = RouteBatch.from_rows(store, rows, mask).solve_best_first(
+        prices, minimum_dollars_delta, top_k=top_k, xatol=xatol, fatol=fatol, cache=get_route_cache())
+    dollars_deltas = prices[solved] * deltas
+
+    kept = np.flatnonzero((best_inputs > 0) & (dollars_deltas > minimum_dollars_delta))
+    opportunities = len(kept)
+    if len(kept) > top_k:
+        kept = kept[np.argpartition(-dollars_deltas[kept], top_k)[:top_k]]
+
+    return [(int(cycle_indices[solved[n]]), tuple(int(row) for row in routes[solved[n]]), float(best_inputs[n]),
+             float(deltas[n]), float(dollars_deltas[n]), float(changes[cycle_indices[solved[n]] - start]))
+            for n in kept], opportunities
+
+
+class ParallelSearch:
+    """
+    Searches a compiled cycle list on a persistent pool of worker processes. The cycles are split in
+    contiguous shards, the pool state is copied once per step in shared memory instead of pickling the AMM,
+    and every shard only sends back its top_k candidates. Every worker keeps its own route cache.
+    """
+    def __init__(self, cycle_matrix: CycleMatrix, starters: Dict[str, Dict[str, float]], processes: int = None,
+                 top_k: int = 16, shards_per_process: int = 4, route_cache_size: int = 100000):
+        self.cycle_matrix = cycle_matrix
+        self.processes = processes or mp.cpu_count()
+        self.top_k = top_k
+
+        num_cycles = len(cycle_matrix)
+        bounds = np.linspace(0, num_cycles, min(self.processes * shards_per_process, max(num_cycles, 1)) + 1)
+        bounds = bounds.astype(int)
+        self.shards = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+        prices = cycle_matrix.start_prices(starters)
+        self.shared = SharedArrays()
+
+        # Workers must share the parent's resource tracker, or theirs unlink the blocks when they exit
+        resource_tracker.ensure_running()
+        self.pool = mp.Pool(self.processes, initializer=_init_worker,
+                            initargs=(cycle_matrix.matrix, prices, route_cache_size))
+
+        atexit.register(self.close)
+
+    def write(self, amm: AMM):
+        """
+        Copy the pool state and the pools of every compiled edge in shared memory
+        """
+        store = amm.store
+        store.change  # make sure the change rates are up to date
+        for field in PoolStore.fields:
+            self.shared.write(field, getattr(store, field))
+
+        edge_rows = [[pool.row for pool in amm.pools_between(start, end)] for start, end in self.cycle_matrix.edges]
+        offsets = np.zeros(len(edge_rows) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(rows) for rows in edge_rows])
+        self.shared.write('edge_offsets', offsets)
+        self.shared.write('edge_rows', np.fromiter(itertools.chain.from_iterable(edge_rows), dtype=np.int64,
+                                                   count=offsets[-1]))
+
+    def search(self, amm: AMM, config: dict) -> Tuple[List[Transaction], int]:
+        """
+        Same transactions as find_all_transactions on the profitable cycles, limited to the top_k best
+        of every shard
+        return :
+           - transactions:   Best transactions of every shard
+           - opportunities:  Number of profitable routes of all the shards, before keeping their top_k
+        """
+        self.write(amm)
+
+        tasks = [(start, stop, self.shared.layout, len(amm.store), config['xatol'], config['fatol'],
+                  config['minimum_dollars_delta'], self.top_k) for start, stop in self.shards]
+        results = self.pool.map(_search_shard, tasks, chunksize=1)
+
+        pools = {pool.row: pool for pool in amm.directed.values()}
+
+        transactions = []
+        candidates = itertools.chain.from_iterable(shard_candidates for shard_candidates, _ in results)
+        for cycle_index, rows, best_input, delta, dollars_delta, change in candidates:
+            cycle = self.cycle_matrix.cycles[cycle_index]
+            transactions.append(Transaction(dollars_delta=dollars_delta, delta=delta,
+                                            pools=[pools[row] for row in rows], cycle=cycle, from_asset=cycle[0],
+                                            best_input=best_input, change=change))
+        return transactions, sum(opportunities for _, opportunities in results)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.shared.close()
@@ -1,18 +1,20 @@
 from typing import List
 import numpy as np
 from amm.asset import Asset
+from amm.store import PoolStore, POOL_TYPES
 
 
 class Pool:
     """
     A pool of assets. It swaps asset1 --> asset2.
+    Reserves, weights, fee and change rate live in a row of a PoolStore, the pool is a view on it.
     """
+    __slots__ = ['idx', 'asset_1', 'asset_2', 'symbol_1', 'symbol_2', '_store', '_row']
+
     def __init__(self, idx: str, asset_1: Asset, asset_2: Asset, swap_fee: float, amount_in, amount_out, wi, wo,
-                 pool_type='xyk'):
+                 pool_type='xyk', store: PoolStore = None):
 
         self.idx = idx
-        self.swap_fee = swap_fee
-        self.r = (1 - self.swap_fee)
 
         self.asset_1 = asset_1
         self.asset_2 = asset_2
@@ -20,18 +22,83 @@ class Pool:
         self.symbol_1 = asset_1.symbol
         self.symbol_2 = asset_2.symbol
 
-        self.i = amount_in
-        self.o = amount_out
-        self.wi = wi
-        self.wo = wo
-
-        self.pool_type = pool_type
-
-        if pool_type == 'xyk':
-            self.change = np.log(self.o / self.i) + np.log(self.wi / self.wo) + np.log(self.r)
-
-        elif pool_type == 'stable':
-            self.change = np.log(self.wi / self.wo) + np.log(self.r)
+        if store is None:
+            store = PoolStore(capacity=1)
+
+        self._store = store
+        self._row = store.append(amount_in, amount_out, wi, wo, 1 - swap_fee, pool_type)
+
+    @classmethod
+    def view(cls, store: PoolStore, row: int, idx: str, asset_1: Asset, asset_2: Asset) -> 'Pool':
+        """
+        Pool on a row already written in the store
+        """
+        pool = cls.__new__(cls)
+        pool.idx = idx
+        pool.asset_1 = asset_1
+        pool.asset_2 = asset_2
+        pool.symbol_1 = asset_1.symbol
+        pool.symbol_2 = asset_2.symbol
+        pool._store = store
+        pool._row = row
+        return pool
+
+    def bind(self, store: PoolStore):
+        """
+        Move this pool's row to the given store, the pool becomes a view on it
+        """
+        if store is self._store:
+            return
+
+        old, row = self._store, self._row
+        self._row = store.append(old._reserves_in[row], old._reserves_out[row], old._wi[row], old._wo[row],
+                                 old._r[row], self.pool_type)
+        self._store = store
+
+    @property
+    def store(self) -> PoolStore:
+        return self._store
+
+    @property
+    def row(self) -> int:
+        return self._row
+
+    # Reserves are read only : AMM.refresh updates them and keeps the pools of every edge sorted by change
+
+    @property
+    def i(self):
+        return self._store._reserves_in[self._row]
+
+    @property
+    def o(self):
+        return self._store._reserves_out[self._row]
+
+    @property
+    def wi(self):
+        return self._store._wi[self._row]
+
+    @property
+    def wo(self):
+        return self._store._wo[self._row]
+
+    @property
+    def r(self):
+        return self._store._r[self._row]
+
+    @property
+    def swap_fee(self):
+        return 1 - self.r
+
+    @property
+    def pool_type(self) -> str:
+        return POOL_TYPES[self._store._type_code[self._row]]
+
+    @property
+    def change(self):
+        store = self._store
+        if store.stale:
+            store.update_changes()
+        return store._change[self._row]
 
     def simulate_swap(self, amount):
         if self.pool_type == 'xyk':
@@ -52,6 +119,28 @@ class Pool:
             Ao = min(self.o, Ai * self.wi / self.wo * self.r)
             return Ao
 
+    def simulate_swap_derivatives(self, amount):
+        """
+        Output amount of the swap with its first and second derivatives with respect to the input amount
+        """
+        if self.pool_type == 'xyk':
+            i = self.i
+            r = self.r
+            w = self.wi / self.wo
+            base = i + amount * r
+
+            Ao = self.o * (1 - (i / base) ** w)
+            dAo = self.o * w * r / base * (i / base) ** w
+            d2Ao = -(w + 1) * r / base * dAo
+
+            return Ao, dAo, d2Ao
+
+        elif self.pool_type == 'stable':
+            rate = self.wi / self.wo * self.r
+            if amount * rate < self.o:
+                return amount * rate, rate, 0.
+            return self.o, 0., 0.
+
     def __repr__(self):
         return f'{self.idx} {self.symbol_1} =={np.round(self.change, 2)}==> {self.symbol_2}'
 
@@ -0,0 +1,187 @@
+from typing import List
+import numpy as np
+
+POOL_TYPES = ['xyk', 'stable']
+POOL_TYPE_CODES = {pool_type: code for code, pool_type in enumerate(POOL_TYPES)}
+
+
+class PoolStore:
+    """
+    Struct-of-arrays storage for directed pools: one row per pool, one contiguous array per field.
+    Pool objects are lightweight handles on a row of a store.
+    """
+    fields = ['reserves_in', 'reserves_out', 'wi', 'wo', 'r', 'change', 'type_code']
+
+    def __init__(self, capacity: int = 64):
+        self.size = 0
+        self.capacity = 0
+        self._stale: List[int] = []  # rows updated in place since the last change computation
+        self._computed = 0           # rows appended before this one have an up to date change
+
+        self._reserves_in = np.empty(0)
+        self._reserves_out = np.empty(0)
+        self._wi = np.empty(0)
+        self._wo = np.empty(0)
+        self._r = np.empty(0)
+        self._change = np.empty(0)
+        self._type_code = np.empty(0, dtype=np.int8)
+
+        self.reserve(capacity)
+
+    @classmethod
+    def view(cls, arrays: dict, size: int) -> 'PoolStore':
+        """
+        Read-only store on existing arrays (e.g. in shared memory), field --> array of at least size rows.
+        Change rates are taken as they are.
+        """
+        store = cls.__new__(cls)
+        store.size = size
+        store.capacity = size
+        store._stale = []
+        store._computed = size
+        for field in cls.fields:
+            setattr(store, f'_{field}', arrays[field])
+        return store
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, n: int):
+        """
+        Make room for n more pools without reallocating
+        """
+        if self.size + n <= self.capacity:
+            return
+
+        capacity = max(self.size + n, 2 * self.capacity)
+        for field in self.fields:
+            old = getattr(self, f'_{field}')
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, f'_{field}', new)
+        self.capacity = capacity
+
+    def append(self, amount_in, amount_out, wi, wo, r, pool_type='xyk') -> int:
+        """
+        Add a pool and return its row
+        """
+        self.reserve(1)
+        row = self.size
+
+        self._reserves_in[row] = amount_in
+        self._reserves_out[row] = amount_out
+        self._wi[row] = wi
+        self._wo[row] = wo
+        self._r[row] = r
+        self._type_code[row] = POOL_TYPE_CODES[pool_type]
+
+        self.size += 1
+        return row
+
+    def extend(self, reserves_in, reserves_out, wi, wo, r, type_code) -> int:
+        """
+        Add many pools at once from arrays and return the row of the first one
+        """
+        n = len(reserves_in)
+        self.reserve(n)
+        row = self.size
+
+        self._reserves_in[row:row + n] = reserves_in
+        self._reserves_out[row:row + n] = reserves_out
+        self._wi[row:row + n] = wi
+        self._wo[row:row + n] = wo
+        self._r[row:row + n] = r
+        self._type_code[row:row + n] = type_code
+
+        self.size += n
+        return row
+
+    def update(self, row: int, amount_in, amount_out, wi, wo, r) -> bool:
+        """
+        Overwrite a pool state in place, return whether it changed
+        """
+        if self._reserves_in[row] == amount_in and self._reserves_out[row] == amount_out and \
+                self._wi[row] == wi and self._wo[row] == wo and self._r[row] == r:
+            return False
+
+        self._reserves_in[row] = amount_in
+        self._reserves_out[row] = amount_out
+        self._wi[row] = wi
+        self._wo[row] = wo
+        self._r[row] = r
+        self.mark_stale(row)
+        return True
+
+    def update_rows(self, rows: np.ndarray, reserves_in, reserves_out, wi, wo, r) -> np.ndarray:
+        """
+        Same as update on many rows at once from arrays, return whether each of them changed
+        """
+        changed = (self._reserves_in[rows] != reserves_in) | (self._reserves_out[rows] != reserves_out) | \
+            (self._wi[rows] != wi) | (self._wo[rows] != wo) | (self._r[rows] != r)
+
+        updated = rows[changed]
+        self._reserves_in[updated] = np.asarray(reserves_in)[changed]
+        self._reserves_out[updated] = np.asarray(reserves_out)[changed]
+        self._wi[updated] = np.asarray(wi)[changed]
+        self._wo[updated] = np.asarray(wo)[changed]
+        self._r[updated] = np.asarray(r)[changed]
+        self._stale.extend(updated.tolist())
+        return changed
+
+    def mark_stale(self, row: int):
+        self._stale.append(row)
+
+    @property
+    def stale(self) -> bool:
+        return self._computed < self.size or len(self._stale) > 0
+
+    def update_changes(self):
+        """
+        Compute the change rate of every appended or updated pool in one vectorized pass
+        """
+        rows = np.arange(self._computed, self.size)
+        if self._stale:
+            rows = np.union1d(rows, self._stale)
+
+        i = self._reserves_in[rows]
+        o = self._reserves_out[rows]
+
+        change = np.log(self._wi[rows] / self._wo[rows]) + np.log(self._r[rows])
+
+        xyk = self._type_code[rows] == POOL_TYPE_CODES['xyk']
+        change[xyk] += np.log(o[xyk] / i[xyk])
+
+        self._change[rows] = change
+
+        self._computed = self.size
+        self._stale = []
+
+    @property
+    def reserves_in(self) -> np.ndarray:
+        return self._reserves_in[:self.size]
+
+    @property
+    def reserves_out(self) -> np.ndarray:
+        return self._reserves_out[:self.size]
+
+    @property
+    def wi(self) -> np.ndarray:
+        return self._wi[:self.size]
+
+    @property
+    def wo(self) -> np.ndarray:
+        return self._wo[:self.size]
+
+    @property
+    def r(self) -> np.ndarray:
+        return self._r[:self.size]
+
+    @property
+    def change(self) -> np.ndarray:
+        if self.stale:
+            self.update_changes()
+        return self._change[:self.size]
+
+    @property
+    def type_code(self) -> np.ndarray:
+        return self._type_code[:self.size]
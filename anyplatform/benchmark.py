@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import itertools
+from typing import List, Dict, Callable, Optional
+
+import numpy as np
+from loguru import logger
+
+from amm import AMM, CycleMatrix, Pool
+from amm.engine import find_optimal_amount
+from utils.cycles import save_available_cycles
+from anyplatform.query import generate_market
+
+script_dir = os.path.dirname(__file__)
+
+priorities = ['A0', 'A1']
+
+
+def timed(function: Callable, repeat: int = 1) -> float:
+    """Best wall time of function() over the given number of runs, in seconds"""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_market(num_pools: int, seed: int = 0, max_hops: int = 3, samples: int = 1000, steps: int = 3,
+                     app_factory: Optional[Callable] = None) -> Dict[str, float]:
+    """
+    Time every stage of the engine on a synthetic market of the given number of pools (num_pools / 5 assets)
+    :param app_factory: builds an App stepping on the market, from a function returning the pools of a step
+    :return: stage --> seconds (per call for the stages measured on samples)
+    """
+    num_assets = max(20, num_pools // 5)
+
+    def pools(step: int = 0) -> List[Pool]:
+        return generate_market(num_assets, num_pools, seed=seed, step=step)
+
+    results = {"num_assets": num_assets, "num_pools": num_pools}
+
+    results["generate_market"] = timed(pools)
+    market = pools()
+    results["amm_construction"] = timed(lambda: AMM("anyplatform", pools=pools()), repeat=3)
+    amm = AMM("anyplatform", pools=market)
+
+    cycles = []
+
+    def enumerate_cycles():
+        cycles[:] = save_available_cycles("anyplatform", amm=amm, priorities=priorities, max_hops=max_hops)
+
+    results["save_available_cycles"] = timed(enumerate_cycles)
+    results["num_cycles"] = len(cycles)
+
+    sample = cycles[:samples]
+    results["compute_cycle"] = timed(lambda: [amm.compute_cycle(cycle) for cycle in sample]) / max(len(sample), 1)
+
+    cycle_matrix = CycleMatrix(cycles)
+    results["cycle_matrix_score"] = timed(lambda: cycle_matrix.score(amm), repeat=3)
+
+    routes = list(itertools.islice((pools for cycle in cycles for pools in amm.all_pools_with_cycle(cycle)),
+                                   samples))
+    results["find_optimal_amount"] = timed(lambda: [find_optimal_amount(route, xatol=0.01, fatol=0.01)
+                                                    for route in routes]) / max(len(routes), 1)
+
+    if app_factory is not None:
+        step_count = itertools.count(1)
+        app = app_factory(lambda: pools(step=next(step_count)))
+        results["app_step"] = timed(app.step, repeat=steps)
+
+    return results
+
+
+def run(sizes=(100, 1000, 10000), seed: int = 0, app_factory: Optional[Callable] = None,
+        output: Optional[str] = None) -> dict:
+    """
+    Run the benchmarks for every market size and save them as JSON in input_data/benchmarks
+    """
+    report = {"timestamp": time.time(), "seed": seed, "results": {}}
+
+    for num_pools in sizes:
+        logger.info(f'Benchmarking {num_pools} pools')
+        report["results"][str(num_pools)] = results = benchmark_market(num_pools, seed=seed, app_factory=app_factory)
+        logger.info(f'{results}')
+
+    if output is None:
+        output = os.path.join(script_dir, f"../input_data/benchmarks/benchmark-{int(report['timestamp'])}.json")
+    os.makedirs(os.path.split(output)[0], exist_ok=True)
+    with open(output, "w") as f:
+        f.write(json.dumps(report, indent=4))
+
+    logger.info(f'Benchmark saved to {output}')
+    return report
+
+
+if __name__ == "__main__":
+    run()
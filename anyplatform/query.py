@@ -7,6 +7,7 @@ from amm import *
 from utils import fetch_raw_data
 import random
 import string
+import numpy as np
 
 script_dir = os.path.dirname(__file__)
 
@@ -14,14 +15,15 @@ script_dir = os.path.dirname(__file__)
 def fetch_pools(regenerate=True) -> List[Pool]:
 
     pools = []
+    store = PoolStore(capacity=20)
     for _ in range(10):
 
         amount_token0 = random.randint(1, 100)
         amount_token1 = random.randint(1, 100)
 
         # random string with 3 chars
-        symbol_token0 = random.choices(list(string.ascii_lowercase), k=3)
-        symbol_token1 = random.choices(list(string.ascii_lowercase), k=3)
+        symbol_token0 = ''.join(random.choices(list(string.ascii_lowercase), k=3))
+        symbol_token1 = ''.join(random.choices(list(string.ascii_lowercase), k=3))
 
         pool_idx = str(random.randint(0, 1000))
 
@@ -32,10 +34,80 @@ def fetch_pools(regenerate=True) -> List[Pool]:
         asset_2 = Asset(symbol=symbol_token1, denom=symbol_token1)
 
         pools.append(Pool(idx=pool_idx, asset_1=asset_1, asset_2=asset_2, swap_fee=0.003,
-                          amount_in=amount_token0, amount_out=amount_token1, wi=1, wo=1))
+                          amount_in=amount_token0, amount_out=amount_token1, wi=1, wo=1, store=store))
 
         pools.append(Pool(idx=pool_idx, asset_1=asset_2, asset_2=asset_1, swap_fee=0.003,
-                          amount_in=amount_token1, amount_out=amount_token0, wi=1, wo=1))
+                          amount_in=amount_token1, amount_out=amount_token0, wi=1, wo=1, store=store))
+
+    return pools
+
+
+def generate_market(num_assets: int, num_pools: int, seed: int = 0, hub_exponent: float = 1.2,
+                    weighted_share: float = 0.2, stable_share: float = 0.1, mispricing: float = 0.002,
+                    step: int = 0) -> List[Pool]:
+    """
+    Seeded synthetic market. Assets are named A0, A1, ... by decreasing connectivity : the assets of each
+    pool are drawn with a probability proportional to rank ** -hub_exponent, so a few hubs get most pools.
+    Pools are a mix of xyk, weighted xyk (80/20 or 67/33) and stable pools, priced from random asset prices
+    with a small random mispricing. A0 is worth 1 and A1 is worth 10.
+    :param num_pools: number of distinct pairs, at most num_assets * (num_assets - 1) / 2
+    :param step: reserves of the same market drift with the step, the topology does not change
+    """
+    rng = np.random.default_rng(seed)
+
+    prices = np.exp(rng.normal(0, 2, size=num_assets))
+    prices[:2] = 1, 10
+
+    popularity = np.arange(1, num_assets + 1) ** -hub_exponent
+    popularity /= popularity.sum()
+
+    # Distinct pairs, so that routes do not multiply through parallel pools
+    pair_assets = []
+    pairs = set()
+    while len(pair_assets) < num_pools:
+        candidates = rng.choice(num_assets, size=(2 * num_pools, 2), p=popularity)
+        for a, b in candidates:
+            if a == b or (min(a, b), max(a, b)) in pairs:
+                continue
+            pairs.add((min(a, b), max(a, b)))
+            pair_assets.append((a, b))
+            if len(pair_assets) == num_pools:
+                break
+
+    liquidity = np.exp(rng.normal(np.log(1e6), 1.5, size=num_pools))  # in A0
+    kinds = rng.choice(['xyk', 'weighted', 'stable'], size=num_pools,
+                       p=[1 - weighted_share - stable_share, weighted_share, stable_share])
+    weights = rng.choice([4, 2], size=num_pools)
+
+    # Reserves move a bit from one step to the next
+    drift = np.random.default_rng([seed, step]).normal(0, mispricing, size=(num_pools, 2)) if step else 0
+    noise = np.exp(rng.normal(0, mispricing, size=(num_pools, 2)) + drift)
+
+    store = PoolStore(capacity=2 * num_pools)
+    assets = [Asset(symbol=f"A{k}", denom=f"a{k}") for k in range(num_assets)]
+
+    pools = []
+    for n in range(num_pools):
+        a, b = pair_assets[n]
+        asset_1, asset_2 = assets[a], assets[b]
+
+        if kinds[n] == 'stable':
+            # The stable model swaps at the weights ratio, until the output reserve is empty
+            amount_1 = liquidity[n] / prices[a] * noise[n, 0]
+            amount_2 = liquidity[n] / prices[b] * noise[n, 1]
+            w1, w2 = prices[a] * noise[n, 0], prices[b] * noise[n, 1]
+            pool_type, swap_fee = 'stable', 0.0005
+        else:
+            w1, w2 = (weights[n], 1) if kinds[n] == 'weighted' else (1, 1)
+            amount_1 = liquidity[n] * w1 / (w1 + w2) / prices[a] * noise[n, 0]
+            amount_2 = liquidity[n] * w2 / (w1 + w2) / prices[b] * noise[n, 1]
+            pool_type, swap_fee = 'xyk', 0.003
+
+        pools.append(Pool(idx=str(n), asset_1=asset_1, asset_2=asset_2, swap_fee=swap_fee, amount_in=amount_1,
+                          amount_out=amount_2, wi=w1, wo=w2, pool_type=pool_type, store=store))
+
+        pools.append(Pool(idx=str(n), asset_1=asset_2, asset_2=asset_1, swap_fee=swap_fee, amount_in=amount_2,
+                          amount_out=amount_1, wi=w2, wo=w1, pool_type=pool_type, store=store))
 
     return pools
 
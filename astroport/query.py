@@ -4,10 +4,15 @@ import attr
 from typing import List, Dict
 
 from amm import *
-from utils import fetch_raw_data
+from utils import fetch_raw_data, loads
+from utils.async_fetcher import AsyncFetcher, retry
+from utils.recorder import get_recorder
+from utils.metrics import get_metrics
 import requests
+import asyncio
 
 script_dir = os.path.dirname(__file__)
+graphql_url = "https://hive-terra.everstake.one/graphql"
 
 
 @attr.s
@@ -114,14 +119,40 @@ def fetch_astroport_pairs() -> List[AstroportPair]:
 
 
 def fetch_astroport_amounts(pairs: List[AstroportPair]) -> Dict[str, AstroportAmounts]:
-    url = "https://hive-terra.everstake.one/graphql"
-    local_file = script_dir + "/../input_data/dynamic/astroport/amounts.json"
     data_raw = {"query": _build_query_amounts(pairs)}
-    raw_data = requests.post(url, json=data_raw)
-    raw_amounts = raw_data.json()
-    with open(local_file, "w+") as f:
-        f.write(json.dumps(raw_amounts, indent=4))
+    with get_metrics().timer("pool_fetch"):
+        raw_data = requests.post(graphql_url, json=data_raw)
+        raw_amounts = raw_data.json()
+    save_astroport_amounts(raw_amounts)
+
+    with get_metrics().timer("parse"):
+        return parse_astroport_amounts(raw_amounts)
+
+
+async def async_fetch_astroport_amounts(fetcher: AsyncFetcher, pairs: List[AstroportPair],
+                                        chunk_size=50) -> Dict[str, AstroportAmounts]:
+    """Same as fetch_astroport_amounts, the query is split in chunks of pairs sent concurrently"""
+    chunks = [pairs[k:k + chunk_size] for k in range(0, len(pairs), chunk_size)]
+    with get_metrics().timer("pool_fetch"):
+        responses = await asyncio.gather(*[fetcher.post_raw_data(graphql_url, {"query": _build_query_amounts(chunk)})
+                                           for chunk in chunks])
+
+    raw_amounts = {"data": {}}
+    for response in responses:
+        raw_amounts["data"].update(response["data"])
+    save_astroport_amounts(raw_amounts)
+
+    with get_metrics().timer("parse"):
+        return parse_astroport_amounts(raw_amounts)
+
+
+def save_astroport_amounts(raw_amounts):
+    """Record the response in the background, amounts.json keeps the latest one"""
+    local_file = script_dir + "/../input_data/dynamic/astroport/amounts.json"
+    get_recorder().record("astroport/amounts", raw_amounts, latest_path=local_file)
 
+
+def parse_astroport_amounts(raw_amounts) -> Dict[str, AstroportAmounts]:
     dict_amounts = {pair_addr: AstroportAmounts.from_data(
         raw_amounts["data"][pair_addr], pair_addr) for pair_addr in raw_amounts["data"]}
 
@@ -129,9 +160,22 @@ def fetch_astroport_amounts(pairs: List[AstroportPair]) -> Dict[str, AstroportAm
 
 
 def fetch_pools(regenerate=True) -> List[Pool]:
+    """Parsed pools of the pairs, without building the AMM : they can refresh an existing model in place"""
     lst_pairs = fetch_astroport_pairs()
+
+    error = None
+    for attempt in range(10):
+        try:
+            dict_amounts = fetch_astroport_amounts(lst_pairs)
+            return build_pools(lst_pairs, dict_amounts)
+        except Exception as e:
+            error = e
+
+    raise error
+
+
+def build_pools(lst_pairs: List[AstroportPair], dict_amounts: Dict[str, AstroportAmounts]) -> List[Pool]:
     dict_pairs = {pair.contract_addr: pair for pair in lst_pairs}
-    dict_amounts = fetch_astroport_amounts(lst_pairs)
 
     pair_type_to_fee = {
         "xyk": 0.003,
@@ -139,6 +183,7 @@ def fetch_pools(regenerate=True) -> List[Pool]:
     }
 
     pools = []
+    store = PoolStore(capacity=2 * len(dict_amounts))
     for pair_addr, astroport_amount in dict_amounts.items():
 
         astroport_pair = dict_pairs[pair_addr]
@@ -156,27 +201,58 @@ def fetch_pools(regenerate=True) -> List[Pool]:
             continue
 
         pools.append(Pool(idx=pair_addr, asset_1=asset_1, asset_2=asset_2, swap_fee=swap_fee,
-                          amount_in=amount_1, amount_out=amount_2, wi=1, wo=1, pool_type=pair_type))
+                          amount_in=amount_1, amount_out=amount_2, wi=1, wo=1, pool_type=pair_type,
+                          store=store))
 
         pools.append(Pool(idx=pair_addr, asset_1=asset_2, asset_2=asset_1, swap_fee=swap_fee,
-                          amount_in=amount_2, amount_out=amount_1, wi=1, wo=1, pool_type=pair_type))
+                          amount_in=amount_2, amount_out=amount_1, wi=1, wo=1, pool_type=pair_type,
+                          store=store))
 
     return pools
 
 
 def make_model(regenerate=True) -> AMM:
     """Create the model"""
-    for attempt in range(10):
-        try:
-            pools = fetch_pools(regenerate=True)
+    pools = fetch_pools(regenerate=True)
 
-            m_amm = AMM("terraswap", pools=pools)
+    with get_metrics().timer("amm_build"):
+        return AMM("terraswap", pools=pools)
 
-            return m_amm
-        except Exception as e:
-            pass
 
-    raise e
+async def async_fetch_pools(fetcher: AsyncFetcher, regenerate=True) -> List[Pool]:
+    """Same as fetch_pools, with the shared async fetcher"""
+    lst_pairs = fetch_astroport_pairs()
+
+    async def attempt():
+        dict_amounts = await async_fetch_astroport_amounts(fetcher, lst_pairs)
+        return build_pools(lst_pairs, dict_amounts)
+
+    return await retry(attempt)
+
+
+async def async_make_model(fetcher: AsyncFetcher, regenerate=True) -> AMM:
+    """Same as make_model, with the shared async fetcher"""
+    pools = await async_fetch_pools(fetcher, regenerate)
+
+    with get_metrics().timer("amm_build"):
+        return AMM("terraswap", pools=pools)
+
+
+def pools_from_snapshot(raw_amounts: bytes) -> List[Pool]:
+    """Parse a recorded amounts response, without any network call"""
+    lst_pairs = fetch_astroport_pairs()
+    with get_metrics().timer("parse"):
+        dict_amounts = parse_astroport_amounts(loads(raw_amounts))
+
+    return build_pools(lst_pairs, dict_amounts)
+
+
+def make_model_from_snapshot(raw_amounts: bytes) -> AMM:
+    """Build the model from a recorded amounts response, without any network call"""
+    pools = pools_from_snapshot(raw_amounts)
+
+    with get_metrics().timer("amm_build"):
+        return AMM("terraswap", pools=pools)
 
 
 if __name__ == "__main__":
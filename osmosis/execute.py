@@ -1,6 +1,7 @@
 from typing import List
 from amm import Pool
 from utils.fetcher import fetch_raw_data
+from utils.async_fetcher import AsyncFetcher
 from subprocess import Popen, PIPE
 
 
@@ -12,19 +13,51 @@ def get_account_sequence(account):
     return sequence
 
 
-def build_swap_command(transaction, amount_in, sequence, fees) -> str:
-    """Builds the command to send to the blockchain"""
+async def async_get_account_sequence(fetcher: AsyncFetcher, account):
+    """Same as get_account_sequence, with the shared async fetcher"""
+    url = f"https://osmosis.stakesystems.io/auth/accounts/{account}"
+    raw_data = await fetcher.fetch_raw_data(url)
+    sequence = raw_data["result"]["value"]["sequence"]
+    return sequence
+
+
+def get_tx_result(txhash):
+    """
+    Result of a transaction, None while it is not in a block
+    return :
+       - code:           0 on success, 11 when out of gas
+       - gas_used:       Gas used
+       - gas_wanted:     Gas limit of the transaction
+       - height:         Block the transaction is in
+    """
+    url = f"https://osmosis.stakesystems.io/cosmos/tx/v1beta1/txs/{txhash}"
+    raw_data = fetch_raw_data(url)
+    if "tx_response" not in raw_data:
+        # tx not found, it is not in a block yet
+        return None
+    tx_response = raw_data["tx_response"]
+    return int(tx_response["code"]), int(tx_response["gas_used"]), int(tx_response["gas_wanted"]), \
+        int(tx_response["height"])
+
+
+def build_swap_command(transaction, amount_in, sequence, fees, gas=None) -> str:
+    """
+    Builds the command to send to the blockchain
+    :param gas: gas limit, simulated by osmosisd when None
+    """
     denom_in = transaction.pools[0].asset_1.denom
     min_amount_out = amount_in
 
     base = "osmosisd tx gamm swap-exact-amount-in "
 
+    gas_flags = f"--gas {gas}" if gas else "--gas auto --gas-adjustment 1.2"
+
     if sequence:
         tail = f"--from=arbitrage --keyring-backend test --chain-id=osmosis-1 --fees={fees}uosmo" \
-               f" --gas auto --gas-adjustment 1.2 --sequence={sequence} -y"
+               f" {gas_flags} --sequence={sequence} -y"
     else:
         tail = f"--from=arbitrage --keyring-backend test --chain-id=osmosis-1 --fees={fees}uosmo" \
-               f" --gas auto --gas-adjustment 1.2 -y"
+               f" {gas_flags} -y"
 
     initial = f"{amount_in}{denom_in} {min_amount_out} "
 
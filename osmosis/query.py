@@ -1,106 +1,120 @@
 from typing import List, Dict
 import json
-import attr
 import os
 
-from utils import fetch_raw_data
-from amm import AMM, Pool, Asset
+import asyncio
+
+import numpy as np
+
+from utils import fetch_raw_data, fetch_raw_bytes, loads
+from utils.async_fetcher import AsyncFetcher, retry
+from utils.recorder import get_recorder
+from utils.metrics import get_metrics
+from amm import AMM, Pool, Asset, PoolStore
+from amm.store import POOL_TYPE_CODES
 
 from loguru import logger
 
 script_dir = os.path.dirname(__file__)
 
-
-@attr.s
-class LCDPoolAsset:
-    token_denom: str = attr.ib()
-    token_amount: int = attr.ib(default=0)
-    weight: int = attr.ib(default=0)
-
-    @classmethod
-    def from_data(cls, data):
-        return cls(
-            token_denom=data['token']['denom'],
-            token_amount=int(data['token']['amount']),
-            weight=int(data['weight'])
-        )
-
-
-@attr.s
-class LCDPool:
-    address: str = attr.ib()
-    id: str = attr.ib()
-    swap_fee: float = attr.ib(default=0)
-    assets: List[LCDPoolAsset] = attr.ib(default=attr.Factory(list))
-    total_weight: int = attr.ib(default=0)
-
-    @classmethod
-    def from_data(cls, data):
-        return cls(
-            address=data['address'],
-            id=data['id'],
-            swap_fee=float(data['poolParams']['swapFee']),
-            assets=[LCDPoolAsset.from_data(asset)
-                    for asset in data['poolAssets']],
-            total_weight=int(data['totalWeight'])
-        )
+# pools_url = "https://lcd-osmosis.keplr.app/osmosis/gamm/v1beta1/pools?pagination.limit=750"
+pools_url = "https://osmosis.stakesystems.io/osmosis/gamm/v1beta1/pools?pagination.limit=1000&pagination.count_total=true"
+details_url = "https://api-osmosis.imperator.co/search/v1/pools"
 
 
 def get_pool_data_from_blockchain(regenerate) -> List[Pool]:
     """Read input_data from API, returns pools input_data"""
 
+    # Fetch and store input_data
+    with get_metrics().timer("pool_fetch"):
+        raw_pools_data = fetch_raw_bytes(pools_url)
+    save_pool_data(raw_pools_data)
+
+    denom_to_symbol = get_pool_additional_details(regenerate)
+
+    with get_metrics().timer("parse"):
+        return parse_raw_pool_data(raw_pools_data, denom_to_symbol)
+
+
+def save_pool_data(raw_pools_data: bytes):
+    """Record the response in the background, lcd_data.json keeps the latest one"""
     local_file = os.path.join(
         script_dir, "../input_data/dynamic/osmosis/lcd_data.json")
 
-    # pools_url = "https://lcd-osmosis.keplr.app/osmosis/gamm/v1beta1/pools?pagination.limit=750"
-    pools_url = "https://osmosis.stakesystems.io/osmosis/gamm/v1beta1/pools?pagination.limit=1000&pagination.count_total=true"
-
-    # Fetch and store input_data
-    pools_data = fetch_raw_data(pools_url)
-    os.makedirs(os.path.split(local_file)[0], exist_ok=True)
-    with open(local_file, "w+") as f:
-        f.write(json.dumps(pools_data, indent=4))
+    get_recorder().record("osmosis/lcd_data", raw_pools_data, latest_path=local_file)
 
-    denom_to_symbol = get_pool_additional_details(regenerate)
 
-    # Parse input_data
-    pools: List[Pool] = []
+def parse_raw_pool_data(raw_pools_data: bytes, denom_to_symbol: Dict[str, str]) -> List[Pool]:
+    """
+    Parse the pools of the LCD response body into Pools : pools are filtered on the decoded dicts and the
+    survivors are written in preallocated arrays, then in the store in one go
+    """
+    pools_data = loads(raw_pools_data)['pools']
 
-    for pool_data in pools_data['pools']:
-        lcd_pool = LCDPool.from_data(pool_data)
+    n = len(pools_data)
+    amounts = np.empty((n, 2))
+    weights = np.empty((n, 2))
+    swap_fees = np.empty(n)
+    ids = []
+    pool_assets = []
+    assets: Dict[str, Asset] = {}  # denom --> Asset, shared by every pool
 
-        lcd_asset_1 = lcd_pool.assets[0]
-        lcd_asset_2 = lcd_pool.assets[1]
+    for pool_data in pools_data:
+        data_1, data_2 = pool_data['poolAssets'][0], pool_data['poolAssets'][1]
+        denom_1 = data_1['token']['denom']
+        denom_2 = data_2['token']['denom']
 
-        symbol_1 = denom_to_symbol.get(lcd_asset_1.token_denom, '')
-        symbol_2 = denom_to_symbol.get(lcd_asset_2.token_denom, '')
+        symbol_1 = denom_to_symbol.get(denom_1, '')
+        symbol_2 = denom_to_symbol.get(denom_2, '')
 
-        # TODO : Improve these dirty filters
         if symbol_1 == '' or symbol_2 == '':
             continue
 
-        if lcd_asset_1.token_amount + lcd_asset_2.token_amount < 1e10 or \
-                lcd_asset_1.token_amount + lcd_asset_2.token_amount > 1e21:
+        amount_1 = int(data_1['token']['amount'])
+        amount_2 = int(data_2['token']['amount'])
+
+        if amount_1 + amount_2 < 1e10 or amount_1 + amount_2 > 1e21:
             continue
 
-        asset_1 = Asset(symbol=symbol_1, denom=lcd_asset_1.token_denom)
+        m = len(ids)
+        amounts[m] = amount_1, amount_2
+        weights[m] = int(data_1['weight']), int(data_2['weight'])
+        swap_fees[m] = float(pool_data['poolParams']['swapFee'])
+        ids.append(pool_data['id'])
 
-        amount_1 = lcd_asset_1.token_amount
-        w1 = lcd_asset_1.weight
+        if denom_1 not in assets:
+            assets[denom_1] = Asset(symbol=symbol_1, denom=denom_1)
+        if denom_2 not in assets:
+            assets[denom_2] = Asset(symbol=symbol_2, denom=denom_2)
+        pool_assets.append((assets[denom_1], assets[denom_2]))
 
-        asset_2 = Asset(symbol=symbol_2, denom=lcd_asset_2.token_denom)
-        amount_2 = lcd_asset_2.token_amount
-        w2 = lcd_asset_2.weight
+    # Both directions of each pool, interleaved
+    m = len(ids)
+    amounts = amounts[:m]
+    weights = weights[:m]
 
-        pools.append(Pool(idx=lcd_pool.id, swap_fee=lcd_pool.swap_fee, asset_1=asset_1, asset_2=asset_2,
-                          amount_in=amount_1, amount_out=amount_2, wi=w1, wo=w2))
+    store = PoolStore(capacity=2 * m)
+    row = store.extend(reserves_in=amounts.ravel(), reserves_out=amounts[:, ::-1].ravel(), wi=weights.ravel(),
+                       wo=weights[:, ::-1].ravel(), r=np.repeat(1 - swap_fees[:m], 2), type_code=POOL_TYPE_CODES['xyk'])
 
-        pools.append(Pool(idx=lcd_pool.id, swap_fee=lcd_pool.swap_fee, asset_1=asset_2, asset_2=asset_1,
-                          amount_in=amount_2, amount_out=amount_1, wi=w2, wo=w1))
+    pools: List[Pool] = []
+    for idx, (asset_1, asset_2) in zip(ids, pool_assets):
+        pools.append(Pool.view(store, row, idx=idx, asset_1=asset_1, asset_2=asset_2))
+        pools.append(Pool.view(store, row + 1, idx=idx, asset_1=asset_2, asset_2=asset_1))
+        row += 2
 
     return pools
 
 
+def parse_pool_additional_details(details_data) -> Dict[str, str]:
+    denom_to_symbol: Dict[str, str] = {}
+    for assets in details_data.values():
+        for asset in assets:
+            if asset['denom'] not in denom_to_symbol:
+                denom_to_symbol[asset['denom']] = asset['symbol']
+    return denom_to_symbol
+
+
 def get_pool_additional_details(regenerate) -> Dict[str, str]:
     """Read input_data from API, returns pool details input_data"""
 
@@ -108,19 +122,13 @@ def get_pool_additional_details(regenerate) -> Dict[str, str]:
     local_file = script_dir + "/../input_data/dynamic/osmosis/denom_to_symbol.json"
     if regenerate:
         try:
-            details_url = "https://api-osmosis.imperator.co/search/v1/pools"
             details_data = fetch_raw_data(details_url)
-            denom_to_symbol: Dict[str, str] = {}
-            for assets in details_data.values():
-                for asset in assets:
-                    if asset['denom'] not in denom_to_symbol:
-                        denom_to_symbol[asset['denom']] = asset['symbol']
+            denom_to_symbol = parse_pool_additional_details(details_data)
             with open(local_file, "w+") as f:
                 f.write(json.dumps(denom_to_symbol, indent=4))
 
         except Exception as e:
-            logger.warning(f'https://api-osmosis.imperator.co/search/v1/pools is down. Attempting Fetch denom_to_symbol'
-                           f' from local file')
+            logger.warning(f'{details_url} is down. Attempting Fetch denom_to_symbol from local file')
 
             with open(local_file, "r") as f:
                 denom_to_symbol = json.loads(f.read())
@@ -133,22 +141,97 @@ def get_pool_additional_details(regenerate) -> Dict[str, str]:
     return denom_to_symbol
 
 
-def make_model(regenerate=True):
+async def async_get_pool_additional_details(fetcher: AsyncFetcher, regenerate) -> Dict[str, str]:
+    """Same as get_pool_additional_details, with the shared async fetcher"""
+
+    local_file = script_dir + "/../input_data/dynamic/osmosis/denom_to_symbol.json"
+    if regenerate:
+        try:
+            details_data = await fetcher.fetch_raw_data(details_url)
+            denom_to_symbol = parse_pool_additional_details(details_data)
+            with open(local_file, "w+") as f:
+                f.write(json.dumps(denom_to_symbol, indent=4))
+            return denom_to_symbol
+
+        except Exception as e:
+            logger.warning(f'{details_url} is down. Attempting Fetch denom_to_symbol from local file')
+
+    with open(local_file, "r") as f:
+        denom_to_symbol = json.loads(f.read())
+
+    return denom_to_symbol
+
+
+def fetch_pools(regenerate=True) -> List[Pool]:
     """
-    Takes raw and details input_data, then returns the AMM model
+    Parsed pools of the LCD, without building the AMM : they can refresh an existing model in place
     :param regenerate forces the call of details API instead of reading from local file
     """
+    error = None
     for attempt in range(10):
         try:
-            pools = get_pool_data_from_blockchain(regenerate)
+            return get_pool_data_from_blockchain(regenerate)
+        except Exception as e:
+            error = e
 
-            m_amm = AMM("osmosis", pools=pools)
+    raise error
 
-            return m_amm
-        except Exception as e:
-            pass
 
-    raise e
+def make_model(regenerate=True):
+    """
+    Takes raw and details input_data, then returns the AMM model
+    :param regenerate forces the call of details API instead of reading from local file
+    """
+    pools = fetch_pools(regenerate)
+
+    with get_metrics().timer("amm_build"):
+        return AMM("osmosis", pools=pools)
+
+
+async def async_fetch_pools(fetcher: AsyncFetcher, regenerate=True) -> List[Pool]:
+    """
+    Same as fetch_pools, the pools and details requests are issued concurrently
+    :param fetcher: shared async fetcher
+    :param regenerate forces the call of details API instead of reading from local file
+    """
+    async def attempt():
+        with get_metrics().timer("pool_fetch"):
+            raw_pools_data, denom_to_symbol = await asyncio.gather(
+                fetcher.fetch_raw_bytes(pools_url), async_get_pool_additional_details(fetcher, regenerate))
+        save_pool_data(raw_pools_data)
+
+        with get_metrics().timer("parse"):
+            return parse_raw_pool_data(raw_pools_data, denom_to_symbol)
+
+    return await retry(attempt)
+
+
+async def async_make_model(fetcher: AsyncFetcher, regenerate=True) -> AMM:
+    """
+    Same as make_model, the pools and details requests are issued concurrently
+    :param fetcher: shared async fetcher
+    :param regenerate forces the call of details API instead of reading from local file
+    """
+    pools = await async_fetch_pools(fetcher, regenerate)
+
+    with get_metrics().timer("amm_build"):
+        return AMM("osmosis", pools=pools)
+
+
+def pools_from_snapshot(raw_pools_data: bytes) -> List[Pool]:
+    """Parse a recorded LCD pools response with the local denom_to_symbol, without any network call"""
+    denom_to_symbol = get_pool_additional_details(regenerate=False)
+
+    with get_metrics().timer("parse"):
+        return parse_raw_pool_data(raw_pools_data, denom_to_symbol)
+
+
+def make_model_from_snapshot(raw_pools_data: bytes) -> AMM:
+    """Build the model from a recorded LCD pools response and the local denom_to_symbol, without any network call"""
+    pools = pools_from_snapshot(raw_pools_data)
+
+    with get_metrics().timer("amm_build"):
+        return AMM("osmosis", pools=pools)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+import base64
+from typing import List, Optional, Tuple
+
+import requests
+
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
+
+from amm import Transaction
+
+lcd_url = "https://osmosis.stakesystems.io"
+chain_id = "osmosis-1"
+
+SWAP_EXACT_AMOUNT_IN = "/osmosis.gamm.v1beta1.MsgSwapExactAmountIn"
+SECP256K1_PUBKEY = "/cosmos.crypto.secp256k1.PubKey"
+SIGN_MODE_DIRECT = 1
+
+
+# Protobuf wire format, only what the transaction messages need. Default values are omitted as in proto3.
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _uint64(field: int, value: int) -> bytes:
+    if not value:
+        return b""
+    return _varint(field << 3) + _varint(value)
+
+
+def _bytes(field: int, value: bytes) -> bytes:
+    if not value:
+        return b""
+    return _varint(field << 3 | 2) + _varint(len(value)) + value
+
+
+def _string(field: int, value: str) -> bytes:
+    return _bytes(field, value.encode())
+
+
+def _message(field: int, value: bytes) -> bytes:
+    # Embedded messages are written even when empty, their presence matters
+    return _varint(field << 3 | 2) + _varint(len(value)) + value
+
+
+def _any(type_url: str, value: bytes) -> bytes:
+    return _string(1, type_url) + _bytes(2, value)
+
+
+def _coin(denom: str, amount: int) -> bytes:
+    return _string(1, denom) + _string(2, str(amount))
+
+
+def encode_swap_exact_amount_in(sender: str, routes: List[Tuple[int, str]], denom_in: str, amount_in: int,
+                                min_amount_out: int) -> bytes:
+    """
+    MsgSwapExactAmountIn
+    :param routes: (pool_id, denom_out) of every hop
+    """
+    msg = _string(1, sender)
+    for pool_id, denom_out in routes:
+        msg += _message(2, _uint64(1, int(pool_id)) + _string(2, denom_out))
+    msg += _message(3, _coin(denom_in, amount_in))
+    msg += _string(4, str(min_amount_out))
+    return msg
+
+
+def encode_tx_body(messages: List[Tuple[str, bytes]], memo: str = "") -> bytes:
+    """ TxBody of (type_url, message) """
+    return b"".join(_message(1, _any(type_url, value)) for type_url, value in messages) + _string(2, memo)
+
+
+def encode_auth_info(public_key: bytes, sequence: int, fee_denom: str, fee_amount: int, gas_limit: int) -> bytes:
+    """ AuthInfo of a single SIGN_MODE_DIRECT secp256k1 signer """
+    signer_info = _message(1, _any(SECP256K1_PUBKEY, _bytes(1, public_key))) + \
+        _message(2, _message(1, _uint64(1, SIGN_MODE_DIRECT))) + \
+        _uint64(3, sequence)
+    fee = (_message(1, _coin(fee_denom, fee_amount)) if fee_amount else b"") + _uint64(2, gas_limit)
+    return _message(1, signer_info) + _message(2, fee)
+
+
+def encode_sign_doc(body: bytes, auth_info: bytes, chain: str, account_number: int) -> bytes:
+    return _bytes(1, body) + _bytes(2, auth_info) + _string(3, chain) + _uint64(4, account_number)
+
+
+def encode_tx_raw(body: bytes, auth_info: bytes, signature: bytes) -> bytes:
+    return _bytes(1, body) + _bytes(2, auth_info) + _bytes(3, signature)
+
+
+class TxClient:
+    """
+    Builds, signs and broadcasts swap transactions in process, over one persistent HTTP session to the LCD :
+    no osmosisd process, keyring or gas simulation per trade. Needs coincurve for the secp256k1 signatures.
+    The private key is read once from a file holding it in hex (osmosisd keys export --unarmored-hex --unsafe).
+    """
+    def __init__(self, account: str, key_file: str, lcd: Optional[str] = None, chain: str = chain_id,
+                 account_number: Optional[int] = None, timeout: float = 10):
+        if coincurve is None:
+            raise ImportError("coincurve is needed to sign transactions in process")
+
+        with open(key_file, "r") as f:
+            self.private_key = coincurve.PrivateKey(bytes.fromhex(f.read().strip()))
+        self.public_key = self.private_key.public_key.format(compressed=True)
+
+        self.account = account
+        self.lcd = (lcd or lcd_url).rstrip("/")
+        self.chain = chain
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._account_number = account_number
+
+    @property
+    def account_number(self) -> int:
+        """ Fetched once, it never changes """
+        if self._account_number is None:
+            res = self.session.get(f"{self.lcd}/cosmos/auth/v1beta1/accounts/{self.account}", timeout=self.timeout)
+            account = res.json()["account"]
+            # Vesting accounts wrap a base account
+            account = account.get("base_vesting_account", {}).get("base_account", account)
+            self._account_number = int(account["account_number"])
+        return self._account_number
+
+    def sign(self, body: bytes, auth_info: bytes) -> bytes:
+        """ Compact (r, s) signature of the sign doc, low-s normalized by libsecp256k1 """
+        sign_doc = encode_sign_doc(body, auth_info, self.chain, self.account_number)
+        return self.private_key.sign_recoverable(sign_doc)[:64]
+
+    def build_swap_tx(self, transaction: Transaction, amount_in: int, sequence: int, fees: int,
+                      gas_limit: int) -> bytes:
+        """ Signed TxRaw of the swap, same swap as execute.build_swap_command """
+        denom_in = transaction.pools[0].asset_1.denom
+        routes = [(pool.idx, pool.asset_2.denom) for pool in transaction.pools]
+
+        msg = encode_swap_exact_amount_in(self.account, routes, denom_in, amount_in, min_amount_out=amount_in)
+        body = encode_tx_body([(SWAP_EXACT_AMOUNT_IN, msg)])
+        auth_info = encode_auth_info(self.public_key, int(sequence or 0), "uosmo", fees, gas_limit)
+
+        return encode_tx_raw(body, auth_info, self.sign(body, auth_info))
+
+    def broadcast(self, tx_bytes: bytes) -> Tuple[Optional[str], str]:
+        """
+        Broadcast in sync mode (checked, not waiting for inclusion)
+        return :
+           - txhash:         None if the transaction was rejected
+           - raw_log:        Log of the chain, contains the rejection reason
+        """
+        payload = {"tx_bytes": base64.b64encode(tx_bytes).decode(), "mode": "BROADCAST_MODE_SYNC"}
+        try:
+            res = self.session.post(f"{self.lcd}/cosmos/tx/v1beta1/txs", json=payload, timeout=self.timeout)
+            data = res.json()
+        except (requests.RequestException, ValueError) as e:
+            return None, str(e)
+
+        tx_response = data.get("tx_response")
+        if tx_response is None:
+            return None, data.get("message", res.text)
+
+        if int(tx_response.get("code", 0)) != 0:
+            return None, tx_response.get("raw_log", "")
+        return tx_response["txhash"], tx_response.get("raw_log", "")
@@ -8,7 +8,11 @@ def get_account_sequence(account):
     return '1'
 
 
-def build_swap_command(transaction, amount_in, sequence, fees) -> str:
+async def async_get_account_sequence(fetcher, account):
+    return '1'
+
+
+def build_swap_command(transaction, amount_in, sequence, fees, gas=None) -> str:
     return ' '
 
 
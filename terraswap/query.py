@@ -1,14 +1,22 @@
 import os
 import json
 import attr
-from typing import List
+from typing import List, Dict
+
+import asyncio
 
 from amm import *
-from utils import fetch_raw_data
+from utils import fetch_raw_data, loads
+from utils.async_fetcher import AsyncFetcher, retry
+from utils.recorder import get_recorder
+from utils.metrics import get_metrics
 
 script_dir = os.path.dirname(__file__)
 blockchain_prefix = "terra"
 
+tokens_url = "https://api.terraswap.io/tokens"
+dashboard_pairs_url = "https://api.terraswap.io/dashboard/pairs"
+
 
 @attr.s
 class DashboardPair:
@@ -85,11 +93,8 @@ def fetch_terraswap_tokens(regenerate=True) -> List[TerraswapToken]:
 
     if regenerate:
         # Fetch API
-        url = "https://api.terraswap.io/tokens"
-        raw_data = fetch_raw_data(url)
-        denom_to_symbol = {token['contract_addr']: token['symbol'] for token in raw_data}
-        with open(local_file, 'w') as f:
-            json.dump(denom_to_symbol, f, indent=4)
+        raw_data = fetch_raw_data(tokens_url)
+        denom_to_symbol = save_terraswap_tokens(raw_data)
     else:
         with open(local_file, "r") as f:
             denom_to_symbol = json.loads(f.read())
@@ -101,25 +106,44 @@ def fetch_terraswap_tokens(regenerate=True) -> List[TerraswapToken]:
     return denom_to_symbol
 
 
+def save_terraswap_tokens(raw_data) -> Dict[str, str]:
+    local_file = os.path.join(script_dir, "../input_data/dynamic/terraswap/denom_to_symbol.json")
+
+    denom_to_symbol = {token['contract_addr']: token['symbol'] for token in raw_data}
+    with open(local_file, 'w') as f:
+        json.dump(denom_to_symbol, f, indent=4)
+    return denom_to_symbol
+
+
 def fetch_terraswap_dashboard_pairs(regenerate=True) -> List[Pool]:
     local_file = os.path.join(script_dir, "../input_data/dynamic/terraswap/data.json")
 
     if regenerate:
         # Fetch API
-        dashboard_pairs_url = "https://api.terraswap.io/dashboard/pairs"
-        raw_data = fetch_raw_data(dashboard_pairs_url)
+        with get_metrics().timer("pool_fetch"):
+            raw_data = fetch_raw_data(dashboard_pairs_url)
+        save_dashboard_pairs(raw_data)
     else:
         with open(local_file, "r") as f:
             raw_data = json.loads(f.read())
 
+    with get_metrics().timer("parse"):
+        return parse_dashboard_pairs(raw_data)
+
+
+def save_dashboard_pairs(raw_data):
+    """Record the response in the background, data.json keeps the latest one"""
+    local_file = os.path.join(script_dir, "../input_data/dynamic/terraswap/data.json")
+
+    get_recorder().record("terraswap/data", raw_data, latest_path=local_file)
+
+
+def parse_dashboard_pairs(raw_data) -> List[Pool]:
     # Process data
     dashboard_pairs: List[DashboardPair] = [DashboardPair.from_data(pair_data) for pair_data in raw_data]
 
-    # Save to local file
-    with open(local_file, "w+") as f:
-        f.write(json.dumps(raw_data, indent=4))
-
     pools = []
+    store = PoolStore(capacity=2 * len(dashboard_pairs))
     for dashboard_pair in dashboard_pairs:
 
         amount_token0 = dashboard_pair.token0Reserve*10**(-dashboard_pair.token0Decimals)
@@ -138,28 +162,72 @@ def fetch_terraswap_dashboard_pairs(regenerate=True) -> List[Pool]:
         asset_2 = Asset(symbol=dashboard_pair.token1Symbol+'_@'+dashboard_pair.token1, denom=dashboard_pair.token1)
 
         pools.append(Pool(idx=dashboard_pair.pairAddress, asset_1=asset_1, asset_2=asset_2, swap_fee=0.003,
-                          amount_in=amount_token0, amount_out=amount_token1, wi=1, wo=1))
+                          amount_in=amount_token0, amount_out=amount_token1, wi=1, wo=1, store=store))
 
         pools.append(Pool(idx=dashboard_pair.pairAddress, asset_1=asset_2, asset_2=asset_1, swap_fee=0.003,
-                          amount_in=amount_token1, amount_out=amount_token0, wi=1, wo=1))
+                          amount_in=amount_token1, amount_out=amount_token0, wi=1, wo=1, store=store))
 
     return pools
 
 
-def make_model(regenerate=True) -> AMM:
-    tokens = fetch_terraswap_tokens(regenerate)
+def fetch_pools(regenerate=True) -> List[Pool]:
+    """Parsed pools of the dashboard, without building the AMM : they can refresh an existing model in place"""
+    fetch_terraswap_tokens(regenerate)
 
+    error = None
     for attempt in range(10):
         try:
-            pools = fetch_terraswap_dashboard_pairs(regenerate=True)
+            return fetch_terraswap_dashboard_pairs(regenerate=True)
+        except Exception as e:
+            error = e
 
-            m_amm = AMM("terraswap", pools=pools)
+    raise error
 
-            return m_amm
-        except Exception as e:
-            pass
 
-    raise e
+def make_model(regenerate=True) -> AMM:
+    pools = fetch_pools(regenerate)
+
+    with get_metrics().timer("amm_build"):
+        return AMM("terraswap", pools=pools)
+
+
+async def async_fetch_pools(fetcher: AsyncFetcher, regenerate=True) -> List[Pool]:
+    """Same as fetch_pools, the tokens and pairs requests are issued concurrently"""
+    async def fetch_tokens():
+        if regenerate:
+            save_terraswap_tokens(await fetcher.fetch_raw_data(tokens_url))
+
+    async def attempt():
+        with get_metrics().timer("pool_fetch"):
+            _, raw_data = await asyncio.gather(fetch_tokens(), fetcher.fetch_raw_data(dashboard_pairs_url))
+        save_dashboard_pairs(raw_data)
+
+        with get_metrics().timer("parse"):
+            return parse_dashboard_pairs(raw_data)
+
+    return await retry(attempt)
+
+
+async def async_make_model(fetcher: AsyncFetcher, regenerate=True) -> AMM:
+    """Same as make_model, the tokens and pairs requests are issued concurrently"""
+    pools = await async_fetch_pools(fetcher, regenerate)
+
+    with get_metrics().timer("amm_build"):
+        return AMM("terraswap", pools=pools)
+
+
+def pools_from_snapshot(raw_data: bytes) -> List[Pool]:
+    """Parse a recorded dashboard pairs response, without any network call"""
+    with get_metrics().timer("parse"):
+        return parse_dashboard_pairs(loads(raw_data))
+
+
+def make_model_from_snapshot(raw_data: bytes) -> AMM:
+    """Build the model from a recorded dashboard pairs response, without any network call"""
+    pools = pools_from_snapshot(raw_data)
+
+    with get_metrics().timer("amm_build"):
+        return AMM("terraswap", pools=pools)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+import gzip
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Union
+
+Response = Union[dict, bytes, Callable[[bytes], dict]]
+
+
+class StubServer:
+    """
+    Local keep-alive HTTP server answering fixed responses by path (query string included), in place of
+    the LCD and the APIs. A response is a JSON object, raw bytes, or a function of the request body for POSTs.
+    Every request is recorded with the client port it came from, so connection reuse can be checked.
+    """
+    def __init__(self, responses: Dict[str, Response], delay: float = 0., headers: Dict[str, str] = None):
+        self.responses = responses
+        self.delay = delay
+        self.headers = headers or {}
+        self.requests: List[dict] = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub._handle(self, b"")
+
+            def do_POST(self):
+                stub._handle(self, self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "StubServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handle(self, handler: BaseHTTPRequestHandler, body: bytes):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.requests.append({"path": handler.path, "port": handler.client_address[1],
+                                  "headers": dict(handler.headers), "body": body})
+        try:
+            time.sleep(self.delay)
+            response = self.responses.get(handler.path)
+            if response is None:
+                handler.send_response(404)
+                handler.send_header("Content-Length", "0")
+                handler.end_headers()
+                return
+
+            if callable(response):
+                response = response(body)
+            if isinstance(response, dict):
+                response = json.dumps(response).encode()
+
+            gzipped = "gzip" in handler.headers.get("Accept-Encoding", "")
+            if gzipped:
+                response = gzip.compress(response)
+
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json")
+            if gzipped:
+                handler.send_header("Content-Encoding", "gzip")
+            handler.send_header("Content-Length", str(len(response)))
+            for key, value in self.headers.items():
+                handler.send_header(key, value)
+            handler.end_headers()
+            handler.wfile.write(response)
+        finally:
+            with self._lock:
+                self.active -= 1
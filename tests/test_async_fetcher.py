@@ -0,0 +1,116 @@
+import asyncio
+import json
+import os
+import random
+import time
+
+import pytest
+
+from osmosis import query as osmosis_query
+from utils.async_fetcher import AsyncFetcher, retry
+from utils.recorder import get_recorder
+from tests.stub_server import StubServer
+
+DENOMS = ["uosmo", "uatom", "uion", "ibc/27394"]
+SYMBOLS = ["OSMO", "ATOM", "ION", "USDC"]
+
+
+def lcd_pools(n: int = 20, seed: int = 0) -> dict:
+    """ LCD pools response of n balancer pools """
+    rnd = random.Random(seed)
+    pools = []
+    for k in range(n):
+        assets = [{"token": {"denom": denom, "amount": str(rnd.randint(10 ** 10, 10 ** 12))}, "weight": "1000"}
+                  for denom in rnd.sample(DENOMS, 2)]
+        pools.append({"address": f"osmo{k}", "id": str(k + 1),
+                      "poolParams": {"swapFee": "0.003000000000000000", "exitFee": "0"},
+                      "totalWeight": "2000", "poolAssets": assets})
+    return {"pools": pools, "pagination": {"next_key": None, "total": str(n)}}
+
+
+def test_fetch_gzip_and_post():
+    responses = {"/data": {"a": 1}, "/raw": b"raw bytes", "/post": lambda body: {"echo": json.loads(body)}}
+
+    async def main(fetcher):
+        try:
+            return await asyncio.gather(fetcher.fetch_raw_data(f"{stub.url}/data"),
+                                        fetcher.fetch_raw_bytes(f"{stub.url}/raw"),
+                                        fetcher.post_raw_data(f"{stub.url}/post", {"b": 2}))
+        finally:
+            await fetcher.close()
+
+    with StubServer(responses) as stub:
+        data, raw, posted = asyncio.run(main(AsyncFetcher()))
+
+    assert data == {"a": 1}
+    assert raw == b"raw bytes"
+    assert posted == {"echo": {"b": 2}}
+    assert all("gzip" in request["headers"]["Accept-Encoding"] for request in stub.requests)
+
+
+def test_pooled_connections_and_host_limit():
+    responses = {f"/{k}": {"k": k} for k in range(16)}
+
+    async def main(fetcher):
+        try:
+            started = time.perf_counter()
+            results = await asyncio.gather(*[fetcher.fetch_raw_data(f"{stub.url}/{k}") for k in range(16)])
+            return results, time.perf_counter() - started
+        finally:
+            await fetcher.close()
+
+    with StubServer(responses, delay=0.1) as stub:
+        results, elapsed = asyncio.run(main(AsyncFetcher(limit_per_host=4)))
+
+    assert results == [{"k": k} for k in range(16)]
+    # 4 requests at a time, each of the 4 connections is kept alive and reused
+    assert stub.max_active <= 4
+    assert len({request["port"] for request in stub.requests}) <= 4
+    assert 0.4 <= elapsed < 1.6
+
+
+def test_retry():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ValueError("down")
+        return "up"
+
+    assert asyncio.run(retry(flaky)) == "up"
+    assert len(attempts) == 3
+
+    async def down():
+        raise ValueError("down")
+
+    with pytest.raises(ValueError):
+        asyncio.run(retry(down, attempts=2))
+
+
+def test_osmosis_async_make_model(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "osmosis")
+    os.makedirs(tmp_path / "input_data/dynamic/osmosis")
+    responses = {"/pools": lcd_pools(), "/details": {str(k): [{"denom": denom, "symbol": symbol}]
+                                                    for k, (denom, symbol) in enumerate(zip(DENOMS, SYMBOLS))}}
+
+    async def main(fetcher):
+        try:
+            return await osmosis_query.async_make_model(fetcher, regenerate=True)
+        finally:
+            await fetcher.close()
+
+    with StubServer(responses) as stub:
+        monkeypatch.setattr(osmosis_query, "script_dir", str(tmp_path / "osmosis"))
+        monkeypatch.setattr(osmosis_query, "pools_url", f"{stub.url}/pools")
+        monkeypatch.setattr(osmosis_query, "details_url", f"{stub.url}/details")
+        amm = asyncio.run(main(AsyncFetcher()))
+    get_recorder().flush()
+
+    assert sorted(request["path"] for request in stub.requests) == ["/details", "/pools"]
+    assert {str(pool.idx) for pool in amm.directed.values()} == {str(k + 1) for k in range(20)}
+    assert {pool.asset_1.symbol for pool in amm.directed.values()} <= set(SYMBOLS)
+    with open(tmp_path / "input_data/dynamic/osmosis/denom_to_symbol.json") as f:
+        assert json.load(f) == dict(zip(DENOMS, SYMBOLS))
+    with open(tmp_path / "input_data/dynamic/osmosis/lcd_data.json", "rb") as f:
+        assert json.loads(f.read()) == responses["/pools"]
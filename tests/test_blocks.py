@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+from utils.blocks import BlockClock, BlockScheduler, FakeBlockSource, block_height
+
+
+@pytest.fixture
+def source():
+    clock = BlockClock(block_time=0.05)
+    source = FakeBlockSource(clock, block_time=0.05)
+    yield source
+    source.stop()
+
+
+def make_scheduler(source: FakeBlockSource, polls: list) -> BlockScheduler:
+    def poll_height() -> int:
+        polls.append(time.monotonic())
+        return source.latest_height()
+
+    return BlockScheduler(source, source.clock, poll_height, min_poll_interval=0.01, max_poll_interval=0.2)
+
+
+def test_block_height():
+    message = {"result": {"data": {"value": {"block": {"header": {"height": "123"}}}}}}
+    assert block_height(message) == 123
+    assert block_height({"result": {}}) is None
+
+
+def test_clock_publish_and_wait():
+    clock = BlockClock()
+    assert clock.publish(5)
+    assert not clock.publish(5)
+    assert not clock.publish(4)
+
+    threading.Timer(0.05, clock.publish, args=(6,)).start()
+    assert clock.wait(5, timeout=2) == 6
+    assert clock.wait(6, timeout=0.05) == 6
+
+
+def test_one_step_per_block(source):
+    polls = []
+    scheduler = make_scheduler(source, polls)
+    scheduler.start()
+
+    heights = [scheduler.next_block() for _ in range(5)]
+
+    # Every height once and in order, without polling while the source is connected
+    assert heights == sorted(set(heights))
+    assert heights[-1] - heights[0] == 4
+    assert polls == []
+
+
+def test_busy_caller_skips_to_latest_block(source):
+    scheduler = make_scheduler(source, [])
+    scheduler.start()
+
+    first = scheduler.next_block()
+    time.sleep(0.3)
+    assert scheduler.next_block() == source.clock.height > first + 1
+
+
+def test_polls_while_disconnected(source):
+    polls = []
+    scheduler = make_scheduler(source, polls)
+    scheduler.start()
+    scheduler.next_block()
+
+    source.disconnect()
+    heights = [scheduler.next_block() for _ in range(3)]
+    assert heights == sorted(set(heights))
+    assert len(polls) >= 3
+
+    # Back on the events once the subscription is up again
+    source.connect()
+    scheduler.next_block()
+    polled = len(polls)
+    heights = [scheduler.next_block() for _ in range(3)]
+    assert heights == sorted(set(heights))
+    assert len(polls) == polled
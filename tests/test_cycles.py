@@ -0,0 +1,30 @@
+import os
+
+from amm import AMM
+from anyplatform.query import generate_market
+from utils.cycles import CycleCache, iter_cycles, load_cycle_cache
+
+
+def test_cycle_cache_keys(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    amm = AMM("bench", generate_market(20, 60, seed=0))
+    parent = tmp_path / "input_data/dynamic/bench/cycles"
+
+    cycles = load_cycle_cache("bench", amm, priorities=["A0", "A1"], max_hops=3)
+    assert list(cycles) == list(iter_cycles(amm, priorities=["A0", "A1"], max_hops=3))
+    other = load_cycle_cache("bench", amm, priorities=["A0"], max_hops=3)
+    assert len(other) < len(cycles)
+
+    # The cache of another topology is kept
+    keys = sorted(os.listdir(parent))
+    assert len(keys) == 2
+    assert list(load_cycle_cache("bench", amm, priorities=["A0", "A1"], max_hops=3)) == list(cycles)
+    assert sorted(os.listdir(parent)) == keys
+
+    # An incomplete cache is rebuilt, and only that one
+    os.remove(parent / keys[0] / CycleCache.complete_marker)
+    rebuilt = load_cycle_cache("bench", amm, priorities=["A0", "A1"], max_hops=3)
+    rebuilt_other = load_cycle_cache("bench", amm, priorities=["A0"], max_hops=3)
+    assert list(rebuilt) == list(cycles) and list(rebuilt_other) == list(other)
+    assert sorted(os.listdir(parent)) == keys
+    assert all(os.path.exists(parent / key / CycleCache.complete_marker) for key in keys)
@@ -0,0 +1,282 @@
+import itertools
+import numpy as np
+import scipy.optimize
+
+from amm import AMM, CycleMatrix, Pool, PoolStore
+from amm import engine
+from amm.batch import RouteBatch
+from anyplatform.query import generate_market
+from utils.cycles import CycleCache, iter_cycles
+
+
+def test_negative_cycles_bounded_walks(monkeypatch):
+    amm = AMM("bench", generate_market(600, 3000, seed=1))
+    sources = ["A0", "A1"]
+
+    walks = []
+
+    def tree_path(predecessors, ancestor, symbol, max_length):
+        path = tree_path.wrapped(predecessors, ancestor, symbol, max_length)
+        walks.append(len(path) if path is not None else max_length)
+        return path
+
+    tree_path.wrapped = engine._tree_path
+    monkeypatch.setattr(engine, "_tree_path", tree_path)
+
+    cycles = engine.find_negative_cycles(amm, sources=sources, max_length=4)
+
+    assert cycles
+    assert all(len(cycle) <= 4 and cycle[0] in sources and amm.compute_cycle(cycle) > 0 for cycle in cycles)
+    assert len({tuple(cycle) for cycle in cycles}) == len(cycles)
+    # A walk of at most 4 hops per relaxation, and about as many relaxations as 4 Bellman-Ford rounds
+    assert max(walks) <= 4
+    assert len(walks) <= 4 * len(amm.edges) * len(sources)
+
+
+def market_routes(amm, count: int = 500):
+    """ 3 hops routes A -> B -> C -> A of the best pool of every edge """
+    routes = []
+    for (symbol_1, symbol_2), edge in amm.edges.items():
+        for symbol_3 in amm.assets:
+            if (symbol_2, symbol_3) in amm.edges and (symbol_3, symbol_1) in amm.edges and symbol_3 != symbol_1:
+                routes.append([edge[0], amm.edges[(symbol_2, symbol_3)][0], amm.edges[(symbol_3, symbol_1)][0]])
+                if len(routes) == count:
+                    return routes
+    return routes
+
+
+def test_route_bound_and_key_match_batch():
+    amm = AMM("bench", generate_market(100, 500, seed=2))
+    routes = market_routes(amm)
+    batch = RouteBatch(routes)
+
+    assert np.allclose([engine.route_profit_bound(pools) for pools in routes], batch.profit_bounds(), rtol=1e-9)
+    assert [engine.route_key(pools) for pools in routes] == batch.keys()
+
+
+def test_cycle_scores_match_compute_cycle():
+    amm = AMM("bench", generate_market(30, 120, seed=3))
+    cycles = list(iter_cycles(amm, priorities=["A0", "A1"], max_hops=4))
+    expected = np.array([amm.compute_cycle(cycle) for cycle in cycles])
+
+    matrix = CycleMatrix(cycles)
+    assert np.allclose(matrix.score(amm), expected, rtol=1e-12)
+    assert np.allclose(CycleMatrix.from_cache(CycleCache.build(cycles)).score(amm), expected, rtol=1e-12)
+
+    indices, changes = matrix.profitable(amm)
+    assert list(indices) == list(np.flatnonzero(expected > 0))
+    assert np.allclose(changes, expected[indices], rtol=1e-12)
+
+
+def test_edges_match_graph():
+    pools = generate_market(10, 30, seed=4)
+    # Parallel pools on some pairs, with other reserves
+    for n, pool in enumerate(pools[:10:2]):
+        amount = float(pool.i) * (1 + n / 10)
+        pools += [Pool(f"p{n}", pool.asset_1, pool.asset_2, 0.003, amount, float(pool.o), 1, 1),
+                  Pool(f"p{n}", pool.asset_2, pool.asset_1, 0.003, float(pool.o), amount, 1, 1)]
+    amm = AMM("bench", pools)
+
+    assert sum(len(edge) for edge in amm.edges.values()) == len(pools)
+    assert any(len(edge) > 1 for edge in amm.edges.values())
+    for symbol_1, links in amm.graph.items():
+        for symbol_2 in {dest for _, dest in links}:
+            expected = sorted([pool for pool, dest in links if dest == symbol_2], key=lambda pool: -pool.change)
+            assert [pool.change for pool in amm.pools_between(symbol_1, symbol_2)] == \
+                [pool.change for pool in expected]
+            assert amm.best_change(symbol_1, symbol_2) == max(pool.change for pool in expected)
+
+
+def scalar_change(pool: Pool) -> float:
+    change = np.log(pool.wi / pool.wo * pool.r)
+    return change + np.log(pool.o / pool.i) if pool.pool_type == "xyk" else change
+
+
+def test_store_rows():
+    # A small capacity, the store grows while the pools are appended
+    store = PoolStore(capacity=2)
+    pools = [Pool(pool.idx, pool.asset_1, pool.asset_2, float(pool.swap_fee), float(pool.i), float(pool.o),
+                  float(pool.wi), float(pool.wo), pool_type=pool.pool_type, store=store)
+             for pool in generate_market(20, 60, seed=5)]
+    assert len(store) == len(pools) and {pool.pool_type for pool in pools} == {"xyk", "stable"}
+    assert np.allclose([pool.change for pool in pools], [scalar_change(pool) for pool in pools], rtol=1e-12)
+
+    # In place updates, one row and many rows, are seen by the views and their change rates
+    assert store.update(pools[0].row, 2 * pools[0].i, pools[0].o, pools[0].wi, pools[0].wo, pools[0].r)
+    assert not store.update(pools[0].row, pools[0].i, pools[0].o, pools[0].wi, pools[0].wo, pools[0].r)
+
+    rows = np.array([pool.row for pool in pools[1:5]])
+    reserves_out = store.reserves_out[rows] * np.array([1, 1.5, 1, 0.5])
+    changed = store.update_rows(rows, store.reserves_in[rows], reserves_out, store.wi[rows], store.wo[rows],
+                                store.r[rows])
+    assert list(changed) == [False, True, False, True]
+    assert pools[2].o == reserves_out[1]
+    assert np.allclose([pool.change for pool in pools], [scalar_change(pool) for pool in pools], rtol=1e-12)
+
+
+def test_newton_matches_reference():
+    amm = AMM("bench", generate_market(100, 500, seed=2, mispricing=0.02))
+    routes = [pools for pools in market_routes(amm, 5000)
+              if engine.simulate_swaps_derivatives(pools, 0.)[1] > 1
+              and not all(pool.pool_type == "xyk" and pool.wi == pool.wo for pool in pools)][:200]
+    assert any(pool.pool_type == "stable" for pools in routes for pool in pools)
+    assert any(pool.wi != pool.wo for pools in routes for pool in pools)
+
+    for pools in routes:
+        # Tolerances to the scale of the synthetic reserves
+        amount = engine.find_optimal_amount_newton(pools, xatol=1e-3, fatol=1e-6)
+        reference = scipy.optimize.minimize_scalar(lambda x: x - engine.simulate_swaps(pools, x),
+                                                   bounds=(0, float(pools[0].i)), method="bounded",
+                                                   options={"xatol": 1e-6})
+        delta = engine.simulate_swaps(pools, amount) - amount
+        assert delta > 0
+        assert delta >= -reference.fun * (1 - 1e-6) - 1e-6
+
+
+def test_batch_solve_matches_scalar():
+    amm = AMM("bench", generate_market(100, 500, seed=2, mispricing=0.02))
+    routes = market_routes(amm, 2000)
+    batch = RouteBatch(routes)
+    assert 0 < batch.equal_weight_xyk.sum() < len(batch)
+
+    best_inputs, outputs, deltas = batch.solve(xatol=1e-3, fatol=1e-6)
+
+    expected_inputs = np.array([max(engine.find_optimal_amount(pools, xatol=1e-3, fatol=1e-6), 0.)
+                                for pools in routes])
+    expected_outputs = np.array([engine.simulate_swaps(pools, amount)
+                                 for pools, amount in zip(routes, expected_inputs)])
+    assert (best_inputs > 0).any()
+    assert np.allclose(best_inputs, expected_inputs, rtol=1e-6, atol=1e-3)
+    assert np.allclose(outputs, expected_outputs, rtol=1e-9, atol=1e-6)
+    assert np.allclose(deltas, expected_outputs - expected_inputs, rtol=1e-6, atol=1e-6)
+
+
+def test_profit_bounds_hold():
+    pools = generate_market(30, 120, seed=3, mispricing=0.02)
+    # Parallel pools on some pairs, with other reserves and fees
+    for n, pool in enumerate(pools[:40:4]):
+        amount = float(pool.i) * (0.5 + n / 10)
+        pools += [Pool(f"p{n}", pool.asset_1, pool.asset_2, 0.001, amount, float(pool.o), 1, 1),
+                  Pool(f"p{n}", pool.asset_2, pool.asset_1, 0.001, float(pool.o), amount, 1, 1)]
+    amm = AMM("bench", pools)
+    cycles = list(iter_cycles(amm, priorities=["A0", "A1"], max_hops=4))
+    matrix = CycleMatrix(cycles)
+    indices, _ = matrix.profitable(amm)
+    assert len(indices)
+
+    routes, cycle_bounds = [], []
+    for cycle, cycle_bound in zip([cycles[n] for n in indices], matrix.profit_bounds(amm, indices)):
+        hops = [amm.pools_between(symbol_1, symbol_2) for symbol_1, symbol_2 in zip(cycle, cycle[1:] + cycle[:1])]
+        for route in itertools.islice(itertools.product(*hops), 8):
+            routes.append(list(route))
+            cycle_bounds.append(cycle_bound)
+    assert any(len(amm.pools_between(pool.symbol_1, pool.symbol_2)) > 1 for route in routes for pool in route)
+
+    _, _, deltas = RouteBatch(routes).solve(xatol=1e-3, fatol=1e-6)
+    route_bounds = np.array([engine.route_profit_bound(route) for route in routes])
+
+    # The bound of a cycle is above the bound of each of its routes, which is above what the route makes
+    assert np.all(route_bounds <= np.array(cycle_bounds) * (1 + 1e-9))
+    assert np.all(deltas <= route_bounds * (1 + 1e-9) + 1e-9)
+    assert (deltas > 0).any()
+
+    # Pruning on the bounds keeps the best routes of a full solve
+    batch, prices = RouteBatch(routes), np.ones(len(routes))
+    solved, _, solved_deltas = batch.solve_best_first(prices, 0., top_k=5, xatol=1e-3, fatol=1e-6)
+    assert len(solved) < len(routes)
+    assert np.allclose(np.sort(solved_deltas)[-5:], np.sort(deltas)[-5:], rtol=1e-9)
+
+
+def parallel_market(step: int = 0):
+    """ Synthetic market with a parallel pool of close reserves on some pairs, so that edge orders can swap """
+    pools = generate_market(20, 60, seed=6, mispricing=0.02, step=step)
+    for n, pool in enumerate(generate_market(20, 60, seed=6, mispricing=0.02)[:40:4]):
+        pools += [Pool(f"p{n}", pool.asset_1, pool.asset_2, 0.003, float(pool.i), float(pool.o), 1, 1),
+                  Pool(f"p{n}", pool.asset_2, pool.asset_1, 0.003, float(pool.o), float(pool.i), 1, 1)]
+    return pools
+
+
+def assert_same_model(amm, expected):
+    assert amm.edges.keys() == expected.edges.keys()
+    for key, edge in expected.edges.items():
+        assert [pool.idx for pool in amm.edges[key]] == [pool.idx for pool in edge]
+        assert np.allclose([pool.change for pool in amm.edges[key]], [pool.change for pool in edge], rtol=1e-12)
+    assert {symbol: {(pool.idx, dest) for pool, dest in links} for symbol, links in amm.graph.items() if links} == \
+        {symbol: {(pool.idx, dest) for pool, dest in links} for symbol, links in expected.graph.items() if links}
+
+    cycles = list(iter_cycles(expected, priorities=["A0", "A1"], max_hops=3))
+    assert cycles
+    assert np.allclose([amm.compute_cycle(cycle) for cycle in cycles],
+                       [expected.compute_cycle(cycle) for cycle in cycles], rtol=1e-12)
+
+
+def test_refresh_matches_rebuild():
+    amm = AMM("bench", parallel_market())
+    orders = {key: [pool.idx for pool in edge] for key, edge in amm.edges.items()}
+    touched = amm.refresh(parallel_market(step=1))
+    assert touched
+    # Some parallel pools swapped places
+    assert any([pool.idx for pool in edge] != orders[key] for key, edge in amm.edges.items())
+    assert_same_model(amm, AMM("bench", parallel_market(step=1)))
+
+    # A pool removed and a pool added
+    pools = parallel_market(step=2)
+    removed = pools[0]
+    pools = [pool for pool in pools if pool.idx != removed.idx]
+    pools += [Pool("new", removed.asset_1, removed.asset_2, 0.003, 2 * float(removed.i), float(removed.o), 1, 1),
+              Pool("new", removed.asset_2, removed.asset_1, 0.003, float(removed.o), 2 * float(removed.i), 1, 1)]
+    touched = amm.refresh(pools)
+    assert {pool.idx for pool in touched} >= {removed.idx, "new"}
+    assert_same_model(amm, AMM("bench", pools))
+
+
+def test_top_k_and_disjoint_transactions(monkeypatch):
+    monkeypatch.setattr(engine, "_route_cache", None)
+    amm = AMM("bench", parallel_market())
+    cycles = list(iter_cycles(amm, priorities=["A0", "A1"], max_hops=4))
+    changes = CycleMatrix(cycles).score(amm)
+    config = {"minimum_dollars_delta": 0., "xatol": 1e-3, "fatol": 1e-6}
+    starters = {"A0": {"current_price": 1.}, "A1": {"current_price": 10.}}
+
+    transactions, opportunities = engine.find_all_transactions(cycles, changes, amm, config, starters)
+    assert opportunities == len(transactions) > 10
+    best, _ = engine.find_all_transactions(cycles, changes, amm, config, starters, top_k=5)
+    assert sorted(transaction.dollars_delta for transaction in best) == \
+        sorted(transaction.dollars_delta for transaction in transactions)[-5:]
+
+    selected = engine.select_disjoint(transactions, max_count=4)
+    assert 1 < len(selected) <= 4
+    assert selected[0].dollars_delta == max(transaction.dollars_delta for transaction in transactions)
+    pool_ids = [{pool.idx for pool in transaction.pools} for transaction in selected]
+    assert sum(len(ids) for ids in pool_ids) == len(set().union(*pool_ids))
+
+    # Pools of the transactions in flight are never reused
+    excluded = pool_ids[0]
+    assert all(not excluded & {pool.idx for pool in transaction.pools}
+               for transaction in engine.select_disjoint(transactions, max_count=4, excluded=excluded))
+
+
+def test_route_cache_invalidation():
+    amm = AMM("bench", generate_market(100, 500, seed=2, mispricing=0.02))
+    routes = market_routes(amm, 200)
+    cache = engine.RouteCache()
+
+    best_inputs, _, deltas = cache.solve(RouteBatch(routes), xatol=1e-3, fatol=1e-6)
+    assert (cache.hits, cache.misses) == (0, len(routes))
+    cached_inputs, _, cached_deltas = cache.solve(RouteBatch(routes), xatol=1e-3, fatol=1e-6)
+    assert cache.hits == len(routes)
+    assert np.array_equal(cached_inputs, best_inputs) and np.array_equal(cached_deltas, deltas)
+
+    # New reserves on the last hop of the first route : only the routes through that pool are solved again
+    pool = routes[0][-1]
+    assert amm.store.update(pool.row, pool.i, 1.1 * pool.o, pool.wi, pool.wo, pool.r)
+    amm.store.update_changes()
+    moved = np.array([any(hop is pool for hop in route) for route in routes])
+
+    hits, misses = cache.hits, cache.misses
+    batch = RouteBatch(routes)
+    best_inputs, _, deltas = cache.solve(batch, xatol=1e-3, fatol=1e-6)
+    assert cache.misses - misses == moved.sum() and cache.hits - hits == len(routes) - moved.sum()
+
+    expected_inputs, _, expected_deltas = batch.solve(xatol=1e-3, fatol=1e-6)
+    assert np.array_equal(best_inputs, expected_inputs) and np.array_equal(deltas, expected_deltas)
@@ -0,0 +1,66 @@
+import os
+import json
+import importlib.util
+
+from osmosis import query as osmosis_query
+from utils.recorder import SnapshotRecorder
+
+root = os.path.join(os.path.dirname(__file__), "..")
+
+DENOMS = {"uosmo": "OSMO", "ibc/27394": "ATOM", "uion": "ION", "ujuno": "JUNO", "uusdc": "USDC"}
+
+
+def load_main():
+    """ The bot module, under another name than __main__ """
+    spec = importlib.util.spec_from_file_location("osmobot_main", os.path.join(root, "__main__.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def lcd_pools() -> dict:
+    """ Two 5% profitable cycles from OSMO without a pool in common """
+    def pool(idx, denom_1, amount_1, denom_2, amount_2):
+        return {"address": f"osmo{idx}", "id": str(idx), "totalWeight": "2000",
+                "poolParams": {"swapFee": "0.003000000000000000", "exitFee": "0"},
+                "poolAssets": [{"token": {"denom": denom_1, "amount": str(amount_1)}, "weight": "1000"},
+                               {"token": {"denom": denom_2, "amount": str(amount_2)}, "weight": "1000"}]}
+
+    pools = [pool(1, "uosmo", 10 ** 10, "ibc/27394", 10 ** 10), pool(2, "ibc/27394", 10 ** 10, "uion", 10 ** 10),
+             pool(3, "uion", 10 ** 10, "uosmo", 105 * 10 ** 8), pool(4, "uosmo", 10 ** 10, "ujuno", 10 ** 10),
+             pool(5, "ujuno", 10 ** 10, "uusdc", 10 ** 10), pool(6, "uusdc", 10 ** 10, "uosmo", 105 * 10 ** 8)]
+    return {"pools": pools, "pagination": {"next_key": None, "total": str(len(pools))}}
+
+
+def test_replay_sends_every_transaction_of_a_step(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(tmp_path / "osmosis")
+    os.makedirs(tmp_path / "input_data/dynamic/osmosis")
+    with open(tmp_path / "input_data/dynamic/osmosis/denom_to_symbol.json", "w") as f:
+        json.dump(DENOMS, f)
+    monkeypatch.setattr(osmosis_query, "script_dir", str(tmp_path / "osmosis"))
+
+    recorder = SnapshotRecorder(str(tmp_path / "snapshots"))
+    for _ in range(2):
+        recorder.record("osmosis/lcd_data", json.dumps(lcd_pools()).encode())
+    recorder.flush()
+
+    main = load_main()
+    app = main.ReplayApp("osmosis", directory=str(tmp_path / "snapshots"))
+    app.config["max_transactions_per_step"] = 2
+
+    sequences = []
+    build_swap_command = app.build_swap_command
+
+    def build(transaction, amount_in, sequence, gas=None, fees=None):
+        sequences.append(sequence)
+        return build_swap_command(transaction, amount_in=amount_in, sequence=sequence, gas=gas, fees=fees)
+
+    monkeypatch.setattr(app, "build_swap_command", build)
+    report = app.run()
+
+    # Both transactions of every step are built, with consecutive sequences, none is waited for
+    assert report.steps == 2
+    assert report.transactions == 4
+    assert sequences == [1, 2, 3, 4]
+    assert app.previous_sequence == 4
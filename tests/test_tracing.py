@@ -0,0 +1,53 @@
+import time
+import asyncio
+
+from amm import Asset, Pool, Transaction
+from utils.async_fetcher import AsyncFetcher
+from utils.fetcher import fetch_raw_data, latest_block_height
+from utils.tracing import Snapshot, Tracer, read_traces, summarize
+from tests.stub_server import StubServer
+
+
+def make_transaction() -> Transaction:
+    osmo, atom = Asset("OSMO", "uosmo"), Asset("ATOM", "ibc/27394")
+    pools = [Pool("1", osmo, atom, 0.003, 100, 100, 1, 1), Pool("2", atom, osmo, 0.003, 100, 100, 1, 1)]
+    return Transaction(1, 1, "OSMO", 5, pools, ["OSMO", "ATOM"], 0.1)
+
+
+def test_trace_heights(tmp_path):
+    tracer = Tracer(str(tmp_path / "traces.jsonl"))
+    now = time.time()
+    included = tracer.start(Snapshot(100, now - 1, now), make_transaction())
+    tracer.submitted(included, "ABC")
+    tracer.finished(included, 0, 102)
+    lost = tracer.start(Snapshot(None, now - 1, now), make_transaction())
+    tracer.submitted(lost, "DEF")
+    tracer.finished(lost, None)
+    tracer.flush()
+
+    traces = read_traces(str(tmp_path / "traces.jsonl"))
+    assert [(trace.snapshot.height, trace.status, trace.included_height) for trace in traces] == \
+        [(100, "included", 102), (None, "unknown", None)]
+    assert traces[0].blocks_to_inclusion == 2 and traces[1].blocks_to_inclusion is None
+
+    summary = summarize(traces)
+    assert summary["statuses"] == {"included": 1, "unknown": 1}
+    assert summary["blocks_to_inclusion"]["max"] == 2
+
+
+def test_lcd_block_height():
+    with StubServer({"/pools": {"pools": []}}, headers={"x-cosmos-block-height": "4321"}) as lcd:
+        fetched = time.time()
+        fetch_raw_data(f"{lcd.url}/pools")
+        assert latest_block_height(since=fetched) == 4321
+        assert latest_block_height(since=time.time() + 1) is None
+
+    async def main(fetcher):
+        try:
+            return await fetcher.fetch_raw_data(f"{lcd.url}/pools")
+        finally:
+            await fetcher.close()
+
+    with StubServer({"/pools": {"pools": []}}, headers={"x-cosmos-block-height": "4322"}) as lcd:
+        asyncio.run(main(AsyncFetcher()))
+    assert latest_block_height(since=fetched) == 4322
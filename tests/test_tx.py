@@ -0,0 +1,149 @@
+import base64
+import json
+import hashlib
+from typing import List, Tuple
+
+import pytest
+
+from amm import Asset, Pool, Transaction
+from osmosis.tx import TxClient, encode_sign_doc, SWAP_EXACT_AMOUNT_IN, SECP256K1_PUBKEY, SIGN_MODE_DIRECT
+from tests.stub_server import StubServer
+
+coincurve = pytest.importorskip("coincurve")
+from coincurve.ecdsa import cdata_to_der, deserialize_compact  # noqa: E402
+
+ACCOUNT = "osmo1sender"
+ACCOUNT_NUMBER = 4242
+
+
+def decode(buf: bytes) -> List[Tuple[int, object]]:
+    """ (field, value) of a protobuf message, value is an int for varints and bytes for the others """
+    fields = []
+    i = 0
+
+    def varint():
+        nonlocal i
+        value = shift = 0
+        while True:
+            byte = buf[i]
+            i += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if byte < 0x80:
+                return value
+
+    while i < len(buf):
+        key = varint()
+        if key & 7 == 0:
+            fields.append((key >> 3, varint()))
+        elif key & 7 == 2:
+            length = varint()
+            fields.append((key >> 3, buf[i:i + length]))
+            i += length
+        else:
+            raise ValueError(f"unexpected wire type {key & 7}")
+    return fields
+
+
+def make_transaction() -> Transaction:
+    osmo, atom, ion = Asset("OSMO", "uosmo"), Asset("ATOM", "ibc/27394"), Asset("ION", "uion")
+    pools = [Pool("1", osmo, atom, 0.003, 100, 100, 1, 1), Pool("498", atom, ion, 0.003, 100, 100, 1, 1),
+             Pool("2", ion, osmo, 0.003, 100, 100, 1, 1)]
+    return Transaction(1, 1, "OSMO", 5, pools, ["OSMO", "ATOM", "ION"], 0.1)
+
+
+@pytest.fixture
+def client(tmp_path) -> TxClient:
+    key_file = tmp_path / "key.hex"
+    key_file.write_text(coincurve.PrivateKey().secret.hex())
+    return TxClient(ACCOUNT, str(key_file), lcd="http://127.0.0.1:9", account_number=ACCOUNT_NUMBER)
+
+
+def test_swap_tx_fields(client):
+    tx_raw = dict(decode(client.build_swap_tx(make_transaction(), amount_in=1000000, sequence=8, fees=2700,
+                                              gas_limit=400000)))
+
+    body = decode(tx_raw[1])
+    assert [field for field, _ in body] == [1]
+    message = dict(decode(body[0][1]))
+    assert message[1].decode() == SWAP_EXACT_AMOUNT_IN
+
+    swap = decode(message[2])
+    assert swap[0] == (1, ACCOUNT.encode())
+    routes = [dict(decode(value)) for field, value in swap if field == 2]
+    assert [(route[1], route[2].decode()) for route in routes] == [(1, "ibc/27394"), (498, "uion"), (2, "uosmo")]
+    token_in = dict(decode(dict(swap)[3]))
+    assert (token_in[1].decode(), token_in[2].decode()) == ("uosmo", "1000000")
+    assert dict(swap)[4].decode() == "1000000"
+
+    auth_info = dict(decode(tx_raw[2]))
+    signer_info = dict(decode(auth_info[1]))
+    public_key = dict(decode(signer_info[1]))
+    assert public_key[1].decode() == SECP256K1_PUBKEY
+    assert dict(decode(public_key[2]))[1] == client.public_key
+    assert dict(decode(dict(decode(signer_info[2]))[1]))[1] == SIGN_MODE_DIRECT
+    assert signer_info[3] == 8
+
+    fee = dict(decode(auth_info[2]))
+    fee_amount = dict(decode(fee[1]))
+    assert (fee_amount[1].decode(), fee_amount[2].decode()) == ("uosmo", "2700")
+    assert fee[2] == 400000
+
+
+def test_swap_tx_signature(client):
+    tx_raw = dict(decode(client.build_swap_tx(make_transaction(), amount_in=1000000, sequence=8, fees=2700,
+                                              gas_limit=400000)))
+    signature = tx_raw[3]
+    assert len(signature) == 64
+
+    sign_doc = encode_sign_doc(tx_raw[1], tx_raw[2], client.chain, ACCOUNT_NUMBER)
+    sign_doc_fields = dict(decode(sign_doc))
+    assert sign_doc_fields[3].decode() == "osmosis-1"
+    assert sign_doc_fields[4] == ACCOUNT_NUMBER
+
+    public_key = coincurve.PublicKey(client.public_key)
+    assert public_key.verify(cdata_to_der(deserialize_compact(signature)), sign_doc)
+
+    # Signed for another account number, the chain would reject it
+    other_doc = encode_sign_doc(tx_raw[1], tx_raw[2], client.chain, ACCOUNT_NUMBER + 1)
+    assert not public_key.verify(cdata_to_der(deserialize_compact(signature)), other_doc)
+
+
+def test_account_number_and_broadcast(tmp_path):
+    def broadcast(body: bytes) -> dict:
+        tx_bytes = base64.b64decode(json.loads(body)["tx_bytes"])
+        return {"tx_response": {"txhash": hashlib.sha256(tx_bytes).hexdigest().upper(), "code": 0, "raw_log": "[]"}}
+
+    responses = {
+        f"/cosmos/auth/v1beta1/accounts/{ACCOUNT}": {"account": {
+            "@type": "/cosmos.vesting.v1beta1.ContinuousVestingAccount",
+            "base_vesting_account": {"base_account": {"address": ACCOUNT, "account_number": str(ACCOUNT_NUMBER)}}}},
+        "/cosmos/tx/v1beta1/txs": broadcast,
+    }
+    key_file = tmp_path / "key.hex"
+    key_file.write_text(coincurve.PrivateKey().secret.hex())
+
+    with StubServer(responses) as lcd:
+        client = TxClient(ACCOUNT, str(key_file), lcd=lcd.url)
+        tx_bytes = client.build_swap_tx(make_transaction(), amount_in=1000, sequence=1, fees=2700, gas_limit=400000)
+        assert client.account_number == ACCOUNT_NUMBER
+
+        for _ in range(3):
+            txhash, _ = client.broadcast(tx_bytes)
+            assert txhash == hashlib.sha256(tx_bytes).hexdigest().upper()
+
+    # The account number is fetched once, every request goes over the same connection
+    assert [request["path"] for request in lcd.requests].count(f"/cosmos/auth/v1beta1/accounts/{ACCOUNT}") == 1
+    assert len({request["port"] for request in lcd.requests}) == 1
+
+
+def test_broadcast_rejected(client):
+    responses = {"/cosmos/tx/v1beta1/txs": {"tx_response": {
+        "txhash": "ABC", "code": 32, "raw_log": "account sequence mismatch, expected 9, got 10"}}}
+
+    with StubServer(responses) as lcd:
+        client.lcd = lcd.url
+        txhash, raw_log = client.broadcast(b"\x0a\x00")
+
+    assert txhash is None
+    assert "sequence mismatch" in raw_log
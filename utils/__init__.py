@@ -1,3 +1,3 @@
-from utils.fetcher import fetch_raw_data
+from utils.fetcher import fetch_raw_data, fetch_raw_bytes, loads
 
-__all__ = ['fetch_raw_data']
+__all__ = ['fetch_raw_data', 'fetch_raw_bytes', 'loads']
@@ -0,0 +1,62 @@
+import json
+import asyncio
+import aiohttp
+
+from utils.fetcher import record_block_height
+
+
+class AsyncFetcher:
+    """
+    Shared aiohttp session : pooled keep-alive connections, gzip responses and a concurrency limit per host.
+    The session is bound to the event loop it is first used in.
+    """
+    def __init__(self, limit: int = 64, limit_per_host: int = 8, keepalive_timeout: float = 60, timeout: float = 10):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                             keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                                  headers={"Accept-Encoding": "gzip, deflate"})
+        return self._session
+
+    async def fetch_raw_data(self, url: str) -> dict:
+        """Fetch the URL and transforms response JSON text into an object"""
+        async with self.session.get(url) as res:
+            record_block_height(res.headers)
+            return json.loads(await res.text())
+
+    async def fetch_raw_bytes(self, url: str) -> bytes:
+        """Fetch the URL and return the undecoded response body"""
+        async with self.session.get(url) as res:
+            record_block_height(res.headers)
+            return await res.read()
+
+    async def post_raw_data(self, url: str, payload: dict) -> dict:
+        """Post a JSON payload to the URL and transforms response JSON text into an object"""
+        async with self.session.post(url, json=payload) as res:
+            return json.loads(await res.text())
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+async def retry(coroutine_function, attempts: int = 10):
+    """Await coroutine_function() until it succeeds, raise the last error after the given number of attempts"""
+    error = None
+    for attempt in range(attempts):
+        try:
+            return await coroutine_function()
+        except Exception as e:
+            error = e
+            await asyncio.sleep(0)
+    raise error
@@ -0,0 +1,215 @@
+import json
+import time
+import asyncio
+import threading
+from typing import Callable, Optional
+
+import aiohttp
+from loguru import logger
+
+from utils.fetcher import fetch_raw_data
+
+NEW_BLOCK_QUERY = "tm.event='NewBlock'"
+
+
+class BlockClock:
+    """
+    Latest known block height, published by a block source and waited on by the scheduler.
+    Also keeps a moving average of the block time.
+    """
+    def __init__(self, block_time: float = 6.):
+        self.height = 0
+        self.timestamp = None  # time.monotonic() of the latest block
+        self.block_time = block_time
+        self.condition = threading.Condition()
+
+    def publish(self, height: int) -> bool:
+        """ Record a block height, return whether it is a new one """
+        with self.condition:
+            if height <= self.height:
+                return False
+
+            now = time.monotonic()
+            if self.timestamp is not None and self.height > 0:
+                elapsed = (now - self.timestamp) / (height - self.height)
+                self.block_time = 0.8 * self.block_time + 0.2 * elapsed
+
+            self.height = height
+            self.timestamp = now
+            self.condition.notify_all()
+            return True
+
+    def wait(self, after: int, timeout: Optional[float] = None) -> int:
+        """ Wait until a height above after is published or timeout seconds elapsed, return the latest height """
+        with self.condition:
+            self.condition.wait_for(lambda: self.height > after, timeout=timeout)
+            return self.height
+
+
+def block_height(message: dict) -> Optional[int]:
+    """ Height of a Tendermint NewBlock event message, None for any other message """
+    try:
+        return int(message["result"]["data"]["value"]["block"]["header"]["height"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class TendermintSubscriber:
+    """
+    Subscribes to the NewBlock events of a Tendermint RPC websocket in a background thread and publishes
+    every height to the clock. Reconnects with an exponential backoff when the subscription drops,
+    connected is cleared meanwhile.
+    """
+    def __init__(self, rpc_url: str, clock: BlockClock, reconnect_delay: float = 1., max_reconnect_delay: float = 30.):
+        websocket_url = rpc_url.replace("https://", "wss://").replace("http://", "ws://")
+        self.websocket_url = websocket_url.rstrip("/") + "/websocket"
+        self.clock = clock
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connected = threading.Event()
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._run()), name="block-subscriber", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    async def _run(self):
+        delay = self.reconnect_delay
+        while not self._stop.is_set():
+            try:
+                await self._subscribe()
+                delay = self.reconnect_delay
+            except Exception as e:
+                logger.warning(f'Block subscription to {self.websocket_url} dropped : {e}')
+            self.connected.clear()
+
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, self.max_reconnect_delay)
+
+    async def _subscribe(self):
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(self.websocket_url, heartbeat=30) as ws:
+                await ws.send_json({"jsonrpc": "2.0", "method": "subscribe", "id": 0,
+                                    "params": {"query": NEW_BLOCK_QUERY}})
+                async for message in ws:
+                    if self._stop.is_set() or message.type != aiohttp.WSMsgType.TEXT:
+                        break
+
+                    height = block_height(json.loads(message.data))
+                    if height is not None:
+                        self.connected.set()
+                        self.clock.publish(height)
+
+
+class FakeBlockSource:
+    """
+    Local block source for tests : publishes a new height every block_time seconds. disconnect() and
+    connect() simulate a dropped subscription, heights keep increasing meanwhile.
+    """
+    def __init__(self, clock: BlockClock, block_time: float = 0.1, start_height: int = 1):
+        self.clock = clock
+        self.block_time = block_time
+        self.height = start_height
+        self.connected = threading.Event()
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.connected.set()
+        self._thread = threading.Thread(target=self._run, name="fake-block-source", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def connect(self):
+        self.connected.set()
+
+    def disconnect(self):
+        self.connected.clear()
+
+    def latest_height(self) -> int:
+        """ Same as polling the RPC status """
+        return self.height
+
+    def _run(self):
+        while not self._stop.wait(self.block_time):
+            self.height += 1
+            if self.connected.is_set():
+                self.clock.publish(self.height)
+
+
+class BlockScheduler:
+    """
+    Hands out every new block height once, as soon as the block source publishes it. While the source
+    is disconnected, the latest height is polled instead : first around the expected time of the next
+    block, then more and more sparsely up to max_poll_interval.
+    Heights produced while the caller was busy are skipped, only the latest one is returned.
+    """
+    def __init__(self, source, clock: BlockClock, poll_height: Callable[[], int], min_poll_interval: float = 0.05,
+                 max_poll_interval: float = 1.):
+        self.source = source
+        self.clock = clock
+        self.poll_height = poll_height
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.height = 0
+        self.polls = 0
+
+    def start(self):
+        self.source.start()
+
+    def stop(self):
+        self.source.stop()
+
+    def next_block(self) -> int:
+        """ Wait for a block above the last returned one and return its height """
+        interval = self.min_poll_interval
+        while True:
+            if self.source.connected.is_set():
+                height = self.clock.wait(self.height, timeout=self.max_poll_interval)
+            else:
+                height = self._poll()
+
+            if height > self.height:
+                self.height = height
+                return height
+
+            if not self.source.connected.is_set():
+                # Woken up early if the source reconnects meanwhile
+                self.clock.wait(self.height, timeout=interval)
+                interval = min(1.5 * interval, self.max_poll_interval)
+
+    def _poll(self) -> int:
+        # Nothing new can be expected before the next block time
+        if self.clock.timestamp is not None:
+            expected = self.clock.timestamp + 0.9 * self.clock.block_time - time.monotonic()
+            if expected > 0:
+                height = self.clock.wait(self.height, timeout=min(expected, self.max_poll_interval))
+                if height > self.height:
+                    return height
+
+        self.polls += 1
+        try:
+            self.clock.publish(int(self.poll_height()))
+        except Exception as e:
+            logger.warning(f'Block height could not be polled : {e}')
+        return self.clock.height
+
+
+def make_block_scheduler(rpc_url: str, min_poll_interval: float = 0.05, max_poll_interval: float = 1.) \
+        -> BlockScheduler:
+    """ Scheduler on the NewBlock events of a Tendermint RPC, polling its status when the websocket drops """
+    clock = BlockClock()
+
+    def poll_height() -> int:
+        return int(fetch_raw_data(f"{rpc_url.rstrip('/')}/status")["result"]["sync_info"]["latest_block_height"])
+
+    return BlockScheduler(TendermintSubscriber(rpc_url, clock), clock, poll_height,
+                          min_poll_interval=min_poll_interval, max_poll_interval=max_poll_interval)
@@ -1,8 +1,12 @@
 import pickle
-import networkx as nx
+import hashlib
+import json
+import shutil
+import numpy as np
 from amm import AMM
 import os
-from typing import List
+from loguru import logger
+from typing import List, Iterator, Optional, Sequence, Iterable
 
 
 def load_available_cycles(platform):
@@ -11,21 +15,51 @@ def load_available_cycles(platform):
     return cycles
 
 
-def save_available_cycles(platform, amm: AMM, priorities: List[str]):
-    G = nx.DiGraph()
-
-    for p in amm.pools.values():
-
-        G.add_edge(p.symbol_1, p.symbol_2)
-        G.add_edge(p.symbol_2, p.symbol_1)
-
-    cycles = list(nx.simple_cycles(G))
-
-    filtered_cycles = []
-    for cycle in cycles:
-        cycle, from_asset = rotate_cycle(cycle, priorities=priorities)
-        if from_asset in priorities:
-            filtered_cycles.append(cycle)
+def iter_cycles(amm: AMM, priorities: List[str], max_hops: Optional[int] = None,
+                skip_reversed=False) -> Iterator[List[str]]:
+    """
+    Lazily enumerate the simple cycles of the assets graph that go through at least one of the priorities.
+    Each cycle is yielded once, starting with its first asset in the priorities order (as rotate_cycle does):
+    the DFS only starts from priorities and never goes through a priority that comes before its start.
+    :param max_hops: maximum number of swaps in a cycle, unbounded if None
+    :param skip_reversed: only yield one of a cycle and its reverse
+    """
+    neighbours = {}  # asset_symbol --> sorted symbols it shares a pool with
+    for symbol_1, symbol_2 in amm.edges:
+        neighbours.setdefault(symbol_1, set()).add(symbol_2)
+        neighbours.setdefault(symbol_2, set()).add(symbol_1)
+    neighbours = {symbol: sorted(symbols) for symbol, symbols in neighbours.items()}
+
+    if max_hops is None:
+        max_hops = len(neighbours)
+
+    for k, start in enumerate(priorities):
+        if start not in neighbours:
+            continue
+
+        blocked = set(priorities[:k])
+        path = [start]
+        on_path = {start}
+        stack = [iter(neighbours[start])]
+
+        while stack:
+            for symbol in stack[-1]:
+                if symbol == start:
+                    if len(path) >= 2 and (not skip_reversed or path[1] <= path[-1]):
+                        yield list(path)
+                elif symbol not in on_path and symbol not in blocked and len(path) < max_hops:
+                    path.append(symbol)
+                    on_path.add(symbol)
+                    stack.append(iter(neighbours[symbol]))
+                    break
+            else:
+                stack.pop()
+                on_path.discard(path.pop())
+
+
+def save_available_cycles(platform, amm: AMM, priorities: List[str], max_hops: Optional[int] = None,
+                          skip_reversed=False):
+    filtered_cycles = list(iter_cycles(amm, priorities=priorities, max_hops=max_hops, skip_reversed=skip_reversed))
 
     os.makedirs(f'input_data/dynamic/{platform}/', exist_ok=True)
 
@@ -52,3 +86,126 @@ def rotate_cycle(cycle: List[str], priorities):
 
     cycle = cycle[break_index:] + cycle[:break_index]
     return cycle, from_asset
+
+
+class CycleCache(Sequence):
+    """
+    Compact storage of cycles : an interned symbol table and two int32 arrays, cycle n being
+    [symbols[k] for k in nodes[offsets[n]:offsets[n + 1]]]. Saved arrays are opened with np.memmap,
+    so loading is almost free and the pages are shared between processes.
+    """
+    def __init__(self, symbols: List[str], offsets: np.ndarray, nodes: np.ndarray):
+        self.symbols = symbols
+        self.offsets = offsets
+        self.nodes = nodes
+
+    @classmethod
+    def build(cls, cycles: Iterable[List[str]]) -> 'CycleCache':
+        symbols = []
+        symbol_index = {}  # asset_symbol --> index in symbols
+        offsets = [0]
+        nodes = []
+
+        for cycle in cycles:
+            for symbol in cycle:
+                if symbol not in symbol_index:
+                    symbol_index[symbol] = len(symbols)
+                    symbols.append(symbol)
+                nodes.append(symbol_index[symbol])
+            offsets.append(len(nodes))
+
+        return cls(symbols, np.array(offsets, dtype=np.int32), np.array(nodes, dtype=np.int32))
+
+    # Written last by save : a cache directory without it was not fully written
+    complete_marker = 'complete'
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+
+        with open(os.path.join(directory, 'symbols.json'), 'w') as f:
+            json.dump(self.symbols, f)
+
+        # Raw int32 arrays, their lengths are enough to memmap them back
+        self.offsets.tofile(os.path.join(directory, 'offsets.i32'))
+        self.nodes.tofile(os.path.join(directory, 'nodes.i32'))
+
+        open(os.path.join(directory, self.complete_marker), 'w').close()
+
+    @classmethod
+    def open(cls, directory: str) -> 'CycleCache':
+        """ Raise ValueError if the cache in directory is incomplete or its arrays do not match """
+        if not os.path.exists(os.path.join(directory, cls.complete_marker)):
+            raise ValueError(f'{directory} is not a complete cycle cache')
+
+        with open(os.path.join(directory, 'symbols.json'), 'r') as f:
+            symbols = json.load(f)
+
+        offsets = _memmap_int32(os.path.join(directory, 'offsets.i32'))
+        nodes = _memmap_int32(os.path.join(directory, 'nodes.i32'))
+        if len(offsets) == 0 or offsets[-1] != len(nodes):
+            raise ValueError(f'{directory} has {len(nodes)} nodes for offsets up to {offsets[-1:]}')
+
+        return cls(symbols, offsets, nodes)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[k] for k in range(*n.indices(len(self)))]
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError('cycle index out of range')
+        return [self.symbols[k] for k in self.nodes[self.offsets[n]:self.offsets[n + 1]]]
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+
+def _memmap_int32(path: str) -> np.ndarray:
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.int32)
+    return np.memmap(path, dtype=np.int32, mode='r')
+
+
+def topology_hash(amm: AMM, priorities: List[str], max_hops: Optional[int] = None, skip_reversed=False) -> str:
+    """
+    Hash of everything the cycles depend on : the assets graph edges and the enumeration parameters
+    """
+    h = hashlib.sha1()
+    h.update(json.dumps([sorted(amm.edges), priorities, max_hops, skip_reversed]).encode())
+    return h.hexdigest()[:16]
+
+
+def load_cycle_cache(platform, amm: AMM, priorities: List[str], max_hops: Optional[int] = None,
+                     skip_reversed=False) -> CycleCache:
+    """
+    Open the cycles of the AMM topology from the binary cache, enumerate and save them first if the
+    topology changed since they were cached, or if its cache is incomplete or corrupt. The caches of the other
+    topologies are left as they are
+    """
+    key = topology_hash(amm, priorities=priorities, max_hops=max_hops, skip_reversed=skip_reversed)
+    directory = f'input_data/dynamic/{platform}/cycles/{key}'
+
+    if os.path.exists(directory):
+        try:
+            return CycleCache.open(directory)
+        except (OSError, ValueError) as e:
+            # Only this topology is rebuilt, the caches of the other ones may still be used by other configs
+            logger.warning(f'Cycle cache {key} is rebuilt : {e}')
+            shutil.rmtree(directory, ignore_errors=True)
+
+    cache = CycleCache.build(iter_cycles(amm, priorities=priorities, max_hops=max_hops,
+                                         skip_reversed=skip_reversed))
+
+    # Write in a temporary directory and rename it, so a concurrent reader never sees a partial cache
+    tmp_directory = f'{directory}.{os.getpid()}.tmp'
+    cache.save(tmp_directory)
+    try:
+        os.rename(tmp_directory, directory)
+    except OSError:
+        shutil.rmtree(tmp_directory)  # Another process cached the same topology meanwhile
+
+    return CycleCache.open(directory)
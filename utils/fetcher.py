@@ -1,9 +1,55 @@
 import requests
 import json
+import time
+from typing import Optional
+
+from loguru import logger
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_orjson_warned = False  # the json fallback is logged once
+# Height in the x-cosmos-block-height header of the latest LCD response, and when it was received
+_latest_height = (None, 0.)
 
 
 def fetch_raw_data(url: str) -> dict:
     """Fetch the URL and transforms response JSON text into an object"""
     res = requests.get(url)
+    record_block_height(res.headers)
     raw_data = json.loads(res.text)
     return raw_data
+
+
+def fetch_raw_bytes(url: str) -> bytes:
+    """Fetch the URL and return the undecoded response body"""
+    res = requests.get(url)
+    record_block_height(res.headers)
+    return res.content
+
+
+def loads(raw: bytes):
+    """Decode JSON with orjson when it is installed, json otherwise"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    global _orjson_warned
+    if not _orjson_warned:
+        _orjson_warned = True
+        logger.info("orjson is not installed, payloads are decoded with json (pip3 install orjson)")
+    return json.loads(raw)
+
+
+def record_block_height(headers):
+    """Keep the block height of the response headers of the LCD, the other APIs do not send it"""
+    global _latest_height
+    height = headers.get("x-cosmos-block-height")
+    if height is not None:
+        _latest_height = (int(height), time.time())
+
+
+def latest_block_height(since: float = 0.) -> Optional[int]:
+    """Block height of the latest LCD response received after since (a time.time()), None if there is none"""
+    height, received = _latest_height
+    return height if received >= since else None
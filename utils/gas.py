@@ -0,0 +1,91 @@
+import os
+import re
+import json
+import math
+import threading
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+# e.g. "insufficient fees; got: 2700uosmo required: 3000uosmo: insufficient fee"
+INSUFFICIENT_FEES = re.compile(r"insufficient fees; got: (\d+)\w* required: (\d+)")
+OUT_OF_GAS = 11  # code of the transactions that ran out of gas
+
+
+def route_shape(transaction) -> str:
+    """ Gas is learned per hop count and pool types, e.g. "3:xyk,xyk,stable" """
+    return f"{len(transaction.pools)}:" + ",".join(pool.pool_type for pool in transaction.pools)
+
+
+class GasModel:
+    """
+    Gas used by the past transactions of every route shape, persisted in a JSON file. Estimates are the
+    highest recent gas used of the shape times a safety margin, so that no gas simulation is needed.
+    The gas price goes up to what the chain requires when fees are rejected, and slowly back down towards
+    min_gas_price while transactions are accepted.
+    """
+    def __init__(self, path: str, default_gas: int = 400000, gas_price: float = 0.0025, min_gas_price: float = 0.0025,
+                 margin: float = 1.2, history: int = 50, decay: float = 0.01):
+        self.path = path
+        self.default_gas = default_gas
+        self.min_gas_price = min_gas_price
+        self.margin = margin
+        self.history = history
+        self.decay = decay
+
+        self.gas_price = gas_price
+        self.observations: Dict[str, List[int]] = {}  # route shape --> gas used, oldest first
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            self.gas_price = data.get("gas_price", gas_price)
+            self.observations = data.get("observations", {})
+
+    def estimate(self, transaction) -> int:
+        """ Gas limit of the transaction """
+        with self.lock:
+            observations = self.observations.get(route_shape(transaction))
+            if not observations:
+                # Unknown shape : the most expensive known shape with as many hops
+                hops = f"{len(transaction.pools)}:"
+                observations = [gas for shape, gases in self.observations.items() if shape.startswith(hops)
+                                for gas in gases]
+            if not observations:
+                return self.default_gas
+            return int(math.ceil(max(observations) * self.margin))
+
+    def fee(self, gas: int) -> int:
+        return int(math.ceil(gas * self.gas_price))
+
+    def record(self, shape: str, gas_used: int, out_of_gas: bool = False):
+        """
+        Gas used by an included transaction. When it ran out of gas, the estimate of its shape is raised.
+        """
+        with self.lock:
+            if out_of_gas:
+                gas_used = int(math.ceil(gas_used * self.margin))
+            observations = self.observations.setdefault(shape, [])
+            observations.append(int(gas_used))
+            del observations[:-self.history]
+            self.save()
+
+    def outcome(self, gas: int, txhash: Optional[str], output: str = ""):
+        """ Adjust the gas price from the result of a submission made with the given gas limit """
+        with self.lock:
+            insufficient = INSUFFICIENT_FEES.search(output or "")
+            if insufficient is not None:
+                required = int(insufficient.group(2))
+                self.gas_price = max(self.gas_price, 1.02 * required / gas)
+                logger.warning(f'Fees rejected, gas price raised to {self.gas_price:.5f}')
+                self.save()
+            elif txhash is not None:
+                self.gas_price = max(self.min_gas_price, self.gas_price * (1 - self.decay))
+
+    def save(self):
+        os.makedirs(os.path.split(self.path)[0], exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"gas_price": self.gas_price, "observations": self.observations}, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import cProfile
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Callable
+
+import numpy as np
+from loguru import logger
+
+script_dir = os.path.dirname(__file__)
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = [1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.]
+
+
+class Histogram:
+    """ Latency histogram with fixed buckets, as a Prometheus histogram """
+    def __init__(self, buckets: List[float] = BUCKETS):
+        self.buckets = np.array(buckets)
+        self.counts = np.zeros(len(buckets) + 1, dtype=np.int64)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value: float):
+        self.counts[np.searchsorted(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """ Upper bound of the bucket holding the q quantile (max for the +Inf bucket) """
+        if self.count == 0:
+            return 0.
+        index = int(np.searchsorted(np.cumsum(self.counts), q * self.count))
+        return float(self.buckets[index]) if index < len(self.buckets) else self.max
+
+    def summary(self) -> dict:
+        return {"count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count else 0.,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99), "max": self.max}
+
+
+class Metrics:
+    """
+    Latency histograms of the stages of a step, counters, and gauges. end_step() sets the last_step_<counter>
+    gauges to what each counter gained during the step.
+    """
+    def __init__(self, prefix: str = "osmobot"):
+        self.prefix = prefix
+        self.histograms: Dict[str, Histogram] = {}  # stage --> latencies
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self._step_start: Dict[str, float] = {}  # counters at the end of the previous step
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        """ Record the duration of the with block in the stage histogram """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    def end_step(self):
+        with self.lock:
+            for name, value in self.counters.items():
+                self.gauges[f"last_step_{name}"] = value - self._step_start.get(name, 0)
+            self._step_start = dict(self.counters)
+
+    def to_json(self) -> dict:
+        with self.lock:
+            return {"stages": {stage: histogram.summary() for stage, histogram in self.histograms.items()},
+                    "counters": dict(self.counters), "gauges": dict(self.gauges)}
+
+    def to_prometheus(self) -> str:
+        """ Prometheus text exposition format """
+        lines = []
+        with self.lock:
+            name = f"{self.prefix}_stage_seconds"
+            lines.append(f"# TYPE {name} histogram")
+            for stage, histogram in self.histograms.items():
+                cumulative = np.cumsum(histogram.counts)
+                for bound, count in zip(list(histogram.buckets) + ["+Inf"], cumulative):
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+
+            for counter, value in self.counters.items():
+                lines.append(f"# TYPE {self.prefix}_{counter}_total counter")
+                lines.append(f"{self.prefix}_{counter}_total {value}")
+
+            for gauge, value in self.gauges.items():
+                lines.append(f"# TYPE {self.prefix}_{gauge} gauge")
+                lines.append(f"{self.prefix}_{gauge} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(metrics: Metrics, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """ Serve /metrics (Prometheus text) and /metrics.json from a background thread """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = metrics.to_prometheus().encode(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(metrics.to_json()).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f'Metrics served on http://{host}:{port}/metrics')
+    return server
+
+
+class StepProfiler:
+    """ Runs one call out of every under cProfile and dumps its stats in directory, for snakeviz or pstats """
+    def __init__(self, every: int, directory: Optional[str] = None):
+        self.every = every
+        self.directory = directory or os.path.join(script_dir, "../input_data/profiles")
+        self.calls = 0
+
+    def __call__(self, function: Callable, *args, **kwargs):
+        self.calls += 1
+        if self.calls % self.every != 0:
+            return function(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args, **kwargs)
+        finally:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(os.path.join(self.directory, f"step-{int(time.time() * 1000)}-{self.calls}.prof"))
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """ Metrics shared by the App, the platform query modules and the engine """
+    return _metrics
@@ -0,0 +1,119 @@
+import time
+import queue
+import threading
+import collections
+from typing import List, Callable, Optional
+
+from loguru import logger
+
+
+class LatestQueue:
+    """
+    Bounded queue between two stages that never blocks the producer : when it is full, the oldest item
+    is dropped, so the consumer always gets the most recent ones.
+    """
+    def __init__(self, maxsize: int = 1):
+        self.items = collections.deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self, timeout: Optional[float] = None):
+        """ Oldest item, raise queue.Empty if there is none after timeout seconds """
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.items) > 0, timeout=timeout):
+                raise queue.Empty
+            return self.items.popleft()
+
+
+class Stage:
+    """ One thread running function(item) on every item of its input queue, None outputs are not passed on """
+    def __init__(self, name: str, function: Callable, inputs: Optional[LatestQueue],
+                 outputs: Optional[LatestQueue]):
+        self.name = name
+        self.function = function
+        self.inputs = inputs
+        self.outputs = outputs
+
+        self.processed = 0
+        self.busy = 0.  # seconds spent in function
+        self.error = None
+        self.thread = None
+
+    def run(self, stop: threading.Event):
+        try:
+            while not stop.is_set():
+                if self.inputs is None:
+                    item = None
+                else:
+                    try:
+                        item = self.inputs.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+
+                start = time.perf_counter()
+                output = self.function(item)
+                self.busy += time.perf_counter() - start
+                self.processed += 1
+
+                if output is not None and self.outputs is not None:
+                    self.outputs.put(output)
+        except Exception as e:
+            logger.exception(f'Stage {self.name} failed')
+            self.error = e
+            stop.set()
+
+
+class Pipeline:
+    """
+    Runs functions as stages in their own threads, connected by LatestQueues : the first stage is called
+    with None in a loop, every next one gets the outputs of the previous one. A slow stage makes the
+    previous one drop its stale outputs instead of waiting.
+    """
+    def __init__(self, functions: List[Callable], names: List[str] = None, maxsize: int = 1):
+        if names is None:
+            names = [function.__name__ for function in functions]
+
+        self.queues = [LatestQueue(maxsize) for _ in functions[1:]]
+        self.stages = [Stage(name, function, inputs, outputs) for name, function, inputs, outputs
+                       in zip(names, functions, [None] + self.queues, self.queues + [None])]
+        self.stop_event = threading.Event()
+
+    def start(self):
+        for stage in self.stages:
+            stage.thread = threading.Thread(target=stage.run, args=(self.stop_event,), name=f'pipeline-{stage.name}',
+                                            daemon=True)
+            stage.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        for stage in self.stages:
+            if stage.thread is not None:
+                stage.thread.join()
+
+    def run(self, duration: Optional[float] = None):
+        """
+        Run until stopped, a stage fails (its error is raised) or duration seconds are elapsed
+        """
+        self.start()
+        try:
+            self.stop_event.wait(timeout=duration)
+        finally:
+            self.stop()
+            logger.info(f'{self}')
+
+        for stage in self.stages:
+            if stage.error is not None:
+                raise stage.error
+
+    def __repr__(self):
+        stages = ", ".join(f"{stage.name}={stage.processed} in {stage.busy:.2f}s" for stage in self.stages)
+        dropped = ", ".join(f"{stage.name}={outputs.dropped}"
+                            for stage, outputs in zip(self.stages, self.queues))
+        return f"Pipeline(processed: {stages} ; dropped: {dropped})"
@@ -0,0 +1,127 @@
+import os
+import json
+import gzip
+import time
+import queue
+import threading
+from typing import Iterator, Tuple, Optional
+
+from loguru import logger
+
+script_dir = os.path.dirname(__file__)
+
+
+class SnapshotRecorder:
+    """
+    Hands raw payloads to a background writer thread, so the trading loop never waits for the disk.
+
+    Each payload name (e.g. "osmosis/lcd_data") gets its own directory of append-only segments : every
+    snapshot is one gzip member appended to the current segment, and one line of index.jsonl records its
+    timestamp, segment, offset and length. The latest payload of a name can also be mirrored to a plain file.
+    When the queue is full, snapshots are dropped instead of blocking.
+    """
+    def __init__(self, directory: str, max_queue: int = 64, segment_size: int = 64 * 1024 * 1024,
+                 record_history: bool = True):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.record_history = record_history
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.recorded = 0
+        self.dropped = 0
+
+        self._segments = {}  # name --> current segment file name
+        self._thread = threading.Thread(target=self._run, name="snapshot-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, name: str, payload, latest_path: Optional[str] = None) -> bool:
+        """
+        Queue a payload (bytes or JSON serializable object), return False if it was dropped
+        :param latest_path: also overwrite this file with the payload
+        """
+        try:
+            self.queue.put_nowait((time.time(), name, payload, latest_path))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self):
+        """Wait until every queued snapshot is written"""
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            timestamp, name, payload, latest_path = self.queue.get()
+            try:
+                self._write(timestamp, name, payload, latest_path)
+                self.recorded += 1
+            except Exception as e:
+                logger.warning(f'Snapshot {name} could not be written : {e}')
+            finally:
+                self.queue.task_done()
+
+    def _write(self, timestamp: float, name: str, payload, latest_path: Optional[str]):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+
+        if latest_path is not None:
+            os.makedirs(os.path.split(latest_path)[0], exist_ok=True)
+            tmp_path = f'{latest_path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, latest_path)
+
+        if not self.record_history:
+            return
+
+        directory = os.path.join(self.directory, name)
+        os.makedirs(directory, exist_ok=True)
+
+        segment = self._segments.get(name)
+        if segment is None or os.path.getsize(os.path.join(directory, segment)) >= self.segment_size:
+            segment = f'{int(timestamp * 1000)}.gz'
+            self._segments[name] = segment
+
+        with open(os.path.join(directory, segment), 'ab') as f:
+            offset = f.tell()
+            f.write(gzip.compress(data, compresslevel=1))
+            length = f.tell() - offset
+
+        with open(os.path.join(directory, 'index.jsonl'), 'a') as f:
+            f.write(json.dumps({"timestamp": timestamp, "segment": segment, "offset": offset,
+                                "length": length}) + "\n")
+
+
+def read_snapshots(directory: str, name: str) -> Iterator[Tuple[float, bytes]]:
+    """Yield (timestamp, payload) of every recorded snapshot of a name, oldest first"""
+    directory = os.path.join(directory, name)
+    index_file = os.path.join(directory, 'index.jsonl')
+    if not os.path.exists(index_file):
+        return
+
+    with open(index_file, 'r') as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+
+    for entry in entries:
+        with open(os.path.join(directory, entry["segment"]), 'rb') as f:
+            f.seek(entry["offset"])
+            yield entry["timestamp"], gzip.decompress(f.read(entry["length"]))
+
+
+_recorder: Optional[SnapshotRecorder] = None
+
+
+def configure_recorder(directory: str = None, record_history: bool = False, max_queue: int = 64) -> SnapshotRecorder:
+    """Replace the recorder used by the platform query modules"""
+    global _recorder
+    if directory is None:
+        directory = os.path.join(script_dir, "../input_data/snapshots")
+    _recorder = SnapshotRecorder(directory, max_queue=max_queue, record_history=record_history)
+    return _recorder
+
+
+def get_recorder() -> SnapshotRecorder:
+    """Recorder used by the platform query modules, it only mirrors the latest payloads until configured"""
+    if _recorder is None:
+        configure_recorder()
+    return _recorder
@@ -0,0 +1,77 @@
+import os
+from typing import Iterator, Tuple, List, Optional
+
+from utils.recorder import read_snapshots
+from utils.tracing import trace_log_path
+
+script_dir = os.path.dirname(__file__)
+
+# platform --> (name of its recorded payload, latest payload file)
+snapshot_sources = {
+    "osmosis": ("osmosis/lcd_data", "../input_data/dynamic/osmosis/lcd_data.json"),
+    "terraswap": ("terraswap/data", "../input_data/dynamic/terraswap/data.json"),
+    "astroport": ("astroport/amounts", "../input_data/dynamic/astroport/amounts.json"),
+}
+
+
+def replay_trace_path(platform: str, directory: Optional[str] = None) -> str:
+    """
+    Trace log of the replays of a SnapshotRecorder directory, kept next to the snapshots instead of
+    mixed with the traces of the live transactions
+    :param directory: SnapshotRecorder directory, input_data/snapshots by default
+    """
+    if directory is None:
+        directory = os.path.join(script_dir, "../input_data/snapshots")
+    return trace_log_path(platform, directory=os.path.join(directory, "traces"))
+
+
+def iter_snapshots(platform: str, directory: Optional[str] = None) -> Iterator[Tuple[float, bytes]]:
+    """
+    Yield (timestamp, payload) of the recorded snapshots of a platform, oldest first. Falls back on the
+    latest payload file when no history was recorded.
+    :param directory: SnapshotRecorder directory, input_data/snapshots by default
+    """
+    if directory is None:
+        directory = os.path.join(script_dir, "../input_data/snapshots")
+
+    name, latest_file = snapshot_sources[platform]
+
+    found = False
+    for timestamp, payload in read_snapshots(directory, name):
+        found = True
+        yield timestamp, payload
+
+    if not found:
+        latest_file = os.path.join(script_dir, latest_file)
+        with open(latest_file, "rb") as f:
+            yield os.path.getmtime(latest_file), f.read()
+
+
+class ReplayReport:
+    """Throughput and decisions of a replay"""
+    def __init__(self):
+        self.steps = 0
+        self.seconds = 0.
+        self.opportunities = 0
+        self.transactions = 0
+        self.pnl = 0.  # Sum of the dollars_delta of the submitted transactions
+
+    def add_step(self, seconds: float, opportunities: int, transactions: List):
+        """
+        :param opportunities: number of profitable transactions found during the step
+        :param transactions: transactions submitted during the step
+        """
+        self.steps += 1
+        self.seconds += seconds
+        self.opportunities += opportunities
+        self.transactions += len(transactions)
+        self.pnl += sum(transaction.dollars_delta for transaction in transactions)
+
+    @property
+    def steps_per_second(self) -> float:
+        return self.steps / self.seconds if self.seconds > 0 else 0.
+
+    def __repr__(self):
+        return f"ReplayReport(steps={self.steps}, steps_per_second={self.steps_per_second:.2f}, " \
+               f"opportunities={self.opportunities}, transactions={self.transactions}, pnl={self.pnl:.2f})"
+
@@ -0,0 +1,68 @@
+import re
+import time
+import threading
+from typing import Callable, Optional
+
+from loguru import logger
+
+# e.g. "account sequence mismatch, expected 12, got 11: incorrect account sequence"
+SEQUENCE_MISMATCH = re.compile(r"account sequence mismatch, expected (\d+), got (\d+)")
+
+
+class SequenceManager:
+    """
+    Tracks the account sequence locally and hands out increasing sequences to the submissions, so that
+    several transactions can be in flight without fetching the sequence before each of them.
+    The sequence is fetched from chain again only after a failed submission, or once no sequence was handed
+    out for resync_interval seconds (the chain sequence lags behind the transactions in flight). A sequence
+    mismatch error gives the expected sequence, it is used without fetching.
+    """
+    def __init__(self, fetch_sequence: Callable[[], int], resync_interval: Optional[float] = 60.):
+        self.fetch_sequence = fetch_sequence
+        self.resync_interval = resync_interval
+
+        self.sequence = None  # next sequence to hand out, None until synced
+        self.used_at = None   # time.monotonic() of the last sync or sequence handed out
+        self.resyncs = 0
+        self.lock = threading.Lock()
+
+    def _sync(self):
+        self.sequence = int(self.fetch_sequence())
+        self.resyncs += 1
+        logger.debug(f'Account sequence synced : {self.sequence}')
+
+    def next(self) -> int:
+        """ Sequence of the next submission """
+        with self.lock:
+            now = time.monotonic()
+            idle = self.resync_interval is not None and self.used_at is not None and \
+                now - self.used_at > self.resync_interval
+            if self.sequence is None or idle:
+                self._sync()
+
+            sequence = self.sequence
+            self.sequence += 1
+            self.used_at = now
+            return sequence
+
+    def report(self, sequence: int, txhash: Optional[str], output: str = ""):
+        """
+        Outcome of the submission made with sequence
+        :param txhash: None if the submission failed
+        :param output: submission output, searched for a sequence mismatch
+        """
+        with self.lock:
+            mismatch = SEQUENCE_MISMATCH.search(output or "")
+            if mismatch is not None:
+                # The chain tells the sequence it expects, no need to fetch it
+                expected = int(mismatch.group(1))
+                logger.warning(f'Sequence {sequence} rejected, expected {expected}')
+                self.sequence = expected
+            elif txhash is None:
+                # The sequence may not have been consumed, the next ones would all be rejected
+                self.sequence = None
+
+    def invalidate(self):
+        """ Fetch the sequence from chain before the next submission """
+        with self.lock:
+            self.sequence = None
@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+script_dir = os.path.dirname(__file__)
+
+
+class Snapshot:
+    """ Where the reserves of a model come from : block height (None when unknown) and fetch times """
+    __slots__ = ("height", "fetch_started", "fetched")
+
+    def __init__(self, height: Optional[int], fetch_started: float, fetched: float):
+        self.height = height
+        self.fetch_started = fetch_started  # time.time() when the fetch was sent
+        self.fetched = fetched              # time.time() when the model was built
+
+    def __repr__(self):
+        return f"Snapshot(height={self.height}, fetch_started={self.fetch_started:.3f}, fetched={self.fetched:.3f})"
+
+
+class Trace:
+    """ Life of an opportunity, from the snapshot it was found in to the inclusion of its transaction """
+    __slots__ = ("trace_id", "snapshot", "decided", "submitted", "txhash", "status", "code", "included_height")
+
+    def __init__(self, trace_id: str, snapshot: Snapshot, decided: float):
+        self.trace_id = trace_id
+        self.snapshot = snapshot
+        self.decided = decided
+        self.submitted = None
+        self.txhash = None
+        self.status = "decided"  # then submitted or rejected, then included, failed or unknown
+        self.code = None
+        self.included_height = None
+
+    @property
+    def data_age(self) -> float:
+        """ Age of the reserves when the transaction left (when it was decided, if it was not sent) """
+        return (self.submitted or self.decided) - self.snapshot.fetch_started
+
+    @property
+    def decision_latency(self) -> float:
+        """ From the model being built to the transaction being chosen """
+        return self.decided - self.snapshot.fetched
+
+    @property
+    def blocks_to_inclusion(self) -> Optional[int]:
+        """ Blocks from the snapshot to the one the transaction is in, None when either is unknown """
+        if self.snapshot.height is None or self.included_height is None:
+            return None
+        return self.included_height - self.snapshot.height
+
+
+class Tracer:
+    """
+    Gives every opportunity a trace id and appends its events to a JSON lines log from a background thread :
+    one "decided" line with the snapshot and the transaction, then one line per status change. Lines of the
+    same trace are merged back by read_traces. The latest traces are also kept in memory for summary().
+    """
+    def __init__(self, path: str, max_queue: int = 1024, keep: int = 10000):
+        self.path = path
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.traces = deque(maxlen=keep)
+        self.dropped = 0
+
+        self._thread = threading.Thread(target=self._run, name="tracer", daemon=True)
+        self._thread.start()
+
+    def start(self, snapshot: Snapshot, transaction) -> Trace:
+        """ Trace of the transaction chosen now from snapshot """
+        trace = Trace(uuid.uuid4().hex[:16], snapshot, time.time())
+        self.traces.append(trace)
+        self._append({"id": trace.trace_id, "event": "decided", "height": snapshot.height,
+                      "fetch_started": snapshot.fetch_started, "fetched": snapshot.fetched, "decided": trace.decided,
+                      "cycle": transaction.cycle, "pools": [str(pool.idx) for pool in transaction.pools],
+                      "dollars_delta": transaction.dollars_delta})
+        return trace
+
+    def submitted(self, trace: Trace, txhash: Optional[str]):
+        """ send_cmd returned, txhash is None if the transaction was rejected """
+        trace.submitted = time.time()
+        trace.txhash = txhash
+        trace.status = "submitted" if txhash else "rejected"
+        self._append({"id": trace.trace_id, "event": trace.status, "submitted": trace.submitted, "txhash": txhash})
+
+    def finished(self, trace: Trace, code: Optional[int], height: Optional[int] = None):
+        """
+        Result of the transaction once it is in a block, code is None if it could not be looked up
+        :param height: block the transaction is in
+        """
+        trace.code = code
+        trace.included_height = height
+        if code is None:
+            trace.status = "unknown"
+        else:
+            trace.status = "included" if code == 0 else "failed"
+        self._append({"id": trace.trace_id, "event": trace.status, "code": code, "height": height,
+                      "at": time.time()})
+
+    def summary(self) -> dict:
+        return summarize(list(self.traces))
+
+    def flush(self):
+        self.queue.join()
+
+    def _append(self, line: dict):
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            line = self.queue.get()
+            try:
+                os.makedirs(os.path.split(self.path)[0], exist_ok=True)
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(line, separators=(",", ":")) + "\n")
+            except Exception as e:
+                logger.warning(f'Trace {line["id"]} could not be written : {e}')
+            finally:
+                self.queue.task_done()
+
+
+def read_traces(path: str) -> List[Trace]:
+    """ Traces of a log written by Tracer, oldest first """
+    traces: Dict[str, Trace] = {}
+    if not os.path.exists(path):
+        return []
+
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event["event"] == "decided":
+                snapshot = Snapshot(event.get("height"), event["fetch_started"], event["fetched"])
+                traces[event["id"]] = Trace(event["id"], snapshot, event["decided"])
+                continue
+
+            trace = traces.get(event["id"])
+            if trace is None:
+                continue
+            trace.status = event["event"]
+            if "submitted" in event:
+                trace.submitted, trace.txhash = event["submitted"], event["txhash"]
+            if "code" in event:
+                trace.code, trace.included_height = event["code"], event.get("height")
+
+    return list(traces.values())
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if len(values) == 0:
+        return {}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"p50": float(p50), "p90": float(p90), "p99": float(p99), "max": float(np.max(values))}
+
+
+def summarize(traces: List[Trace]) -> dict:
+    """
+    Data age and decision latency percentiles of the traces, in seconds, blocks from the snapshot to the
+    inclusion percentiles, and their count per status
+    """
+    statuses: Dict[str, int] = {}
+    for trace in traces:
+        statuses[trace.status] = statuses.get(trace.status, 0) + 1
+
+    submitted = [trace for trace in traces if trace.submitted is not None]
+    blocks = [trace.blocks_to_inclusion for trace in traces if trace.blocks_to_inclusion is not None]
+    return {"traces": len(traces), "statuses": statuses,
+            "data_age": _percentiles([trace.data_age for trace in traces]),
+            "decision_latency": _percentiles([trace.decision_latency for trace in traces]),
+            "submission_latency": _percentiles([trace.submitted - trace.decided for trace in submitted]),
+            "blocks_to_inclusion": _percentiles(blocks)}
+
+
+def trace_log_path(platform: str, directory: Optional[str] = None) -> str:
+    """
+    :param directory: directory of the trace logs, input_data/traces by default
+    """
+    if directory is None:
+        directory = os.path.join(script_dir, "../input_data/traces")
+    return os.path.join(directory, f"{platform}.jsonl")